@@ -0,0 +1,371 @@
+# media_bundler/benchmark.py
+
+"""
+Benchmarks for the bundling pipeline.
+
+make_corpus() writes a reproducible synthetic corpus of JavaScript, CSS and PNG
+icons, and run_benchmarks() times each stage of the pipeline on it, from the
+minifiers and packers to a full bundle_media run.  Each benchmark reports its
+best time over a few runs and the throughput that gives.  Results are plain
+dicts that can be saved as JSON and compared with a stored baseline by
+compare_results().  The benchmark_bundler command ties it all together.
+
+PNG optimization is turned off while benchmarking.  pngcrush runs outside of
+Python, and either optimizer would dwarf the rest of sprite building.
+"""
+
+from __future__ import with_statement
+
+from contextlib import contextmanager
+import os
+import platform
+import random
+import time
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from media_bundler.conf import bundler_settings
+from media_bundler import bundler
+from media_bundler import versioning
+from media_bundler.bin_packing import PACKERS, sheet_width
+from media_bundler.cssmin import minify_css
+from media_bundler.jsmin import jsmin
+from media_bundler.pngtools import read_png_size
+
+
+RESULTS_FORMAT = 1
+
+# Benchmarks fail when their throughput drops by more than this fraction of the
+# baseline's.
+DEFAULT_THRESHOLD = 0.1
+
+# Functions per generated script, and rules per generated stylesheet.
+JS_FUNCTIONS = 200
+CSS_RULES = 200
+
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf",
+         "hotel", "india", "juliet", "kilo", "lima", "mike", "november")
+
+
+def _make_js(rng):
+    parts = ["/*\n * Generated by media_bundler.benchmark.\n */\n\n"]
+    for _ in xrange(JS_FUNCTIONS):
+        name = "%s_%x" % (rng.choice(WORDS), rng.getrandbits(24))
+        parts.append(
+            "// Combine %s with its arguments.\n"
+            "function %s(a, b) {\n"
+            "    var label = \"%s\";  /* Shown to the user. */\n"
+            "    if (a > b && b != null) {\n"
+            "        return a + b * %d;\n"
+            "    }\n"
+            "    return label.replace(/%s+/g, '-') + a;\n"
+            "}\n\n" % (name, name, " ".join(rng.sample(WORDS, 4)),
+                       rng.randrange(1000), rng.choice(WORDS)))
+    return "".join(parts)
+
+
+def _make_css(rng, icons):
+    parts = ["/* Generated by media_bundler.benchmark. */\n\n"]
+    for i in xrange(CSS_RULES):
+        selector = ".%s-%x" % (rng.choice(WORDS), rng.getrandbits(24))
+        rule = ("%s a:hover,\n%s > span {\n"
+                "    color: #%06x;\n"
+                "    margin: 0px %dpx 0px %dpx;\n"
+                "    background: url(\"../images/%s\") no-repeat;\n"
+                "    color: #%06x;\n"
+                "}\n\n" % (selector, selector, rng.getrandbits(24),
+                           rng.randrange(10), rng.randrange(10),
+                           rng.choice(icons), rng.getrandbits(24)))
+        if i % 10 == 0:
+            rule = "@media screen and (max-width: %dpx) {\n%s}\n\n" % (
+                rng.randrange(300, 1200), rule)
+        parts.append(rule)
+    return "".join(parts)
+
+
+def _make_icon(Image, rng, path):
+    size = (rng.randrange(8, 49), rng.randrange(8, 49))
+    icon = Image.new("RGBA", size)
+    for _ in xrange(3):
+        left = rng.randrange(size[0])
+        top = rng.randrange(size[1])
+        box = (left, top, rng.randrange(left, size[0]) + 1,
+               rng.randrange(top, size[1]) + 1)
+        icon.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256),
+                    rng.choice((128, 255))), box)
+    icon.save(path, "PNG")
+
+
+class Corpus(object):
+
+    """A synthetic set of sources, laid out like a project's media."""
+
+    def __init__(self, root, js_files, css_files, icons):
+        self.root = root
+        self.js_files = js_files
+        self.css_files = css_files
+        self.icons = icons
+
+    def get_dir(self, kind):
+        return os.path.join(self.root, kind)
+
+    def get_url(self, kind):
+        return "/media/%s/" % kind
+
+    def get_bundle_dicts(self):
+        """Return MEDIA_BUNDLES for the corpus: one bundle of each type."""
+        sprite_css = "sprites.css"
+        return (
+            {"type": "javascript", "name": "bench_scripts", "minify": True,
+             "path": self.get_dir("scripts"), "url": self.get_url("scripts"),
+             "files": self.js_files},
+            {"type": "css", "name": "bench_styles", "minify": True,
+             "path": self.get_dir("styles"), "url": self.get_url("styles"),
+             "files": self.css_files + [sprite_css]},
+            {"type": "png-sprite", "name": "bench_sprites",
+             "path": self.get_dir("images"), "url": self.get_url("images"),
+             "css_file": os.path.join(self.get_dir("styles"), sprite_css),
+             "files": self.icons},
+        )
+
+    def get_bundles(self):
+        return [bundler.Bundle.from_dict(attrs)
+                for attrs in self.get_bundle_dicts()]
+
+    def get_paths(self, kind, files):
+        return [os.path.join(self.get_dir(kind), f) for f in files]
+
+    def read(self, kind, files):
+        contents = []
+        for path in self.get_paths(kind, files):
+            with open(path) as input:
+                contents.append(input.read())
+        return "".join(contents)
+
+    def get_size(self):
+        """Return the total size of the sources in bytes."""
+        paths = (self.get_paths("scripts", self.js_files) +
+                 self.get_paths("styles", self.css_files) +
+                 self.get_paths("images", self.icons))
+        return sum(os.path.getsize(path) for path in paths)
+
+
+def make_corpus(root, js_files=20, css_files=20, icons=200, seed=0):
+    """Write a synthetic corpus under root and return it.
+
+    The same arguments always produce the same files.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+    rng = random.Random(seed)
+    corpus = Corpus(root,
+                    ["script%03d.js" % i for i in xrange(js_files)],
+                    ["style%03d.css" % i for i in xrange(css_files)],
+                    ["icon%04d.png" % i for i in xrange(icons)])
+    for kind in ("scripts", "styles", "images"):
+        os.makedirs(corpus.get_dir(kind))
+    for path in corpus.get_paths("images", corpus.icons):
+        _make_icon(Image, rng, path)
+    for path in corpus.get_paths("scripts", corpus.js_files):
+        with open(path, "w") as output:
+            output.write(_make_js(rng))
+    for path in corpus.get_paths("styles", corpus.css_files):
+        with open(path, "w") as output:
+            output.write(_make_css(rng, corpus.icons))
+    return corpus
+
+
+@contextmanager
+def isolated_settings(**values):
+    """Override bundler settings, and the bundle and version caches that
+    depend on them, restoring everything afterwards."""
+    saved_settings = dict((name, getattr(bundler_settings, name))
+                          for name in values)
+    saved_bundles = bundler._bundles
+    saved_versions = (versioning._snapshot, versioning._snapshot_mtime,
+                      versioning._next_check)
+    for (name, value) in values.iteritems():
+        setattr(bundler_settings, name, value)
+    bundler._bundles = None
+    versioning._snapshot = None
+    try:
+        yield
+    finally:
+        for (name, value) in saved_settings.iteritems():
+            setattr(bundler_settings, name, value)
+        bundler._bundles = saved_bundles
+        (versioning._snapshot, versioning._snapshot_mtime,
+         versioning._next_check) = saved_versions
+
+
+# Each benchmark takes the corpus and returns a function to time, how much
+# work one call does, and the unit of that work.
+
+def bench_jsmin(corpus):
+    js = corpus.read("scripts", corpus.js_files)
+    return (lambda: jsmin(js), len(js), "bytes")
+
+
+def bench_minify_css(corpus):
+    css = corpus.read("styles", corpus.css_files)
+    return (lambda: minify_css(css), len(css), "bytes")
+
+
+def make_packer_bench(packer):
+    def bench_packer(corpus):
+        boxes = [bundler.ImageBox(read_png_size(path), path) for path
+                 in corpus.get_paths("images", corpus.icons)]
+        width = sheet_width(boxes)
+        return (lambda: packer(boxes, width), len(boxes), "boxes")
+    return bench_packer
+
+
+def bench_sprite(corpus):
+    bundle = corpus.get_bundles()[2]
+    def compose():
+        # Start from scratch every time instead of reusing the last layout.
+        if os.path.exists(bundle.get_layout_path()):
+            os.remove(bundle.get_layout_path())
+        bundle.make_bundle(None)
+    return (compose, len(bundle.files), "images")
+
+
+def make_versioner_bench(versioner_name):
+    def bench_versioner(corpus):
+        bundle = corpus.get_bundles()[0]
+        bundle.make_bundle(None)
+        versioner = versioning.VERSIONERS[versioner_name]()
+        if versioner_name == "mtime":
+            amount = (len(bundle.files), "files")
+        else:
+            amount = (os.path.getsize(bundle.get_bundle_path()), "bytes")
+        return ((lambda: versioner.get_version(bundle)),) + amount
+    return bench_versioner
+
+
+def bench_bundle_media(corpus):
+    from django.core.management import call_command
+    def build():
+        with isolated_settings(
+                MEDIA_BUNDLES=corpus.get_bundle_dicts(),
+                BUNDLE_VERSION_FILE=os.path.join(corpus.root, "versions.json"),
+                BUNDLE_MANIFEST_FILE=None):
+            call_command("bundle_media", force=True, verbosity=0)
+    return (build, corpus.get_size(), "bytes")
+
+
+BENCHMARKS = (
+    ("jsmin", bench_jsmin),
+    ("minify_css", bench_minify_css),
+    ("pack_boxes", make_packer_bench(PACKERS["shelf"])),
+    ("pack_boxes_skyline", make_packer_bench(PACKERS["skyline"])),
+    ("pack_boxes_maxrects", make_packer_bench(PACKERS["maxrects"])),
+    ("sprite", bench_sprite),
+    ("sha1_versioning", make_versioner_bench("sha1")),
+    ("md5_versioning", make_versioner_bench("md5")),
+    ("mtime_versioning", make_versioner_bench("mtime")),
+    ("bundle_media", bench_bundle_media),
+)
+
+
+# Fast benchmarks are called in a loop until a run takes at least this many
+# seconds, so timer resolution and noise don't swamp them.
+MIN_RUN_TIME = 0.1
+
+
+def time_benchmark(func, repeat=3):
+    """Time func repeat times and return the best and mean times per call."""
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    number = 1
+    if elapsed < MIN_RUN_TIME:
+        number = int(MIN_RUN_TIME / max(elapsed, 1e-6)) + 1
+    times = []
+    for _ in xrange(repeat):
+        start = time.time()
+        for _ in xrange(number):
+            func()
+        times.append((time.time() - start) / number)
+    return (min(times), sum(times) / len(times))
+
+
+def run_benchmarks(corpus, names=None, repeat=3, callback=None):
+    """Run the named benchmarks, or all of them, and return the results.
+
+    callback, if given, is called with each benchmark's name and result as
+    soon as it finishes.
+    """
+    results = {}
+    with isolated_settings(BUNDLE_PNG_OPTIMIZER=None,
+                           BUNDLE_VERSION_FILE=None):
+        for (name, bench) in BENCHMARKS:
+            if names and name not in names:
+                continue
+            (func, amount, unit) = bench(corpus)
+            (best, mean) = time_benchmark(func, repeat)
+            results[name] = {
+                "seconds": best,
+                "mean_seconds": mean,
+                "amount": amount,
+                "unit": unit,
+                "throughput": amount / best if best else None,
+            }
+            if callback:
+                callback(name, results[name])
+    return {
+        "format": RESULTS_FORMAT,
+        "python": platform.python_version(),
+        "corpus": {
+            "js_files": len(corpus.js_files),
+            "css_files": len(corpus.css_files),
+            "icons": len(corpus.icons),
+            "bytes": corpus.get_size(),
+        },
+        "repeat": repeat,
+        "benchmarks": results,
+    }
+
+
+def save_results(results, path):
+    with open(path, "w") as output:
+        json.dump(results, output, indent=1, sort_keys=True,
+                  separators=(',', ': '))
+        output.write("\n")
+
+
+def load_results(path):
+    with open(path) as input:
+        results = json.load(input)
+    if results.get("format") != RESULTS_FORMAT:
+        raise ValueError("%s is not a benchmark results file." % path)
+    return results
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare results with a baseline.
+
+    Returns a list of (name, baseline throughput, throughput, change,
+    regressed) tuples for the benchmarks in both, where change is the
+    relative change in throughput and regressed says whether it dropped by
+    more than threshold.  Throughput is only comparable between runs on the
+    same corpus.
+    """
+    if results["corpus"] != baseline["corpus"]:
+        raise ValueError("The results and the baseline are for different "
+                         "corpora.")
+    comparisons = []
+    old_results = baseline["benchmarks"]
+    for (name, result) in sorted(results["benchmarks"].iteritems()):
+        old = old_results.get(name)
+        if not old or not old["throughput"] or not result["throughput"]:
+            continue
+        change = result["throughput"] / old["throughput"] - 1
+        comparisons.append((name, old["throughput"], result["throughput"],
+                            change, change < -threshold))
+    return comparisons
@@ -1,6 +1,19 @@
 # media_bundler/bundle.py
 
-"""A simple 2D bin packing algorithm for making sprites."""
+"""
+2D bin packing algorithms for making sprites.
+
+Every packer takes a list of boxes and a maximum width, and returns a tuple of
+the width and height of the packed rectangle, and a list of (left, top, box)
+placements.  The available packers are listed in PACKERS:
+
+- shelf: fills horizontal strips, tallest boxes first.  Simple, but wastes
+  space when box heights vary.
+- skyline: places each box as low as possible on the skyline formed by the
+  boxes placed so far.
+- maxrects: keeps every maximal free rectangle and places each box in the one
+  where it ends up lowest.  Usually the densest, but the slowest.
+"""
 
 import math
 
@@ -9,15 +22,17 @@ class Box(object):
 
     """A simple 2D rectangle with width and height attributes.  Immutable."""
 
+    __slots__ = ("_width", "_height")
+
     def __init__(self, width, height):
-        self.__width = width
-        self.__height = height
+        self._width = width
+        self._height = height
 
     @property
-    def width(self): return self.__width
+    def width(self): return self._width
 
     @property
-    def height(self): return self.__height
+    def height(self): return self._height
 
     def __eq__(self, other):
         return self.width == other.width and self.height == other.height
@@ -62,29 +77,392 @@ def pack_boxes(boxes, max_width=None):
     return (max_width, y_off, packing)
 
 
+def _default_width(boxes):
+    total_area = sum(box.width * box.height for box in boxes)
+    return max(max(box.width for box in boxes), int(math.sqrt(total_area)))
+
+
+def _placement_order(boxes):
+    # Big boxes are the hardest to fit, so they go first.
+    return sorted(boxes, key=lambda box: (-box.height, -box.width))
+
+
+def pack_boxes_skyline(boxes, max_width=None):
+    """Packs boxes with the skyline bottom-left heuristic.
+
+    The skyline is a list of [left, top, width] segments covering the full
+    width.  Each box goes where its top edge would be lowest, leftmost on
+    ties, resting on the highest segment beneath it.
+    """
+    if max_width is None:
+        max_width = _default_width(boxes)
+    skyline = [[0, 0, max_width]]
+    packing = []
+    height = 0
+    for box in _placement_order(boxes):
+        best = None
+        for i in xrange(len(skyline)):
+            left = skyline[i][0]
+            if left + box.width > max_width:
+                break
+            # Find how high the box must sit to clear every segment under it.
+            top = 0
+            j = i
+            right = left + box.width
+            while skyline[j][0] < right:
+                top = max(top, skyline[j][1])
+                j += 1
+                if j == len(skyline):
+                    break
+            if best is None or (top, left) < best[:2]:
+                best = (top, left, i)
+        (top, left, i) = best
+        packing.append((left, top, box))
+        height = max(height, top + box.height)
+        _raise_skyline(skyline, i, left, box.width, top + box.height)
+    return (max_width, height, packing)
+
+
+def _raise_skyline(skyline, i, left, width, top):
+    """Raise the skyline to top over [left, left + width)."""
+    right = left + width
+    j = i
+    # Drop the segments the box covers completely, and trim the last one.
+    while j < len(skyline):
+        (seg_left, seg_top, seg_width) = skyline[j]
+        seg_right = seg_left + seg_width
+        if seg_right <= right:
+            j += 1
+        else:
+            if seg_left < right:
+                skyline[j] = [right, seg_top, seg_right - right]
+            break
+    skyline[i:j] = [[left, top, width]]
+    # Merge neighbouring segments at the same height.
+    k = max(i - 1, 0)
+    while k < len(skyline) - 1 and k <= i + 1:
+        if skyline[k][1] == skyline[k + 1][1]:
+            skyline[k][2] += skyline[k + 1][2]
+            del skyline[k + 1]
+        else:
+            k += 1
+
+
+def pack_boxes_maxrects(boxes, max_width=None):
+    """Packs boxes with the MaxRects bottom-left heuristic.
+
+    We track every maximal free rectangle as (left, top, right, bottom).  The
+    height is unbounded, which we model with a free rectangle as tall as all
+    the boxes stacked.  Each box goes in the free rectangle where its bottom
+    edge would be highest up, leftmost on ties.
+    """
+    if max_width is None:
+        max_width = _default_width(boxes)
+    unbounded = sum(box.height for box in boxes) + 1
+    free = [(0, 0, max_width, unbounded)]
+    packing = []
+    height = 0
+    for box in _placement_order(boxes):
+        best = None
+        for (left, top, right, bottom) in free:
+            if right - left >= box.width and bottom - top >= box.height:
+                score = (top + box.height, left)
+                if best is None or score < best:
+                    best = score
+        (bottom, left) = best
+        top = bottom - box.height
+        packing.append((left, top, box))
+        height = max(height, bottom)
+        free = _split_free_rects(free, (left, top, left + box.width, bottom))
+    return (max_width, height, packing)
+
+
+def _split_free_rects(free, used):
+    """Remove the used rectangle from the free ones, keeping them maximal."""
+    (u_left, u_top, u_right, u_bottom) = used
+    split = []
+    for rect in free:
+        (left, top, right, bottom) = rect
+        if (u_left >= right or u_right <= left or
+            u_top >= bottom or u_bottom <= top):
+            split.append(rect)
+            continue
+        if u_left > left:
+            split.append((left, top, u_left, bottom))
+        if u_right < right:
+            split.append((u_right, top, right, bottom))
+        if u_top > top:
+            split.append((left, top, right, u_top))
+        if u_bottom < bottom:
+            split.append((left, u_bottom, right, bottom))
+    # Drop rectangles contained in other ones.  Sorting by area means we only
+    # have to look for containers among the bigger rectangles.
+    split = sorted(set(split), key=_area, reverse=True)
+    maximal = []
+    for rect in split:
+        (left, top, right, bottom) = rect
+        for (o_left, o_top, o_right, o_bottom) in maximal:
+            if (o_left <= left and o_top <= top and
+                right <= o_right and bottom <= o_bottom):
+                break
+        else:
+            maximal.append(rect)
+    return maximal
+
+
+def _area((left, top, right, bottom)):
+    return (right - left) * (bottom - top)
+
+
+PACKERS = {
+    'shelf': pack_boxes,
+    'skyline': pack_boxes_skyline,
+    'maxrects': pack_boxes_maxrects,
+}
+
+
+def sheet_width(boxes):
+    """Pick a width so that a sheet is squarish and a multiple of 16, and so no
+    box is too wide to fit."""
+    total_area = sum(box.width * box.height for box in boxes)
+    return max(max(box.width for box in boxes),
+               (int(math.sqrt(total_area)) // 16 + 1) * 16)
+
+
+def pack_sheets(boxes, packer=pack_boxes, max_width=None, max_height=None,
+                max_area=None):
+    """Pack boxes into as few sheets as the size limits allow.
+
+    Each sheet is packed from the boxes that are left, and the boxes that end
+    up below the height limit move on to the next sheet.  Without limits,
+    everything goes in one sheet.  Returns a list of (width, height, packing)
+    tuples, and raises ValueError if a box can't fit in any sheet.
+    """
+    for box in boxes:
+        if ((max_width and box.width > max_width) or
+                (max_height and box.height > max_height) or
+                (max_area and box.width * box.height > max_area)):
+            raise ValueError("%r is too big for a sheet." % (box,))
+    sheets = []
+    remaining = list(boxes)
+    while remaining:
+        width = sheet_width(remaining)
+        if max_width:
+            width = min(width, max_width)
+        height_limit = max_height
+        if max_area:
+            tallest = max(box.height for box in remaining)
+            if max_area // width < tallest:
+                # Narrow the sheet so the tallest box fits, and leave boxes
+                # that are now too wide for a later sheet.
+                width = max_area // tallest
+            height_limit = min(height_limit or max_area, max_area // width)
+        candidates = [box for box in remaining if box.width <= width]
+        (_, height, packing) = packer(candidates, width)
+        if height_limit and height > height_limit:
+            packing = [(left, top, box) for (left, top, box) in packing
+                       if top + box.height <= height_limit]
+            height = max(top + box.height for (_, top, box) in packing)
+        placed = set(id(box) for (_, _, box) in packing)
+        remaining = [box for box in remaining if id(box) not in placed]
+        sheets.append((width, height, packing))
+    return sheets
+
+
+def packing_efficiency(width, height, packing):
+    """Return the fraction of the packed rectangle covered by boxes."""
+    if not width or not height:
+        return 1.0
+    used = sum(box.width * box.height for (_, _, box) in packing)
+    return float(used) / (width * height)
+
+
+def sheets_efficiency(sheets):
+    """Return the fraction of a list of (width, height, packing) sheets covered
+    by boxes."""
+    area = sum(width * height for (width, height, _) in sheets)
+    if not area:
+        return 1.0
+    used = sum(box.width * box.height
+               for (_, _, packing) in sheets for (_, _, box) in packing)
+    return float(used) / area
+
+
+class PackingError(Exception):
+
+    """Raised when a packing has overlapping or out of bounds boxes."""
+
+
 def boxes_overlap((x1, y1, box1), (x2, y2, box2)):
-    """Return True if the two boxes at (x1, y1) and (x2, y2) overlap."""
-    left1 = x1
-    top1 = y1
-    right1 = x1 + box1.width
-    bottom1 = y1 + box1.height
-    left2 = x2
-    top2 = y2
-    right2 = x2 + box2.width
-    bottom2 = y2 + box2.height
-    return ((left2 <= left1  <  right2 and top2 <= top1    <  bottom2) or
-            (left2 <  right1 <= right2 and top2 <= top1    <  bottom2) or
-            (left2 <= left1  <  right2 and top2 <  bottom1 <= bottom2) or
-            (left2 <  right1 <= right2 and top2 <  bottom1 <= bottom2))
+    """Return True if the two boxes at (x1, y1) and (x2, y2) overlap.
+
+    Boxes that only touch don't overlap, and neither do empty boxes.
+    """
+    if not (box1.width and box1.height and box2.width and box2.height):
+        return False
+    return (x1 < x2 + box2.width and x2 < x1 + box1.width and
+            y1 < y2 + box2.height and y2 < y1 + box1.height)
+
+
+class _Node(object):
+
+    __slots__ = ("key", "value", "left", "right", "height")
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.left = self.right = None
+        self.height = 1
+
+
+def _height(node):
+    return node.height if node else 0
+
+
+def _rotate(node, left):
+    """Rotate the subtree at node to the left or right, and return its root."""
+    if left:
+        (pivot, node.right) = (node.right, node.right.left)
+        pivot.left = node
+    else:
+        (pivot, node.left) = (node.left, node.left.right)
+        pivot.right = node
+    node.height = 1 + max(_height(node.left), _height(node.right))
+    pivot.height = 1 + max(_height(pivot.left), _height(pivot.right))
+    return pivot
+
+
+def _rebalance(node):
+    node.height = 1 + max(_height(node.left), _height(node.right))
+    balance = _height(node.left) - _height(node.right)
+    if balance > 1:
+        if _height(node.left.left) < _height(node.left.right):
+            node.left = _rotate(node.left, True)
+        return _rotate(node, False)
+    if balance < -1:
+        if _height(node.right.right) < _height(node.right.left):
+            node.right = _rotate(node.right, False)
+        return _rotate(node, True)
+    return node
+
+
+def _insert(node, key, value):
+    if node is None:
+        return _Node(key, value)
+    if key < node.key:
+        node.left = _insert(node.left, key, value)
+    else:
+        node.right = _insert(node.right, key, value)
+    return _rebalance(node)
+
+
+def _remove(node, key):
+    if node is None:
+        raise KeyError(key)
+    if key < node.key:
+        node.left = _remove(node.left, key)
+    elif key > node.key:
+        node.right = _remove(node.right, key)
+    elif node.left is None:
+        return node.right
+    elif node.right is None:
+        return node.left
+    else:
+        successor = node.right
+        while successor.left is not None:
+            successor = successor.left
+        (node.key, node.value) = (successor.key, successor.value)
+        node.right = _remove(node.right, successor.key)
+    return _rebalance(node)
+
+
+class _AvlTree(object):
+
+    """A sorted map kept in an AVL tree.
+
+    Inserts, removals and neighbour lookups all take O(log n).
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def insert(self, key, value):
+        self.root = _insert(self.root, key, value)
+
+    def remove(self, key):
+        self.root = _remove(self.root, key)
+
+    def ceiling(self, key):
+        """Return the value with the smallest key >= key, or None."""
+        (node, found) = (self.root, None)
+        while node is not None:
+            if node.key >= key:
+                (node, found) = (node.left, node)
+            else:
+                node = node.right
+        return found and found.value
+
+    def lower(self, key):
+        """Return the value with the largest key < key, or None."""
+        (node, found) = (self.root, None)
+        while node is not None:
+            if node.key < key:
+                (node, found) = (node.right, node)
+            else:
+                node = node.left
+        return found and found.value
+
+
+def find_overlap(packing):
+    """Return a pair of overlapping placements in a packing, or None.
+
+    This sweeps a vertical line from left to right, keeping the boxes it
+    crosses in an AVL tree keyed by their tops.  Until an overlap is found,
+    their vertical extents are disjoint, so a box entering the sweep can only
+    overlap the extents just above and below it.  Inserting, removing and
+    finding those neighbours each take O(log n), so the whole check takes
+    O(n log n) time.
+    """
+    events = []
+    for placement in packing:
+        (left, top, box) = placement
+        if not (box.width and box.height):
+            continue
+        # At the same x, boxes leave the sweep before others enter it, since
+        # boxes that only touch don't overlap.
+        events.append((left + box.width, 0, top, placement))
+        events.append((left, 1, top, placement))
+    events.sort(key=lambda event: event[:3])
+    active = _AvlTree()
+    for (_, entering, top, placement) in events:
+        if not entering:
+            active.remove(top)
+            continue
+        below = active.ceiling(top)
+        if below and below[1] < top + placement[2].height:
+            return (below, placement)
+        above = active.lower(top)
+        if above and above[1] + above[2].height > top:
+            return (above, placement)
+        active.insert(top, placement)
+    return None
 
 
 def check_no_overlap(packing):
     """Return True if none of the boxes in the packing overlap."""
-    # TODO(rnk): It would be great if we could avoid comparing each box twice.
-    for left in packing:
-        for right in packing:
-            if left == right:
-                continue
-            if boxes_overlap(left, right):
-                return False
-    return True
+    return find_overlap(packing) is None
+
+
+def check_packing(width, height, packing):
+    """Raise PackingError unless every box is inside the rectangle and no two
+    boxes overlap."""
+    for (left, top, box) in packing:
+        if (left < 0 or top < 0 or left + box.width > width or
+                top + box.height > height):
+            raise PackingError("%r at (%d, %d) is outside the %dx%d packing."
+                               % (box, left, top, width, height))
+    overlap = find_overlap(packing)
+    if overlap:
+        ((left1, top1, box1), (left2, top2, box2)) = overlap
+        raise PackingError("%r at (%d, %d) overlaps %r at (%d, %d)." %
+                           (box1, left1, top1, box2, left2, top2))
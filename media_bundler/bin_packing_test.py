@@ -2,10 +2,14 @@
 
 """Tests for the bin packing algorithm."""
 
+import math
 import random
 import unittest
 
-from bin_packing import Box, pack_boxes, check_no_overlap
+from bin_packing import (Box, PACKERS, PackingError, boxes_overlap,
+                         check_no_overlap, check_packing, pack_boxes,
+                         pack_sheets, packing_efficiency)
+from bin_packing import _AvlTree, _height
 
 
 class BinPackingTest(unittest.TestCase):
@@ -20,6 +24,66 @@ class BinPackingTest(unittest.TestCase):
         packing = [(0, 0, Box(2, 2)), (2, 0, Box(2, 2))]
         self.assert_(check_no_overlap(packing))
 
+    def testCheckCrossOverlap(self):
+        # A wide box and a tall box crossing in a plus sign.  Neither has a
+        # corner inside the other.
+        packing = [(0, 2, Box(6, 2)), (2, 0, Box(2, 6))]
+        self.assert_(boxes_overlap(*packing))
+        self.assert_(not check_no_overlap(packing))
+
+    def testCheckSamePlace(self):
+        packing = [(3, 3, Box(2, 2)), (3, 3, Box(2, 2))]
+        self.assert_(not check_no_overlap(packing))
+
+    def testCheckMatchesPairwise(self):
+        rng = random.Random(3)
+        for _ in xrange(300):
+            packing = [(rng.randrange(20), rng.randrange(20),
+                        Box(rng.randrange(0, 8), rng.randrange(0, 8)))
+                       for _ in xrange(rng.randrange(1, 8))]
+            pairwise = not any(boxes_overlap(packing[i], packing[j])
+                               for i in xrange(len(packing))
+                               for j in xrange(i))
+            self.assertEqual(check_no_overlap(packing), pairwise, packing)
+
+    def testCheckLargePackings(self):
+        rng = random.Random(11)
+        boxes = [Box(rng.randrange(1, 33), rng.randrange(1, 33))
+                 for _ in xrange(5000)]
+        for (name, packer) in sorted(PACKERS.items()):
+            (width, height, packing) = packer(boxes, 1024)
+            check_packing(width, height, packing)
+            # Move one box onto its neighbour and make sure it's caught.
+            (left, top, box) = packing[2500]
+            packing[2500] = (left + 1, top + 1, box)
+            self.assert_(not check_no_overlap(packing), name)
+
+    def testAvlTree(self):
+        rng = random.Random(5)
+        tree = _AvlTree()
+        keys = set()
+        for _ in xrange(3000):
+            if keys and rng.random() < 0.4:
+                key = rng.choice(sorted(keys))
+                keys.remove(key)
+                tree.remove(key)
+            else:
+                key = rng.randrange(10000)
+                if key not in keys:
+                    keys.add(key)
+                    tree.insert(key, key)
+            probe = rng.randrange(10000)
+            self.assertEqual(tree.ceiling(probe),
+                             min([k for k in keys if k >= probe] or [None]))
+            self.assertEqual(tree.lower(probe),
+                             max([k for k in keys if k < probe] or [None]))
+            self.assert_(_height(tree.root) <=
+                         1.45 * math.log(len(keys) + 2, 2))
+
+    def testCheckPackingBounds(self):
+        self.assertRaises(PackingError, check_packing, 4, 4,
+                          [(2, 0, Box(3, 1))])
+
     def testPackSingle(self):
         boxes = [Box(1, 1)]
         packing = [(0, 0, Box(1, 1))]
@@ -132,6 +196,62 @@ class BinPackingTest(unittest.TestCase):
             (_, _, actual) = pack_boxes(boxes)
             self.assert_(check_no_overlap(actual))
 
+    def testPackersPlaceEveryBox(self):
+        rng = random.Random(42)
+        for (name, packer) in sorted(PACKERS.items()):
+            for _ in xrange(3):
+                boxes = [Box(rng.randrange(1, 40), rng.randrange(1, 40))
+                         for _ in xrange(100)]
+                (width, height, actual) = packer(boxes, 120)
+                self.assertEqual(width, 120)
+                self.assertEqual(sorted(id(box) for (_, _, box) in actual),
+                                 sorted(id(box) for box in boxes), name)
+                self.assert_(check_no_overlap(actual), name)
+                for (left, top, box) in actual:
+                    self.assert_(0 <= left and left + box.width <= width)
+                    self.assert_(0 <= top and top + box.height <= height)
+
+    def testDensePackers(self):
+        # AAB
+        # AAC
+        # DE
+        # The shelf packer can't put D and E next to A, but the others can.
+        boxes = [Box(2, 2)] + [Box(1, 1) for _ in xrange(4)]
+        for name in ("skyline", "maxrects"):
+            (width, height, actual) = PACKERS[name](boxes, 4)
+            self.assertEqual(height, 2, name)
+            self.assertEqual(packing_efficiency(width, height, actual), 1.0)
+        (width, height, actual) = PACKERS["shelf"](boxes, 4)
+        self.assertEqual(height, 3)
+
+    def testPackSheetsWithinLimits(self):
+        rng = random.Random(7)
+        boxes = [Box(rng.randrange(1, 40), rng.randrange(1, 40))
+                 for _ in xrange(200)]
+        limits = [(64, None, None), (None, 50, None), (None, None, 3000),
+                  (100, 100, 5000)]
+        for (name, packer) in sorted(PACKERS.items()):
+            for (max_width, max_height, max_area) in limits:
+                sheets = pack_sheets(boxes, packer, max_width, max_height,
+                                     max_area)
+                if max_height or max_area:
+                    self.assert_(len(sheets) > 1)
+                placed = []
+                for (width, height, packing) in sheets:
+                    self.assert_(not max_width or width <= max_width)
+                    self.assert_(not max_height or height <= max_height)
+                    self.assert_(not max_area or width * height <= max_area)
+                    self.assert_(check_no_overlap(packing), name)
+                    for (left, top, box) in packing:
+                        self.assert_(left + box.width <= width)
+                        self.assert_(top + box.height <= height)
+                    placed.extend(id(box) for (_, _, box) in packing)
+                self.assertEqual(sorted(placed),
+                                 sorted(id(box) for box in boxes))
+        self.assertEqual(len(pack_sheets(boxes)), 1)
+        self.assertRaises(ValueError, pack_sheets, [Box(10, 10)], pack_boxes,
+                          None, None, 99)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,376 @@
+# media_bundler/build.py
+
+"""
+Dependency-aware scheduling of bundle builds.
+
+A bundle depends on another bundle if one of its source files is an output of
+the other, for example when a CssBundle includes the CSS file generated by a
+PngSpriteBundle.  The BundleBuilder builds bundles in dependency order, and can
+farm independent bundles out to a pool of worker processes.
+"""
+
+import bisect
+import os
+import Queue
+import sys
+import traceback
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+from media_bundler import bundler
+from media_bundler import staging
+from media_bundler import stats
+from media_bundler import versioning
+from media_bundler.manifest import fingerprint_bundle
+from media_bundler.precompress import (get_gzip_path, precompress,
+                                       remove_precompressed)
+
+
+class CyclicDependencyError(Exception):
+
+    def __init__(self, names):
+        msg = "Bundles have cyclic dependencies: %s" % ", ".join(sorted(names))
+        super(CyclicDependencyError, self).__init__(msg)
+
+
+class SourceError(Exception):
+
+    """Raised when a source file of a bundle can't be read."""
+
+    def __init__(self, name, path, strerror):
+        msg = "Can't read %s, a source of bundle %r: %s" % (path, name,
+                                                           strerror)
+        super(SourceError, self).__init__(msg)
+
+
+class BuildError(Exception):
+
+    """Raised when a bundle fails to build in a worker process."""
+
+    def __init__(self, name, tb):
+        msg = "Building bundle %r failed:\n\n%s" % (name, tb)
+        super(BuildError, self).__init__(msg)
+
+
+def _normpath(path):
+    return os.path.realpath(os.path.normpath(path))
+
+
+def get_dependencies(bundles):
+    """Return a dict mapping each bundle name to the set of names it needs.
+
+    Bundle B needs bundle A if any of B's source files is generated by A.
+    """
+    producers = {}
+    for bundle in bundles:
+        for path in bundle.get_output_paths():
+            producers[_normpath(path)] = bundle.name
+    dependencies = {}
+    for bundle in bundles:
+        needs = set()
+        for path in bundle.get_paths():
+            producer = producers.get(_normpath(path))
+            if producer is not None and producer != bundle.name:
+                needs.add(producer)
+        dependencies[bundle.name] = needs
+    return dependencies
+
+
+def check_acyclic(dependencies):
+    """Raise CyclicDependencyError if the dependency graph has a cycle."""
+    remaining = dict((name, set(needs))
+                     for (name, needs) in dependencies.iteritems())
+    while remaining:
+        ready = [name for (name, needs) in remaining.iteritems() if not needs]
+        if not ready:
+            raise CyclicDependencyError(remaining.keys())
+        for name in ready:
+            del remaining[name]
+        for needs in remaining.itervalues():
+            needs.difference_update(ready)
+
+
+def get_dependents(dependencies, names):
+    """Return names and the names of every bundle that needs them.
+
+    Bundles that need them indirectly, through another bundle, are included.
+    """
+    dependents = {}
+    for (name, needs) in dependencies.iteritems():
+        for need in needs:
+            dependents.setdefault(need, set()).add(name)
+    affected = set(names)
+    queue = list(names)
+    while queue:
+        for other in dependents.get(queue.pop(), ()):
+            if other not in affected:
+                affected.add(other)
+                queue.append(other)
+    return affected
+
+
+def make_versioner(versioner_name):
+    if versioner_name:
+        return versioning.VERSIONERS[versioner_name]()
+    return None
+
+
+def precompress_bundle(bundle, version=None, gzip=True):
+    """Write .gz siblings of a text bundle and its versioned copy.
+
+    Returns the compressed size, or None if the bundle wasn't compressed.
+    Without gzip, any siblings left by earlier builds are removed so they
+    can't be served in place of the new bundle.  Stale siblings are removed
+    from the live directories even in a staged build, since serving the old
+    bundle uncompressed until the new one is published is harmless.
+    """
+    if not bundle.compressible:
+        return None
+    path = bundle.get_bundle_path()
+    versioned_path = None
+    if version and version != bundle.get_bundle_filename():
+        versioned_path = os.path.join(bundle.path, version)
+    gzip_size = None
+    if gzip:
+        with stats.stage("gzip"):
+            gzip_size = precompress(staging.output_path(path))
+    if gzip_size is None:
+        remove_precompressed(path)
+        if versioned_path:
+            remove_precompressed(versioned_path)
+    elif versioned_path:
+        versioning.link_or_copy(
+            get_gzip_path(staging.output_path(path)),
+            get_gzip_path(staging.output_path(versioned_path)))
+    return gzip_size
+
+
+def build_bundle(name, versioner_name=None, gzip=False, profile_dir=None):
+    """Build a single bundle.
+
+    Returns a tuple of a dict of the new versioned filenames, which is empty
+    without versioning and has more than the bundle's own for sprites split
+    over several sheets, the size of the bundle, the size of its .gz sibling,
+    if any, the bundle's build report, and its build stats as a dict.  If
+    profile_dir is set, each stage of the build is profiled into it.
+    """
+    bundle = bundler.get_bundles()[name]
+    versioner = make_versioner(versioner_name)
+    build_stats = stats.BuildStats(name, profile_dir)
+    stats.activate(build_stats)
+    try:
+        build_stats.start()
+        bundle.make_bundle(versioner)
+        versions = {}
+        if versioner:
+            for versioned in bundle.get_versioned_bundles():
+                versions[versioned.name] = \
+                    versioner.versions.get(versioned.name)
+        gzip_size = precompress_bundle(bundle, versions.get(name), gzip)
+        build_stats.finish(
+            bundle.get_input_paths(),
+            [staging.output_path(versioned.get_bundle_path())
+             for versioned in bundle.get_versioned_bundles()])
+    finally:
+        stats.activate(None)
+    size = os.path.getsize(staging.output_path(bundle.get_bundle_path()))
+    return (versions, size, gzip_size, bundle.build_report,
+            build_stats.to_dict())
+
+
+def _build_bundle_in_worker(name, versioner_name, gzip, stage, profile_dir):
+    # Exceptions don't make it back through Pool.apply_async callbacks, so we
+    # send the formatted traceback back to the parent instead.  The stage is
+    # passed along explicitly in case the worker wasn't forked from us.
+    staging.activate(stage)
+    try:
+        return (name, build_bundle(name, versioner_name, gzip, profile_dir),
+                None)
+    except Exception:
+        return (name, None, traceback.format_exc())
+
+
+def _get_result(results):
+    # Queue.get() without a timeout can't be interrupted with Ctrl-C.
+    while True:
+        try:
+            return results.get(True, 1)
+        except Queue.Empty:
+            pass
+
+
+def cpu_count():
+    if multiprocessing is None:
+        return 1
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+class BundleBuilder(object):
+
+    """Builds bundles in dependency order.
+
+    Each bundle is fingerprinted as soon as everything it depends on has been
+    built, and skipped if the build manifest says it is up to date.  With more
+    than one job, independent bundles are built concurrently in a process pool,
+    along with their precompressed .gz siblings if gzip is set.
+    The versions of rebuilt bundles are merged into the versioner's versions in
+    bundle name order, so the result does not depend on scheduling.  Versions
+    of sheets a rebuilt sprite no longer has are dropped and their names
+    collected in removed_versions.
+    The build stats of rebuilt bundles are collected in stats, and if
+    profile_dir is set, every stage of their builds is profiled into it.
+    """
+
+    def __init__(self, bundles, versioner_name=None, manifest=None,
+                 force=False, jobs=1, gzip=False, verbosity=1, stdout=None,
+                 profile_dir=None):
+        self.bundles = dict((bundle.name, bundle) for bundle in bundles)
+        self.dependencies = get_dependencies(bundles)
+        check_acyclic(self.dependencies)
+        self.versioner_name = versioner_name
+        self.versioner = make_versioner(versioner_name)
+        self.manifest = manifest
+        self.force = force
+        if jobs < 1:
+            jobs = cpu_count()
+        if multiprocessing is None:
+            jobs = 1
+        self.jobs = jobs
+        self.gzip = gzip
+        self.verbosity = verbosity
+        self.stdout = stdout or sys.stdout
+        self.profile_dir = profile_dir
+        self.rebuilt = {}
+        self.stats = {}
+        self._fingerprints = {}
+        self._new_versions = {}
+        self.removed_versions = set()
+
+    def write(self, msg, level=1):
+        if self.verbosity >= level:
+            self.stdout.write(msg + "\n")
+
+    def get_rebuild_reason(self, bundle):
+        """Fingerprint a bundle and decide whether it needs rebuilding."""
+        extra = {}
+        if self.versioner_name:
+            extra["versioner"] = self.versioner_name
+        if self.gzip and bundle.compressible:
+            extra["gzip"] = True
+        previous = self.manifest and self.manifest.get(bundle.name)
+        try:
+            fingerprint = fingerprint_bundle(bundle, previous, extra)
+        except (IOError, OSError), e:
+            raise SourceError(bundle.name, e.filename, e.strerror)
+        self._fingerprints[bundle.name] = fingerprint
+        version = self.versioner and self.versioner.versions.get(bundle.name)
+        if self.force:
+            return "forced"
+        elif self.manifest:
+            return self.manifest.rebuild_reason(bundle, fingerprint, version)
+        else:
+            return "no build manifest"
+
+    def run(self):
+        """Build every out of date bundle and return the rebuilt reasons."""
+        waiting = dict((name, set(needs))
+                       for (name, needs) in self.dependencies.iteritems())
+        ready = sorted(name for (name, needs) in waiting.iteritems()
+                       if not needs)
+        for name in ready:
+            del waiting[name]
+        results = Queue.Queue()
+        pool = None
+        if self.jobs > 1 and len(self.bundles) > 1:
+            pool = multiprocessing.Pool(min(self.jobs, len(self.bundles)))
+        in_flight = 0
+        try:
+            while ready or in_flight:
+                while ready:
+                    name = ready.pop(0)
+                    reason = self.get_rebuild_reason(self.bundles[name])
+                    if reason is None:
+                        self.write("Skipped %s: up to date" % name, 2)
+                        self._finish(name, waiting, ready)
+                        continue
+                    self.rebuilt[name] = reason
+                    if pool:
+                        pool.apply_async(_build_bundle_in_worker,
+                                         (name, self.versioner_name,
+                                          self.gzip,
+                                          staging.get_active_stage(),
+                                          self.profile_dir),
+                                         callback=results.put)
+                    else:
+                        result = build_bundle(name, self.versioner_name,
+                                              self.gzip, self.profile_dir)
+                        results.put((name, result, None))
+                    in_flight += 1
+                if in_flight:
+                    (name, result, error) = _get_result(results)
+                    in_flight -= 1
+                    if error:
+                        raise BuildError(name, error)
+                    (versions, size, gzip_size, report, build_stats) = result
+                    self._new_versions[name] = versions
+                    self.stats[name] = build_stats
+                    details = self._format_sizes(name, size, gzip_size)
+                    if report:
+                        details += ", " + report
+                    self.write("Rebuilt %s: %s (%s)" %
+                               (name, self.rebuilt[name], details))
+                    self._finish(name, waiting, ready)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+        self._merge_versions()
+        return self.rebuilt
+
+    def _format_sizes(self, name, size, gzip_size):
+        sizes = "%d bytes" % size
+        if gzip_size is not None:
+            sizes += ", %d gzipped" % gzip_size
+        elif self.gzip and self.bundles[name].compressible:
+            sizes += ", not worth gzipping"
+        return sizes
+
+    def _finish(self, name, waiting, ready):
+        """Mark a bundle as done and queue up the bundles waiting on it."""
+        for (other, needs) in waiting.items():
+            needs.discard(name)
+            if not needs:
+                del waiting[other]
+                bisect.insort(ready, other)
+
+    def _merge_versions(self):
+        for name in sorted(self._new_versions):
+            versions = self._new_versions[name]
+            if self.versioner:
+                for (versioned_name, version) in sorted(versions.iteritems()):
+                    if version:
+                        self.versioner.versions[versioned_name] = version
+                if isinstance(self.bundles[name], bundler.PngSpriteBundle):
+                    self._prune_sheet_versions(name, versions)
+            if self.manifest:
+                self.manifest.record(self.bundles[name],
+                                     self._fingerprints[name],
+                                     versions.get(name))
+
+    def _prune_sheet_versions(self, name, versions):
+        """Drop the versions of sheets a rebuilt sprite no longer has."""
+        prefix = name + "-"
+        all_bundles = bundler.get_bundles()
+        for versioned_name in sorted(self.versioner.versions):
+            if (versioned_name.startswith(prefix) and
+                    versioned_name[len(prefix):].isdigit() and
+                    versioned_name not in versions and
+                    versioned_name not in all_bundles):
+                del self.versioner.versions[versioned_name]
+                self.removed_versions.add(versioned_name)
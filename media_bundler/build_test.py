@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""Tests for scheduling bundle builds."""
+
+from cStringIO import StringIO
+import os
+import unittest
+
+from PIL import Image
+
+from test_support import BundleTestCase
+
+from django.core.management.base import CommandError
+
+from media_bundler import versioning
+
+from media_bundler.build import (BundleBuilder, CyclicDependencyError,
+                                 SourceError, get_dependencies,
+                                 get_dependents)
+from media_bundler.management.commands.bundle_media import Command
+from media_bundler.manifest import BuildManifest
+
+
+class BuilderTestCase(BundleTestCase):
+
+    def make_builder(self, **kwargs):
+        return BundleBuilder(self.bundles.values(), stdout=StringIO(),
+                             **kwargs)
+
+
+class BundleBuilderTest(BuilderTestCase):
+
+    def setUp(self):
+        super(BundleBuilderTest, self).setUp()
+        self.write("a.js", "var a;\n")
+        self.write("a.css", "a { color: red }\n")
+        self.add_bundle(type="javascript", name="scripts", files=["a.js"])
+        self.add_bundle(type="css", name="styles", files=["a.css"])
+        self.manifest = BuildManifest(self.path("manifest.json"))
+
+    def testUnchangedSkipped(self):
+        builder = self.make_builder(manifest=self.manifest)
+        self.assertEqual(builder.run(), {"scripts": "new bundle",
+                                         "styles": "new bundle"})
+        builder = self.make_builder(manifest=self.manifest, verbosity=2)
+        self.assertEqual(builder.run(), {})
+        self.assert_("Skipped scripts: up to date" in
+                     builder.stdout.getvalue())
+        self.write("a.css", "a { color: blue }\n")
+        builder = self.make_builder(manifest=self.manifest)
+        self.assertEqual(builder.run(), {"styles": "changed: a.css"})
+
+    def testForce(self):
+        self.make_builder(manifest=self.manifest).run()
+        builder = self.make_builder(manifest=self.manifest, force=True)
+        self.assertEqual(builder.run(), {"scripts": "forced",
+                                         "styles": "forced"})
+
+    def testGzipOnlyFingerprintsCompressible(self):
+        self.write("a.png", "not decoded when fingerprinting")
+        sprite = self.add_bundle(type="png-sprite", name="icons",
+                                 files=["a.png"], css_file="icons.css")
+        builder = self.make_builder(manifest=self.manifest, gzip=True)
+        builder.get_rebuild_reason(self.bundles["scripts"])
+        builder.get_rebuild_reason(sprite)
+        self.assertEqual(builder._fingerprints["scripts"]["options"]["gzip"],
+                         True)
+        self.assert_("gzip" not in builder._fingerprints["icons"]["options"])
+
+
+class MissingSourceTest(BuilderTestCase):
+
+    def setUp(self):
+        super(MissingSourceTest, self).setUp()
+        self.write("a.js", "var a;\n")
+        self.write("a.css", "a { color: red }\n")
+        self.add_bundle(type="javascript", name="scripts",
+                        files=["a.js", "missing.js"])
+        self.add_bundle(type="css", name="styles", files=["a.css"])
+        self.set_setting("BUNDLE_VERSION_FILE", None)
+        self.set_setting("BUNDLE_MANIFEST_FILE", None)
+
+    def testBuilder(self):
+        self.assertRaises(SourceError, self.make_builder().run)
+
+    def testCommand(self):
+        for options in ({"staged": True}, {}, {"jobs": 2}):
+            try:
+                Command().handle_noargs(verbosity=0, **options)
+            except CommandError, e:
+                self.assertEqual(str(e), "Can't read %s, a source of bundle "
+                                 "'scripts': No such file or directory" %
+                                 self.path("missing.js"))
+            else:
+                self.fail("No CommandError with %r" % options)
+            if options.get("staged"):
+                self.assertEqual(sorted(os.listdir(self.dir)),
+                                 ["a.css", "a.js"])
+
+
+class SheetVersionsTest(BuilderTestCase):
+
+    def setUp(self):
+        super(SheetVersionsTest, self).setUp()
+        self.saved_snapshot = (versioning._snapshot,
+                               versioning._snapshot_mtime,
+                               versioning._next_check)
+        versioning._snapshot = None
+        versioning._next_check = 0
+        self.set_setting("BUNDLE_VERSION_FILE", self.path("versions.json"))
+        self.set_setting("BUNDLE_VERSION_RELOAD_INTERVAL", 0)
+        self.set_setting("BUNDLE_VERSIONER", "sha1")
+        self.set_setting("BUNDLE_MANIFEST_FILE", None)
+        self.set_setting("BUNDLE_PNG_OPTIMIZER", None)
+        for (name, color) in (("a", "red"), ("b", "green"), ("c", "blue")):
+            Image.new("RGBA", (16, 16), color).save(self.path(name + ".png"))
+        self.sprite = self.add_bundle(type="png-sprite", name="icons",
+                                      files=["a.png", "b.png", "c.png"],
+                                      css_file=self.path("icons.css"),
+                                      max_sheet_width=16,
+                                      max_sheet_height=16)
+
+    def tearDown(self):
+        (versioning._snapshot, versioning._snapshot_mtime,
+         versioning._next_check) = self.saved_snapshot
+        super(SheetVersionsTest, self).tearDown()
+
+    def testDroppedSheetsPruned(self):
+        Command().handle_noargs(verbosity=0)
+        self.assertEqual(sorted(versioning.load_versions(
+            self.path("versions.json"))), ["icons", "icons-1", "icons-2"])
+        # All the images fit on one sheet now.
+        self.sprite.max_sheet_width = self.sprite.max_sheet_height = 64
+        builder = self.make_builder(versioner_name="sha1")
+        builder.run()
+        self.assertEqual(builder.removed_versions,
+                         set(["icons-1", "icons-2"]))
+        self.assertEqual(sorted(builder.versioner.versions), ["icons"])
+        Command().handle_noargs(verbosity=0)
+        self.assertEqual(sorted(versioning.load_versions(
+            self.path("versions.json"))), ["icons"])
+
+
+class DependencyTest(BuilderTestCase):
+
+    def setUp(self):
+        super(DependencyTest, self).setUp()
+        self.write("a.css", "a { color: red }\n")
+        self.write("b.css", "b { color: blue }\n")
+        self.add_bundle(type="png-sprite", name="icons", files=["a.png"],
+                        css_file=self.path("icons.css"))
+        self.add_bundle(type="css", name="styles",
+                        files=["a.css", "icons.css"])
+        self.add_bundle(type="css", name="all", files=["styles.css", "b.css"])
+
+    def testDependencies(self):
+        dependencies = get_dependencies(self.bundles.values())
+        self.assertEqual(dependencies, {"icons": set(),
+                                        "styles": set(["icons"]),
+                                        "all": set(["styles"])})
+
+    def testBuildOrder(self):
+        # Stand in for the sprite's CSS, so no images are needed.
+        del self.bundles["icons"]
+        self.write("icons.css", ".icons { }\n")
+        builder = self.make_builder()
+        builder.run()
+        rebuilt = [line.split(":")[0] for line
+                   in builder.stdout.getvalue().splitlines()]
+        self.assertEqual(rebuilt, ["Rebuilt styles", "Rebuilt all"])
+        self.assertEqual(self.read("all.css"), "a { color: red }\n"
+                         ".icons { }\nb { color: blue }\n")
+
+    def testDependents(self):
+        dependencies = get_dependencies(self.bundles.values())
+        self.assertEqual(get_dependents(dependencies, ["icons"]),
+                         set(["icons", "styles", "all"]))
+        self.assertEqual(get_dependents(dependencies, ["styles"]),
+                         set(["styles", "all"]))
+        self.assertEqual(get_dependents(dependencies, ["all"]), set(["all"]))
+
+    def testCycle(self):
+        # all needs b.css, which is now built from all.css.
+        self.add_bundle(type="css", name="b", files=["all.css"])
+        self.assertRaises(CyclicDependencyError, self.make_builder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,17 +2,24 @@
 
 from __future__ import with_statement
 
-import math
 import os
 import shutil
-import subprocess
 import re
-from StringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
 
 from media_bundler.conf import bundler_settings
-from media_bundler.bin_packing import Box, pack_boxes
-from media_bundler.jsmin import jsmin
-from media_bundler.cssmin import minify_css
+from media_bundler.bin_packing import (Box, PACKERS, check_packing,
+                                       pack_sheets, sheets_efficiency)
+from media_bundler.jsmin import jsmin_chunks
+from media_bundler.manifest import fingerprint_file, hash_file
+from media_bundler.pngtools import PngError, get_png_optimizer, read_png_size
+from media_bundler.cssmin import minify_css_chunks
+from media_bundler import staging
+from media_bundler import stats
 from media_bundler import versioning
 
 
@@ -33,6 +40,13 @@ def concatenate_files(paths):
                 buffer = input.read(8192)
 
 
+def copy_files(paths, output):
+    """Concatenate several files into an open output file in 64K blocks."""
+    for path in paths:
+        with open(path) as input:
+            shutil.copyfileobj(input, output, 2**16)
+
+
 class Bundle(object):
 
     """Base class for a bundle of media files.
@@ -41,6 +55,18 @@ class Bundle(object):
     together and served as a single file to improve performance.
     """
 
+    # Whether the bundle is text that is worth precompressing.
+    compressible = False
+
+    # Bundles smaller than this many bytes are inlined into the page.
+    inline_threshold = None
+
+    # Whether pages that link the bundle should send a preload hint for it.
+    preload = False
+
+    # A short note about the last build, for bundle_media to report.
+    build_report = None
+
     def __init__(self, name, path, url, files, type):
         self.name = name
         self.path = path
@@ -48,6 +74,8 @@ class Bundle(object):
         if not url.endswith("/"):
             raise ValueError("Bundle URLs must end with a '/'.")
         self.files = files
+        # For fast membership tests from the template tags.
+        self.file_set = frozenset(files)
         self.type = type
 
     @classmethod
@@ -62,22 +90,55 @@ class Bundle(object):
         if attrs["type"] == "javascript":
             return JavascriptBundle(attrs["name"], attrs["path"], attrs["url"],
                                     attrs["files"], attrs["type"],
-                                    attrs.get("minify", False))
+                                    attrs.get("minify", False),
+                                    attrs.get("inline_threshold"),
+                                    attrs.get("preload", True))
         elif attrs["type"] == "css":
             return CssBundle(attrs["name"], attrs["path"], attrs["url"],
                              attrs["files"], attrs["type"],
-                             attrs.get("minify", False))
+                             attrs.get("minify", False),
+                             attrs.get("inline_threshold"),
+                             attrs.get("preload", True))
         elif attrs["type"] == "png-sprite":
             cls.check_attr(attrs, "css_file")
             return PngSpriteBundle(attrs["name"], attrs["path"], attrs["url"],
                                    attrs["files"], attrs["type"],
-                                   attrs["css_file"])
+                                   attrs["css_file"],
+                                   attrs.get("packing", "shelf"),
+                                   attrs.get("max_sheet_width"),
+                                   attrs.get("max_sheet_height"),
+                                   attrs.get("max_sheet_bytes"),
+                                   attrs.get("check_packing", False))
         else:
             raise InvalidBundleType(attrs["type"])
 
     def get_paths(self):
         return [os.path.join(self.path, f) for f in self.files]
 
+    def get_input_paths(self):
+        """Return the paths to read the source files from.
+
+        In a staged build, sources generated by other bundles are read from
+        the stage.
+        """
+        return [staging.input_path(path) for path in self.get_paths()]
+
+    def get_output_paths(self):
+        """Return the paths of every file this bundle generates."""
+        return [self.get_bundle_path()]
+
+    def get_versioned_bundles(self):
+        """Return the bundles whose files this bundle versions when built.
+
+        This is just the bundle itself, except for sprites split over several
+        sheets.
+        """
+        return [self]
+
+    def get_build_options(self):
+        """Return the settings, besides the files, that affect the output."""
+        return {"url": self.url}
+
     def get_extension(self):
         raise NotImplementedError
 
@@ -88,57 +149,113 @@ class Bundle(object):
         filename = self.get_bundle_filename()
         return os.path.join(self.path, filename)
 
-    def get_bundle_url(self):
+    def get_bundle_url(self, versions=None):
+        if versions is None:
+            versions = versioning.get_bundle_versions()
         unversioned = self.get_bundle_filename()
-        filename = versioning.get_bundle_versions().get(self.name, unversioned)
-        return self.url + filename
+        filename = versions.get(self.name, unversioned)
+        # Bundles built on demand are all served by the same view.
+        return (bundler_settings.BUNDLE_SERVE_URL or self.url) + filename
+
+    def get_published_path(self, versions=None):
+        """Return the path of the file that get_bundle_url() links to."""
+        if versions is None:
+            versions = versioning.get_bundle_versions()
+        unversioned = self.get_bundle_filename()
+        return os.path.join(self.path, versions.get(self.name, unversioned))
 
     def make_bundle(self, versioner):
-        self._make_bundle()
+        writer = self._make_bundle(versioner)
         if versioner:
-            versioner.update_bundle_version(self)
-
-    def do_text_bundle(self, minifier=None):
-        with open(self.get_bundle_path(), "w") as output:
-            generator = concatenate_files(self.get_paths())
-            if minifier:
-                # Eventually we should use generators to concatenate and minify
-                # things one bit at a time, but for now we use strings.
-                output.write(minifier("".join(generator)))
-            else:
-                output.write("".join(generator))
+            versioner.update_bundle_version(self, writer)
+
+    def do_text_bundle(self, minifier=None, versioner=None):
+        """Write the bundle, streaming the sources through the minifier.
+
+        minifier should take and return iterables of strings.  We write to a
+        temporary file and rename it into place so a failed build never leaves
+        a truncated bundle behind.  The output goes through the versioner's
+        writer, so hash versioners don't have to read the bundle back, and the
+        file that was written through is returned.
+        """
+        path = staging.output_path(self.get_bundle_path())
+        tmp_path = path + ".tmp"
+        paths = self.get_input_paths()
+        # The sources are streamed through the minifier, so reading them counts
+        # as minifying.
+        stage = "minify" if minifier else "concatenate"
+        try:
+            with stats.stage(stage):
+                with open(tmp_path, "w") as output:
+                    writer = output
+                    if versioner:
+                        writer = versioner.get_writer(output)
+                    if minifier:
+                        chunks = minifier(concatenate_files(paths))
+                    elif writer is output:
+                        copy_files(paths, output)
+                        chunks = ()
+                    else:
+                        chunks = concatenate_files(paths)
+                    for chunk in chunks:
+                        writer.write(chunk)
+        except:
+            os.remove(tmp_path)
+            raise
+        os.rename(tmp_path, path)
+        return writer
 
 
 class JavascriptBundle(Bundle):
 
     """Bundle for JavaScript."""
 
-    def __init__(self, name, path, url, files, type, minify):
+    compressible = True
+
+    def __init__(self, name, path, url, files, type, minify,
+                 inline_threshold=None, preload=True):
         super(JavascriptBundle, self).__init__(name, path, url, files, type)
         self.minify = minify
+        self.inline_threshold = inline_threshold
+        self.preload = preload
 
     def get_extension(self):
         return ".js"
 
-    def _make_bundle(self):
-        minifier = jsmin if self.minify else None
-        self.do_text_bundle(minifier)
+    def get_build_options(self):
+        options = super(JavascriptBundle, self).get_build_options()
+        options["minify"] = self.minify
+        return options
+
+    def _make_bundle(self, versioner):
+        minifier = jsmin_chunks if self.minify else None
+        return self.do_text_bundle(minifier, versioner)
 
 
 class CssBundle(Bundle):
 
     """Bundle for CSS."""
 
-    def __init__(self, name, path, url, files, type, minify):
+    compressible = True
+
+    def __init__(self, name, path, url, files, type, minify,
+                 inline_threshold=None, preload=True):
         super(CssBundle, self).__init__(name, path, url, files, type)
         self.minify = minify
+        self.inline_threshold = inline_threshold
+        self.preload = preload
 
     def get_extension(self):
         return ".css"
 
-    def _make_bundle(self):
-        minifier = minify_css if self.minify else None
-        self.do_text_bundle(minifier)
+    def get_build_options(self):
+        options = super(CssBundle, self).get_build_options()
+        options["minify"] = self.minify
+        return options
+
+    def _make_bundle(self, versioner):
+        minifier = minify_css_chunks if self.minify else None
+        return self.do_text_bundle(minifier, versioner)
 
 
 class PngSpriteBundle(Bundle):
@@ -146,75 +263,332 @@ class PngSpriteBundle(Bundle):
     """Bundle for PNG sprites.
 
     In addition to generating a PNG sprite, it also generates CSS rules so that
-    the user can easily place their sprites.  We build sprite bundles before CSS
-    bundles so that the user can bundle the generated CSS with the rest of their
-    CSS.
+    the user can easily place their sprites.  The generated CSS file is one of
+    the bundle's outputs, so any CssBundle that lists it is built after the
+    sprite, which lets the user bundle it with the rest of their CSS.
+
+    If max_sheet_width, max_sheet_height or max_sheet_bytes (of decoded RGBA
+    pixels) are set, the images are split over as many sheets as it takes to
+    stay within them.  The first sheet is the bundle itself, and the others
+    are SpriteSheets named <name>-1, <name>-2 and so on, each versioned on its
+    own.
+
+    With check_packing, every build checks that no images in the layout
+    overlap or stick out of their sheet, and fails with a PackingError if they
+    do.
+
+    The layout of the last build and a fingerprint of each image are kept in a
+    hidden layout file next to the sprite.  If no image has changed size, the
+    next build reuses the layout and the last sheets, only repastes the images
+    that changed, and leaves sheets without changes alone.  The CSS file is
+    only rewritten if its contents change.
     """
 
-    def __init__(self, name, path, url, files, type, css_file):
+    LAYOUT_FORMAT = 2
+
+    def __init__(self, name, path, url, files, type, css_file,
+                 packing="shelf", max_sheet_width=None, max_sheet_height=None,
+                 max_sheet_bytes=None, check_packing=False):
         super(PngSpriteBundle, self).__init__(name, path, url, files, type)
         self.css_file = css_file
+        if packing not in PACKERS:
+            raise ValueError("Unknown sprite packing %r, expected one of: %s" %
+                             (packing, ", ".join(sorted(PACKERS))))
+        self.packing = packing
+        self.max_sheet_width = max_sheet_width
+        self.max_sheet_height = max_sheet_height
+        self.max_sheet_bytes = max_sheet_bytes
+        self.check_packing = check_packing
 
     def get_extension(self):
         return ".png"
 
+    def get_sheet(self, index, files=()):
+        """Return the bundle for one sheet of the sprite."""
+        if index == 0:
+            return self
+        return SpriteSheet(self, index, files)
+
+    def get_sheets(self):
+        """Return the sheets of the last build, as listed in its layout."""
+        sheets = self.load_layout().get("sheets") or [{"layout": ()}]
+        return [self.get_sheet(index,
+                               [name for (name, _, _) in sheet["layout"]])
+                for (index, sheet) in enumerate(sheets)]
+
+    def get_versioned_bundles(self):
+        return self.get_sheets()
+
+    def get_output_paths(self):
+        paths = super(PngSpriteBundle, self).get_output_paths()
+        paths.append(self.css_file)
+        paths.append(self.get_layout_path())
+        paths.extend(sheet.get_bundle_path() for sheet in self.get_sheets()[1:])
+        return paths
+
+    def get_layout_path(self):
+        return os.path.join(self.path, ".%s.layout.json" % self.name)
+
+    def get_build_options(self):
+        options = super(PngSpriteBundle, self).get_build_options()
+        options["css_file"] = self.css_file
+        options["packing"] = self.packing
+        options["optimizer"] = bundler_settings.BUNDLE_PNG_OPTIMIZER
+        options["max_sheet_width"] = self.max_sheet_width
+        options["max_sheet_height"] = self.max_sheet_height
+        options["max_sheet_bytes"] = self.max_sheet_bytes
+        return options
+
     def make_bundle(self, versioner):
-        import Image  # If this fails, you need the Python Imaging Library.
-        boxes = [ImageBox(Image.open(path), path) for path in self.get_paths()]
-        # Pick a max_width so that the sprite is squarish and a multiple of 16,
-        # and so no image is too wide to fit.
-        total_area = sum(box.width * box.height for box in boxes)
-        width = max(max(box.width for box in boxes),
-                    (int(math.sqrt(total_area)) // 16 + 1) * 16)
-        (_, height, packing) = pack_boxes(boxes, width)
-        sprite = Image.new("RGBA", (width, height))
-        for (left, top, box) in packing:
+        try:
+            from PIL import Image
+        except ImportError:
+            import Image  # If this fails, you need the Python Imaging Library.
+        with stats.stage("pack"):
+            # Only the image sizes are needed for packing, so we read them
+            # from the PNG headers, and only decode each image when we paste
+            # it.
+            boxes = [ImageBox(get_image_size(Image, input_path), path,
+                              input_path)
+                     for (input_path, path)
+                     in zip(self.get_input_paths(), self.get_paths())]
+            old_layout = self.load_layout()
+            old_files = dict((f[0], f[1:4])
+                             for f in old_layout.get("files", ()))
+            fingerprints = [fingerprint_file(box.input_path,
+                                             old_files.get(name))
+                            for (name, box) in zip(self.files, boxes)]
+            sheets = self.get_cached_sheets(old_layout, boxes)
+            if sheets is None:
+                max_area = self.max_sheet_bytes and self.max_sheet_bytes // 4
+                sheets = pack_sheets(boxes, PACKERS[self.packing],
+                                     self.max_sheet_width,
+                                     self.max_sheet_height, max_area)
+                reused = False
+            else:
+                reused = True
+        names = dict((id(box), name) for (name, box) in zip(self.files, boxes))
+        if not reused:
+            last_paths = [None] * len(sheets)
+            changed = set(names)
+            repasted = ""
+        else:
+            last_paths = [self.get_last_sheet_path(index)
+                          for index in range(len(sheets))]
+            changed = set(id(box) for (name, box, fingerprint)
+                          in zip(self.files, boxes, fingerprints)
+                          if old_files[name][2] != fingerprint[2])
+            repasted = ", repasted %d of %d images" % (len(changed),
+                                                       len(boxes))
+        if self.check_packing:
+            with stats.stage("check"):
+                for (width, height, packing) in sheets:
+                    check_packing(width, height, packing)
+        digests = []
+        for (index, (width, height, packing)) in enumerate(sheets):
+            sheet = self.get_sheet(index, [names[id(box)]
+                                           for (_, _, box) in packing])
+            self.make_sheet(Image, sheet, width, height, packing, changed,
+                            last_paths[index])
+            with stats.stage("hash"):
+                digests.append(hash_file(staging.output_path(
+                    sheet.get_bundle_path())))
+            # It's *REALLY* important that this happen here instead of after
+            # the generate_css() call, because if we waited, the CSS woudl have
+            # the URL of the last version of this sheet.  The optimizer writes
+            # the final file, so the versioner has to hash it after
+            # optimization, and the layout's hash of it is passed along.
+            if versioner:
+                versioner.update_bundle_version(sheet, digest=digests[-1])
+        self.save_layout(boxes, names, fingerprints, sheets, digests)
+        sheet_count = ""
+        if len(sheets) > 1:
+            sheet_count = ", %d sheets" % len(sheets)
+        self.build_report = "%s packing, %.1f%% efficient%s%s" % (
+            self.packing, 100 * sheets_efficiency(sheets), sheet_count,
+            repasted)
+        with stats.stage("css"):
+            self.generate_css(sheets, versioner and versioner.versions)
+
+    def make_sheet(self, Image, sheet, width, height, packing, changed,
+                   last_path=None):
+        """Write one sheet of the sprite.
+
+        changed is the set of ids of the boxes to paste.  If last_path is
+        given, they are pasted over the last build's sheet there, and a sheet
+        without any changes is kept as it is.
+        """
+        path = staging.output_path(sheet.get_bundle_path())
+        pastes = [(left, top, box) for (left, top, box) in packing
+                  if id(box) in changed]
+        if last_path and not pastes:
+            if last_path != path:
+                with stats.stage("copy"):
+                    versioning.link_or_copy(last_path, path)
+            return
+        with stats.stage("paste"):
+            sprite = self.paste_images(Image, width, height, pastes,
+                                       last_path)
+        # Like text bundles, the sprite is renamed into place so that older
+        # versioned links to it keep their contents.
+        tmp_path = path + ".tmp"
+        try:
+            with stats.stage("encode"):
+                sprite.save(tmp_path, "PNG")
+            del sprite
+            with stats.stage("optimize"):
+                self._optimize_output(tmp_path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.rename(tmp_path, path)
+
+    def paste_images(self, Image, width, height, pastes, last_path=None):
+        """Return a sheet with the images pasted onto it.
+
+        The sheet is the one at last_path if given, or a new one.
+        """
+        if last_path:
+            with open(last_path, "rb") as input:
+                sprite = Image.open(input)
+                sprite.load()
+            # Optimizers may have stored an opaque sheet as RGB.
+            sprite = sprite.convert("RGBA")
+        else:
+            sprite = Image.new("RGBA", (width, height))
+        for (left, top, box) in pastes:
+            if last_path:
+                # Clear what was there before, so the new image isn't
+                # blended with the old one.
+                sprite.paste((0, 0, 0, 0),
+                             (left, top, left + box.width, top + box.height))
             # This is a bit of magic to make the transparencies work.  To
             # preserve transparency, we pass the image so it can take its
             # alpha channel mask or something.  However, if the image has no
             # alpha channels, then it fails, we we have to check if the
             # image is RGBA here.
-            img = box.image
+            with open(box.input_path, "rb") as input:
+                img = Image.open(input)
+                img.load()
             mask = img if img.mode == "RGBA" else None
             sprite.paste(img, (left, top), mask)
-        sprite.save(self.get_bundle_path(), "PNG")
-        self._optimize_output()
-        # It's *REALLY* important that this happen here instead of after the
-        # generate_css() call, because if we waited, the CSS woudl have the URL
-        # of the last version of this bundle.
-        if versioner:
-            versioner.update_bundle_version(self)
-        self.generate_css(packing)
-
-    def _optimize_output(self):
-        """Optimize the PNG with pngcrush."""
-        sprite_path = self.get_bundle_path()
-        tmp_path = sprite_path + '.tmp'
-        args = ['pngcrush', '-rem', 'alla', sprite_path, tmp_path]
-        proc = subprocess.Popen(args, stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-        proc.wait()
-        if proc.returncode != 0:
-            raise Exception('pngcrush returned error code: %r\nOutput was:\n\n'
-                            '%s' % (proc.returncode, proc.stdout.read()))
-        shutil.move(tmp_path, sprite_path)
-
-    def generate_css(self, packing):
-        """Generate the background offset CSS rules."""
-        with open(self.css_file, "w") as css:
-            css.write("/* Generated classes for django-media-bundler sprites.  "
-                      "Don't edit! */\n")
+            del img, mask
+        return sprite
+
+    def get_last_sheet_path(self, index):
+        return staging.input_path(self.get_sheet(index).get_bundle_path())
+
+    def load_layout(self):
+        """Return the layout saved by the last build, or an empty dict."""
+        try:
+            with open(staging.input_path(self.get_layout_path())) as input:
+                layout = json.load(input)
+        except (IOError, ValueError):
+            return {}
+        if layout.get("format") != self.LAYOUT_FORMAT:
+            return {}
+        return layout
+
+    def save_layout(self, boxes, names, fingerprints, sheets, digests):
+        """Save the layout for the next build to reuse."""
+        layout = {
+            "format": self.LAYOUT_FORMAT,
+            "options": self.get_build_options(),
+            "files": [[name] + fingerprint + [box.width, box.height]
+                      for (name, fingerprint, box)
+                      in zip(self.files, fingerprints, boxes)],
+            "sheets": [{"width": width,
+                        "height": height,
+                        "sprite": digest,
+                        "layout": [[names[id(box)], left, top]
+                                   for (left, top, box) in packing]}
+                       for ((width, height, packing), digest)
+                       in zip(sheets, digests)],
+        }
+        path = staging.output_path(self.get_layout_path())
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as output:
+            json.dump(layout, output)
+        os.rename(tmp_path, path)
+
+    def get_cached_sheets(self, layout, boxes):
+        """Return the last build's sheets if they still fit the images.
+
+        The packers are deterministic, so the sheets are reused when the same
+        images have the same sizes, in the same order, with the same options,
+        and the last sheets are still the ones the layout was saved with.
+        """
+        if not layout or layout.get("options") != self.get_build_options():
+            return None
+        sizes = [[name, box.width, box.height]
+                 for (name, box) in zip(self.files, boxes)]
+        if [[f[0]] + f[4:6] for f in layout["files"]] != sizes:
+            return None
+        boxes_by_name = dict(zip(self.files, boxes))
+        sheets = []
+        for (index, sheet) in enumerate(layout["sheets"]):
+            try:
+                digest = hash_file(self.get_last_sheet_path(index))
+            except IOError:
+                return None
+            if digest != sheet["sprite"]:
+                return None
+            packing = [(left, top, boxes_by_name[name])
+                       for (name, left, top) in sheet["layout"]]
+            sheets.append((sheet["width"], sheet["height"], packing))
+        return sheets
+
+    def _optimize_output(self, sprite_path):
+        """Optimize the PNG with the configured optimizer."""
+        optimizer = get_png_optimizer(bundler_settings.BUNDLE_PNG_OPTIMIZER)
+        if optimizer:
+            optimizer(sprite_path)
+
+    def generate_css(self, sheets, versions=None):
+        """Generate the background offset CSS rules.
+
+        The bundle's class sets the first sheet as the background, and images
+        on other sheets override it.  The file is left alone if it already
+        has these rules, so CSS bundles that include it don't see a change.
+        """
+        rules = ["/* Generated classes for django-media-bundler sprites.  "
+                 "Don't edit! */\n"]
+        props = {
+            "background-image": "url('%s')" % self.get_bundle_url(versions),
+        }
+        rules.append(self.make_css(None, props))
+        for (index, (_, _, packing)) in enumerate(sheets):
+            if index == 0:
+                continue
             props = {
-                "background-image": "url('%s')" % self.get_bundle_url(),
+                "background-image": "url('%s')" %
+                    self.get_sheet(index).get_bundle_url(versions),
             }
-            css.write(self.make_css(None, props))
+            rules.append(self.make_css_rule(
+                [os.path.basename(box.filename) for (_, _, box) in packing],
+                props))
+        for (_, _, packing) in sheets:
             for (left, top, box) in packing:
                 props = {
                     "background-position": "%dpx %dpx" % (-left, -top),
                     "width": "%dpx" % box.width,
                     "height": "%dpx" % box.height,
                 }
-                css.write(self.make_css(os.path.basename(box.filename), props))
+                rules.append(self.make_css(os.path.basename(box.filename),
+                                           props))
+        content = "".join(rules)
+        try:
+            with open(staging.input_path(self.css_file)) as input:
+                if input.read() == content:
+                    return
+        except IOError:
+            pass
+        path = staging.output_path(self.css_file)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as css:
+            css.write(content)
+        os.rename(tmp_path, path)
 
     CSS_REGEXP = re.compile(r"[^a-zA-Z\-_]")
 
@@ -226,11 +600,34 @@ class PngSpriteBundle(Bundle):
         return self.CSS_REGEXP.sub("", name)
 
     def make_css(self, name, props):
+        return self.make_css_rule([name], props)
+
+    def make_css_rule(self, names, props):
         # We try to format it nicely here in case the user actually looks at it.
         # If he wants it small, he'll bundle it up in his CssBundle.
-        css_class = self.css_class_name(name)
+        selectors = ",\n".join("." + self.css_class_name(name)
+                               for name in names)
         css_propstr = "".join("     %s: %s;\n" % p for p in props.iteritems())
-        return "\n.%s {\n%s}\n" % (css_class, css_propstr)
+        return "\n%s {\n%s}\n" % (selectors, css_propstr)
+
+
+class SpriteSheet(Bundle):
+
+    """One of the extra sheets of a PngSpriteBundle split into several.
+
+    Sheets are named after the sprite bundle and their index, and are written
+    and versioned like a bundle of the images on them.
+    """
+
+    def __init__(self, bundle, index, files=()):
+        name = "%s-%d" % (bundle.name, index)
+        super(SpriteSheet, self).__init__(name, bundle.path, bundle.url,
+                                          files, bundle.type)
+        self.bundle = bundle
+        self.index = index
+
+    def get_extension(self):
+        return ".png"
 
 
 class ImageBox(Box):
@@ -241,14 +638,26 @@ class ImageBox(Box):
     arranged, we can place the associated image in the sprite.
     """
 
-    def __init__(self, image, filename):
-        (width, height) = image.size
+    __slots__ = ("filename", "input_path")
+
+    def __init__(self, size, filename, input_path=None):
+        (width, height) = size
         super(ImageBox, self).__init__(width, height)
-        self.image = image
         self.filename = filename
+        self.input_path = input_path or filename
 
     def __repr__(self):
-        return "<ImageBox: filename=%r image=%r>" % (self.filename, self.image)
+        return "<ImageBox: filename=%r size=%r>" % (self.filename,
+                                                    (self.width, self.height))
+
+
+def get_image_size(Image, path):
+    """Return the size of an image, reading just the header of PNGs."""
+    try:
+        return read_png_size(path)
+    except PngError:
+        with open(path, "rb") as input:
+            return Image.open(input).size
 
 
 _bundles = None
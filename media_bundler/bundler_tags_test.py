@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""Tests for the bundle template tags."""
+
+import os
+import unittest
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from test_support import BundleTestCase
+
+from django.template import Context, Template, TemplateSyntaxError
+from django.test.client import RequestFactory
+
+from media_bundler import versioning
+from media_bundler.context_processors import preload
+from media_bundler.templatetags import bundler_tags
+from media_bundler.templatetags.bundler_tags import (JavascriptNode,
+                                                     get_tag_list)
+
+
+class TagTestCase(BundleTestCase):
+
+    settings = {"USE_BUNDLES": True, "DEFER_JAVASCRIPT": False,
+                "BUNDLE_VERSION_FILE": None, "BUNDLE_SERVE_URL": None,
+                "BUNDLE_VERSION_RELOAD_INTERVAL": 0,
+                "BUNDLE_PRELOAD_LIMIT": None}
+
+    def setUp(self):
+        super(TagTestCase, self).setUp()
+        for (name, value) in self.settings.iteritems():
+            self.set_setting(name, value)
+        versioning._snapshot = None
+        # Nothing is versioned, so the generation stays the same between
+        # tests.
+        bundler_tags._inline_contents_generation = None
+        bundler_tags._tag_lists_generation = None
+        self.add_bundle(type="javascript", name="scripts",
+                        files=["a.js", "b.js"])
+        self.add_bundle(type="css", name="styles", files=["a.css"])
+
+    def tearDown(self):
+        versioning._snapshot = None
+        super(TagTestCase, self).tearDown()
+
+    def render(self, source, context=None):
+        template = Template("{% load bundler_tags %}" + source)
+        return template.render(Context(context or {}))
+
+
+class ParseTest(TagTestCase):
+
+    def testUnknownLiterals(self):
+        for source in ("{% javascript 'nope' 'a.js' %}",
+                       "{% javascript 'scripts' 'c.js' %}",
+                       "{% css 'styles' 'a.js' %}",
+                       "{% load_bundle 'nope' %}"):
+            self.assertRaises(TemplateSyntaxError, Template,
+                              "{% load bundler_tags %}" + source)
+
+    def testVariablesCheckedOnRender(self):
+        template = Template("{% load bundler_tags %}"
+                            "{% javascript bundle file %}")
+        self.assertEqual(template.render(Context({"bundle": "scripts",
+                                                  "file": "b.js"})),
+                         '<script type="text/javascript" '
+                         'src="/media/scripts.js"></script>')
+        self.assertRaises(TemplateSyntaxError, template.render,
+                          Context({"bundle": "scripts", "file": "c.js"}))
+
+    def testLinkedOnce(self):
+        self.assertEqual(self.render("{% javascript 'scripts' 'a.js' %}"
+                                     "{% javascript 'scripts' 'b.js' %}"
+                                     "{% css 'styles' 'a.css' %}"),
+                         '<script type="text/javascript" '
+                         'src="/media/scripts.js"></script>'
+                         '<link rel="stylesheet" type="text/css" '
+                         'href="/media/styles.css"/>')
+        self.set_setting("USE_BUNDLES", False)
+        self.assertEqual(self.render("{% javascript 'scripts' 'a.js' %}"
+                                     "{% javascript 'scripts' 'b.js' %}"),
+                         '<script type="text/javascript" '
+                         'src="/media/a.js"></script>'
+                         '<script type="text/javascript" '
+                         'src="/media/b.js"></script>')
+
+
+class LoadBundleTest(TagTestCase):
+
+    def write_versions(self, versions, mtime):
+        path = self.path("versions.json")
+        self.write("versions.json", json.dumps(versions))
+        os.utime(path, (mtime, mtime))
+        self.set_setting("BUNDLE_VERSION_FILE", path)
+
+    def testLoadBundle(self):
+        self.assertEqual(self.render("{% load_bundle 'scripts' %}"
+                                     "{% javascript 'scripts' 'b.js' %}"),
+                         '<script type="text/javascript" '
+                         'src="/media/scripts.js"></script>')
+        self.set_setting("USE_BUNDLES", False)
+        self.assertEqual(self.render("{% javascript 'scripts' 'b.js' %}"
+                                     "{% load_bundle 'scripts' %}"),
+                         '<script type="text/javascript" '
+                         'src="/media/b.js"></script>'
+                         '<script type="text/javascript" '
+                         'src="/media/a.js"></script>')
+
+    def testRebuiltOnNewVersions(self):
+        self.write_versions({}, 1000000000)
+        bundle = self.bundles["scripts"]
+        tags = get_tag_list(JavascriptNode, bundle)
+        self.assert_(get_tag_list(JavascriptNode, bundle) is tags)
+        template = Template("{% load bundler_tags %}"
+                            "{% load_bundle 'scripts' %}")
+        self.assertEqual(template.render(Context()),
+                         '<script type="text/javascript" '
+                         'src="/media/scripts.js"></script>')
+        self.write_versions({"scripts": "scripts.0123456789.js"}, 1000000010)
+        self.assertEqual(template.render(Context()),
+                         '<script type="text/javascript" '
+                         'src="/media/scripts.0123456789.js"></script>')
+        self.assert_(get_tag_list(JavascriptNode, bundle) is not tags)
+
+
+class InlineTest(TagTestCase):
+
+    def setUp(self):
+        super(InlineTest, self).setUp()
+        self.add_bundle(type="javascript", name="small", files=["s.js"],
+                        inline_threshold=20)
+        self.add_bundle(type="css", name="tiny", files=["t.css"],
+                        inline_threshold=20)
+
+    def testInlined(self):
+        self.write("small.js", "var s;")
+        self.write("tiny.css", "a{color:red}")
+        self.assertEqual(self.render("{% javascript 'small' 's.js' %}"
+                                     "{% css 'tiny' 't.css' %}"),
+                         '<script type="text/javascript">var s;</script>'
+                         '<style type="text/css">a{color:red}</style>')
+
+    def testCssUrlsAbsolutized(self):
+        self.bundles["tiny"].url = "/media/css/"
+        self.bundles["tiny"].inline_threshold = 200
+        self.write("tiny.css", "a{background:url(../i/a.png)}"
+                   "b{background:url( 'b.png' )}"
+                   "i{background:URL(\"/i/i.png\")}"
+                   "p{background:url(http://cdn/p.png)}"
+                   "q{background:url(data:image/png;base64,AA==)}"
+                   "s{fill:url(#s)}")
+        self.assertEqual(self.render("{% css 'tiny' 't.css' %}"),
+                         '<style type="text/css">'
+                         "a{background:url(/media/i/a.png)}"
+                         "b{background:url( '/media/css/b.png' )}"
+                         'i{background:URL("/i/i.png")}'
+                         "p{background:url(http://cdn/p.png)}"
+                         "q{background:url(data:image/png;base64,AA==)}"
+                         "s{fill:url(#s)}</style>")
+
+    def testThreshold(self):
+        self.write("small.js", "x" * 19)
+        self.assertEqual(self.render("{% javascript 'small' 's.js' %}"),
+                         '<script type="text/javascript">%s</script>' %
+                         ("x" * 19))
+        bundler_tags._inline_contents_generation = None
+        self.write("small.js", "x" * 20)
+        self.assertEqual(self.render("{% javascript 'small' 's.js' %}"),
+                         '<script type="text/javascript" '
+                         'src="/media/small.js"></script>')
+
+    def testNotBuilt(self):
+        self.assertEqual(self.render("{% javascript 'small' 's.js' %}"),
+                         '<script type="text/javascript" '
+                         'src="/media/small.js"></script>')
+
+    def testClosingTagLinked(self):
+        self.write("small.js", "s='</SCRIPT>';")
+        self.write("tiny.css", "/*</style>*/")
+        self.assertEqual(self.render("{% javascript 'small' 's.js' %}"
+                                     "{% css 'tiny' 't.css' %}"),
+                         '<script type="text/javascript" '
+                         'src="/media/small.js"></script>'
+                         '<link rel="stylesheet" type="text/css" '
+                         'href="/media/tiny.css"/>')
+
+    def testInlinedOnce(self):
+        # Inlined bundles are deduped on their URL like linked ones.
+        self.write("small.js", "var s;")
+        self.assertEqual(self.render("{% load_bundle 'small' %}"
+                                     "{% javascript 'small' 's.js' %}"
+                                     "{% javascript 'small' 's.js' %}"),
+                         '<script type="text/javascript">var s;</script>')
+
+    def testNotInlinedWithoutBundles(self):
+        self.write("small.js", "var s;")
+        self.set_setting("USE_BUNDLES", False)
+        self.assertEqual(self.render("{% javascript 'small' 's.js' %}"),
+                         '<script type="text/javascript" '
+                         'src="/media/s.js"></script>')
+
+
+class PreloadTest(TagTestCase):
+
+    def get_hints(self, source):
+        request = RequestFactory().get("/")
+        self.render(source, preload(request))
+        return request._bundle_preload_hints.hints
+
+    def testHints(self):
+        self.assertEqual(self.get_hints("{% load_bundle 'scripts' %}"
+                                        "{% css 'styles' 'a.css' %}"
+                                        "{% javascript 'scripts' 'a.js' %}"),
+                         [("/media/scripts.js", "script"),
+                          ("/media/styles.css", "style")])
+
+    def testLimit(self):
+        self.set_setting("BUNDLE_PRELOAD_LIMIT", 1)
+        self.assertEqual(self.get_hints("{% css 'styles' 'a.css' %}"
+                                        "{% javascript 'scripts' 'a.js' %}"),
+                         [("/media/styles.css", "style")])
+
+    def testOptOut(self):
+        self.add_bundle(type="javascript", name="late", files=["l.js"],
+                        preload=False)
+        self.assertEqual(self.get_hints("{% javascript 'late' 'l.js' %}"
+                                        "{% load_bundle 'late' %}"), [])
+
+    def testInlinedNotPreloaded(self):
+        self.add_bundle(type="javascript", name="small", files=["s.js"],
+                        inline_threshold=20)
+        self.write("small.js", "var s;")
+        self.assertEqual(self.get_hints("{% javascript 'small' 's.js' %}"),
+                         [])
+
+    def testWithoutRequest(self):
+        # Templates rendered without the context processor just link.
+        self.assertEqual(self.render("{% css 'styles' 'a.css' %}"),
+                         '<link rel="stylesheet" type="text/css" '
+                         'href="/media/styles.css"/>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""Tests for building bundles."""
+
+from __future__ import with_statement
+
+import os
+import unittest
+
+from PIL import Image
+
+from test_support import BundleTestCase
+
+from media_bundler.manifest import hash_file
+from media_bundler.versioning import Md5Versioning, Sha1Versioning
+
+
+class TextBundleTest(BundleTestCase):
+
+    def setUp(self):
+        super(TextBundleTest, self).setUp()
+        self.write("a.js", "var a = 1;\n")
+        self.write("b.js", "// b\nvar b = 2;\n")
+        self.write("app.js", "old")
+        self.bundle = self.add_bundle(type="javascript", name="app",
+                                      files=["a.js", "b.js"])
+
+    def testPlain(self):
+        self.bundle.make_bundle(None)
+        self.assertEqual(self.read("app.js"),
+                         "var a = 1;\n// b\nvar b = 2;\n")
+
+    def testMinified(self):
+        self.bundle.minify = True
+        self.bundle.make_bundle(None)
+        self.assertEqual(self.read("app.js"), "var a=1;var b=2;")
+
+    def testVersioned(self):
+        for minify in (False, True):
+            self.bundle.minify = minify
+            versioner = Sha1Versioning()
+            self.bundle.make_bundle(versioner)
+            version = versioner.versions["app"]
+            self.assertEqual(version,
+                             "app.%s.js" % hash_file(self.path("app.js")))
+            self.assert_(os.path.samefile(self.path(version),
+                                          self.path("app.js")))
+
+    def testMinifierError(self):
+        def minifier(chunks):
+            for chunk in chunks:
+                yield chunk
+            raise ValueError("Unterminated comment.")
+        self.assertRaises(ValueError, self.bundle.do_text_bundle, minifier)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ["a.js", "app.js", "b.js"])
+        self.assertEqual(self.read("app.js"), "old")
+
+
+class SpriteTest(BundleTestCase):
+
+    def setUp(self):
+        super(SpriteTest, self).setUp()
+        self.set_setting("BUNDLE_PNG_OPTIMIZER", None)
+        for (name, color) in (("a", "red"), ("b", "green"), ("c", "blue")):
+            self.make_image(name + ".png", (16, 16), color)
+
+    def make_image(self, filename, size, color):
+        Image.new("RGBA", size, color).save(self.path(filename))
+
+    def make_sprite(self, **attrs):
+        attrs = dict({"type": "png-sprite", "name": "icons",
+                      "files": ["a.png", "b.png", "c.png"],
+                      "css_file": self.path("icons.css")}, **attrs)
+        return self.add_bundle(**attrs)
+
+    def testLayoutReused(self):
+        self.make_sprite().make_bundle(None)
+        css = self.read("icons.css")
+        # Same size, new pixels: only that image is pasted again.
+        self.make_image("b.png", (16, 16), "yellow")
+        sprite = self.make_sprite()
+        sprite.make_bundle(None)
+        self.assert_(sprite.build_report.endswith(
+            ", repasted 1 of 3 images"), sprite.build_report)
+        self.assertEqual(self.read("icons.css"), css)
+        image = Image.open(self.path("icons.png")).convert("RGBA")
+        colors = set(color for (count, color) in image.getcolors())
+        self.assert_((255, 255, 0, 255) in colors)
+        self.assert_((0, 128, 0, 255) not in colors)
+        self.assert_((255, 0, 0, 255) in colors)
+        # A new size means a new layout.
+        self.make_image("b.png", (8, 8), "yellow")
+        sprite = self.make_sprite()
+        sprite.make_bundle(None)
+        self.assert_("repasted" not in sprite.build_report)
+        self.assertNotEqual(self.read("icons.css"), css)
+
+    def testSheets(self):
+        sprite = self.make_sprite(max_sheet_width=32, max_sheet_height=16)
+        versioner = Sha1Versioning()
+        sprite.make_bundle(versioner)
+        self.assert_(", 2 sheets" in sprite.build_report)
+        sheet_versions = {}
+        for name in ("icons", "icons-1"):
+            version = versioner.versions[name]
+            self.assert_(version.startswith(name + "."), version)
+            # The layout's digest is the sheet's version.
+            self.assertEqual(version,
+                             "%s.%s.png" % (name,
+                                            hash_file(self.path(version))))
+            sheet_versions[name] = version
+        css = self.read("icons.css")
+        self.assert_(".icons {\n     background-image: url('/media/%s');" %
+                     sheet_versions["icons"] in css, css)
+        # The image on the second sheet overrides the background.
+        self.assert_(".icons-c-png {\n     background-image: "
+                     "url('/media/%s');" % sheet_versions["icons-1"] in css,
+                     css)
+        self.assertEqual([sheet.name for sheet in sprite.get_sheets()],
+                         ["icons", "icons-1"])
+        self.assertEqual(sprite.get_sheets()[1].files, ["c.png"])
+
+    def testOtherHashesNotReused(self):
+        sprite = self.make_sprite()
+        versioner = Md5Versioning()
+        sprite.make_bundle(versioner)
+        with open(self.path("icons.png"), "rb") as input:
+            digest = versioner.get_hash(input)
+        self.assertEqual(versioner.versions["icons"], "icons.%s.png" % digest)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,5 +23,18 @@ MEDIA_BUNDLES = getattr(settings, "MEDIA_BUNDLES",
                         default_settings.MEDIA_BUNDLES)
 BUNDLE_VERSION_FILE = getattr(settings, "BUNDLE_VERSION_FILE",
                               default_settings.BUNDLE_VERSION_FILE)
+BUNDLE_VERSION_RELOAD_INTERVAL = getattr(
+    settings, "BUNDLE_VERSION_RELOAD_INTERVAL",
+    default_settings.BUNDLE_VERSION_RELOAD_INTERVAL)
 BUNDLE_VERSIONER = getattr(settings, "BUNDLE_VERSIONER",
                            default_settings.BUNDLE_VERSIONER)
+BUNDLE_PNG_OPTIMIZER = getattr(settings, "BUNDLE_PNG_OPTIMIZER",
+                               default_settings.BUNDLE_PNG_OPTIMIZER)
+BUNDLE_PRELOAD_LIMIT = getattr(settings, "BUNDLE_PRELOAD_LIMIT",
+                               default_settings.BUNDLE_PRELOAD_LIMIT)
+BUNDLE_MANIFEST_FILE = getattr(settings, "BUNDLE_MANIFEST_FILE",
+                               default_settings.BUNDLE_MANIFEST_FILE)
+BUNDLE_SERVE_URL = getattr(settings, "BUNDLE_SERVE_URL",
+                           default_settings.BUNDLE_SERVE_URL)
+BUNDLE_SERVE_CACHE_SIZE = getattr(settings, "BUNDLE_SERVE_CACHE_SIZE",
+                                  default_settings.BUNDLE_SERVE_CACHE_SIZE)
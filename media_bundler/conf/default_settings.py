@@ -22,10 +22,16 @@ USE_BUNDLES = getattr(settings, 'FORCE_BUNDLES', False) or not settings.DEBUG
 DEFER_JAVASCRIPT = True
 
 # This setting enables bundle versioning and cache busting.  This should be a
-# file path to a Python module that will be live when the site is deployed.  The
-# bundler will write out Python code defining a dictionary mapping bundle names
-# to versions.
-BUNDLE_VERSION_FILE = None  # Ex: PROJECT_ROOT + "/bundle_versions.py"
+# file path that will be live when the site is deployed.  The bundler will write
+# out a mapping of bundle names to versions there.  If the path ends in .json,
+# the mapping is written as JSON, which is the fastest to load.  Otherwise, it
+# is written as a Python module defining a dictionary.
+BUNDLE_VERSION_FILE = None  # Ex: PROJECT_ROOT + "/bundle_versions.json"
+
+# Running servers pick up a new version file without a restart.  This is the
+# minimum number of seconds between checks of the file's modification time.
+# Set it to None to load the file only once per process.
+BUNDLE_VERSION_RELOAD_INTERVAL = 2
 
 # If bundle versioning is enabled, this setting controls how the bundler
 # computes the current version.  Possible values are 'sha1', 'md5', and 'mtime'.
@@ -33,6 +39,31 @@ BUNDLE_VERSION_FILE = None  # Ex: PROJECT_ROOT + "/bundle_versions.py"
 # versions.
 BUNDLE_VERSIONER = 'sha1'
 
+# This setting enables incremental builds.  It should be a file path where
+# bundle_media can keep a build manifest recording the fingerprint of every
+# bundle's source files.  Bundles whose sources and settings have not changed
+# since the last run are skipped.  Pass --force to bundle_media to ignore it.
+BUNDLE_MANIFEST_FILE = None  # Ex: PROJECT_ROOT + "/.bundle_manifest.json"
+
+# How to optimize PNG sprites.  "pngcrush" runs pngcrush, which must be
+# installed, and "builtin" uses the media bundler's own optimizer, which tries
+# every PNG filter and keeps the smallest result.  The built-in optimizer can
+# take several seconds for large sheets, so "auto" only uses pngcrush, if it
+# is installed.  None disables optimization.
+BUNDLE_PNG_OPTIMIZER = "auto"
+
+# The most preload hints PreloadMiddleware sends per response, in the order the
+# bundles were linked.  None means no limit.
+BUNDLE_PRELOAD_LIMIT = 10
+
+# Set this to the URL that media_bundler.urls is included under to have bundles
+# built on demand by a view instead of by bundle_media, which is handy for
+# review environments that never run it.  Bundles are then linked there, and
+# the view keeps up to BUNDLE_SERVE_CACHE_SIZE bytes of built bundles in
+# memory, rebuilding them when their sources change.
+BUNDLE_SERVE_URL = None  # Ex: "/bundles/"
+BUNDLE_SERVE_CACHE_SIZE = 32 * 1024 * 1024
+
 MEDIA_BUNDLES = (
     # This should contain something like:
 
@@ -0,0 +1,12 @@
+# media_bundler/context_processors.py
+
+"""
+Context processors for the django media bundler.
+"""
+
+from media_bundler.middleware import get_preload_hints
+
+
+def preload(request):
+    """Let the bundle tags record preload hints for PreloadMiddleware."""
+    return {"_bundle_preload_hints": get_preload_hints(request)}
@@ -1,38 +1,224 @@
 # media_bundler/cssmin.py
 
-# Original source code:
+# Originally based on:
 # http://stackoverflow.com/questions/222581/python-script-for-minifying-css
 
-# This is obviously a hacky script, and it probably has bugs.
+"""
+A simple single-pass CSS minifier.
+
+The stylesheet is split into tokens by one regular expression, so comments,
+strings and url() values are recognized wherever they appear, and blocks may
+nest, as with @media.  Comments are removed except for the empty comment used
+by the IE<6 hack, whitespace is collapsed, quotes are dropped from url()
+values, and repeated properties within a rule are merged, keeping the position
+of the first and the value of the last.
+"""
 
 import re
 
+# Everything that isn't a brace, comment, string or url() is plain text, and is
+# normalized and split into statements a whole run at a time.
+TOKEN_RE = re.compile(r"""
+    (?P<text>(?:[^{}"'/uU]+|[uU](?![rR][lL]\())+)
+  | (?P<brace>[{}])
+  | (?P<comment>/\*[\s\S]*?\*/)
+  | (?P<string>"(?:[^"\\\n]|\\[\s\S])*"|'(?:[^'\\\n]|\\[\s\S])*')
+  | (?P<url>url\(\s*(?:"(?:[^"\\\n]|\\[\s\S])*"|'(?:[^'\\\n]|\\[\s\S])*'
+                      |[^'")\s]*)\s*\))
+  | (?P<open>(?:/\*[\s\S]*|"(?:[^"\\\n]|\\[\s\S])*\\?|'(?:[^'\\\n]|\\[\s\S])*\\?
+               |url\([^)]*)\Z)
+  | (?P<other>[\s\S])
+""", re.VERBOSE | re.IGNORECASE)
+
+# url() values that are still valid without their quotes.
+BARE_URL_RE = re.compile(r"""^url\(\s*(["'])([^\s()'"\\]*)\1\s*\)$""", re.I)
+
+EMPTY_COMMENT_RE = re.compile(r"^/\*\s*\*/$")
+
+
 def minify_css(css):
-    # remove comments - this will break a lot of hacks :-P
-    css = re.sub(r'\s*/\*\s*\*/', "$$HACK1$$", css)
-    css = re.sub(r'/\*[\s\S]*?\*/', "", css)
-    css = css.replace("$$HACK1$$", '/**/') # preserve IE<6 comment hack
-    # url() don't need quotes
-    css = re.sub(r'url\((["\'])([^)]*)\1\)', "url(\\2)", css)
-    # spaces may be safely collapsed as generated content will collapse them anyway
-    css = re.sub(r'\s+', " ", css)
-    return "".join(generate_rules(css))
-
-def generate_rules(css):
-    for rule in re.findall(r'([^{]+){([^}]*)}', css):
-        selectors = []
-        for selector in rule[0].split(','):
-            selectors.append(selector.strip())
-        # order is important, but we still want to discard repetitions
-        properties = {}
-        porder  = []
-        for prop in re.findall('(.*?):(.*?)(;|$)', rule[1]):
-            key = prop[0].strip().lower()
-            if key not in porder:
-                porder.insert(0, key)
-            properties[ key ] = prop[1].strip()
-        porder.reverse()
-        # output rule if it contains any declarations
-        if len(properties) > 0:
-            s = ";".join(key + ":" + properties[key] for key in porder)
-            yield ",".join(selectors) + "{" + s + "}"
+    return "".join(minify_css_chunks([css]))
+
+
+def minify_css_chunks(chunks):
+    """Minify an iterable of strings, yielding the minified CSS in chunks.
+
+    Each top-level rule is yielded as soon as its closing brace is seen, so
+    only the rule being parsed is held in memory.
+    """
+    minifier = CssMinifier()
+    for chunk in chunks:
+        output = minifier.feed(chunk)
+        if output:
+            yield output
+    output = minifier.close()
+    if output:
+        yield output
+
+
+class Atom(str):
+
+    """A string or url() token, which must not be split on semicolons."""
+
+
+def split_statements(pieces):
+    """Join text pieces, splitting them on semicolons outside of atoms."""
+    if len(pieces) == 1 and not isinstance(pieces[0], Atom):
+        return pieces[0].split(";")
+    statements = []
+    current = []
+    for piece in pieces:
+        if isinstance(piece, Atom):
+            current.append(piece)
+            continue
+        parts = piece.split(";")
+        current.append(parts[0])
+        for part in parts[1:]:
+            statements.append("".join(current))
+            current = [part]
+    statements.append("".join(current))
+    return statements
+
+
+class Block(object):
+
+    """A rule or at-rule block being parsed."""
+
+    def __init__(self, prelude):
+        self.prelude = prelude
+        self.properties = {}
+        self.order = []
+        self.children = []
+
+    def add_statement(self, statement):
+        statement = statement.strip()
+        if not statement:
+            return
+        if statement[0] == "@":
+            # A statement at-rule like @import or @charset.
+            self.children.append(statement + ";")
+            return
+        if self.prelude is None:
+            # Stray declarations outside of any rule.
+            return
+        (key, colon, value) = statement.partition(":")
+        if not colon:
+            return
+        key = key.strip().lower()
+        if key not in self.properties:
+            self.order.append(key)
+        self.properties[key] = value.strip()
+
+    def render(self):
+        body = ";".join([key + ":" + self.properties[key]
+                         for key in self.order])
+        children = "".join(self.children)
+        if body and children:
+            body += ";"
+        if not body and not children:
+            # Drop rules that don't contain any declarations.
+            return ""
+        return self.prelude + "{" + body + children + "}"
+
+
+class CssMinifier(object):
+
+    """Incremental CSS minifier.
+
+    Text is fed in with feed(), which returns the minified output of every
+    top-level rule completed so far.  Call close() at the end of the input.
+    """
+
+    def __init__(self):
+        self.pending = ""
+        self.stack = [Block(None)]
+        self.text = []
+
+    def feed(self, css):
+        self.pending += css
+        tokens = list(TOKEN_RE.finditer(self.pending))
+        if not tokens:
+            return ""
+        # The last token may continue in the next chunk, so keep it back.
+        last = tokens.pop()
+        self.pending = self.pending[last.start():]
+        return self._process(tokens)
+
+    def close(self):
+        tokens = list(TOKEN_RE.finditer(self.pending))
+        self.pending = ""
+        output = self._process(tokens)
+        # Close any blocks left open at the end of the stylesheet.
+        self._end_statements()
+        while len(self.stack) > 1:
+            self._close_block()
+        return output + self._take_output()
+
+    def _process(self, tokens):
+        text = self.text
+        for match in tokens:
+            kind = match.lastgroup
+            token = match.group()
+            if kind == "text":
+                # Collapse whitespace, keeping one space at either end.
+                words = token.split()
+                if words:
+                    collapsed = " ".join(words)
+                    if "," in collapsed:
+                        collapsed = collapsed.replace(" ,", ",")
+                        collapsed = collapsed.replace(", ", ",")
+                    if token[-1].isspace():
+                        collapsed += " "
+                else:
+                    collapsed = ""
+                if token[0].isspace() and text and text[-1][-1] not in " ,":
+                    collapsed = " " + collapsed
+                if collapsed:
+                    text.append(collapsed)
+            elif kind == "brace":
+                statements = split_statements(text)
+                del text[:]
+                if token == "{":
+                    prelude = statements.pop().strip()
+                    self._add_statements(statements)
+                    self.stack.append(Block(prelude))
+                else:
+                    self._add_statements(statements)
+                    if len(self.stack) > 1:
+                        self._close_block()
+            elif kind == "comment":
+                if EMPTY_COMMENT_RE.match(token):
+                    # Preserve the IE<6 comment hack.
+                    if text and text[-1][-1] == " ":
+                        text[-1] = text[-1][:-1]
+                    text.append("/**/")
+            elif kind == "url":
+                bare = BARE_URL_RE.match(token)
+                if bare:
+                    text.append(Atom("url(%s)" % bare.group(2)))
+                else:
+                    text.append(Atom(token))
+            elif kind == "string":
+                text.append(Atom(token))
+            else:
+                text.append(token)
+        return self._take_output()
+
+    def _add_statements(self, statements):
+        block = self.stack[-1]
+        for statement in statements:
+            block.add_statement(statement)
+
+    def _end_statements(self):
+        self._add_statements(split_statements(self.text))
+        del self.text[:]
+
+    def _close_block(self):
+        block = self.stack.pop()
+        self.stack[-1].children.append(block.render())
+
+    def _take_output(self):
+        top = self.stack[0]
+        output = "".join(top.children)
+        del top.children[:]
+        return output
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""Tests for the CSS minifier."""
+
+import unittest
+
+from cssmin import minify_css, minify_css_chunks
+
+
+class CssminTest(unittest.TestCase):
+
+    def assertMinifies(self, css, expected):
+        self.assertEqual(minify_css(css), expected)
+        # Splitting the input anywhere must not change the output.
+        for size in (1, 2, 5):
+            chunks = [css[i:i + size] for i in range(0, len(css), size)]
+            self.assertEqual("".join(minify_css_chunks(chunks)), expected)
+
+    def testRules(self):
+        self.assertMinifies("a , b  >  c {\n  color : red ;\n  margin: 0 }\n",
+                            "a,b > c{color:red;margin:0}")
+
+    def testRepeatedProperties(self):
+        # The first position wins, but the last value does.
+        self.assertMinifies("a { color: red; margin: 0; COLOR: blue }",
+                            "a{color:blue;margin:0}")
+
+    def testEmptyRulesDropped(self):
+        self.assertMinifies("a {} b { } c { d: e }", "c{d:e}")
+
+    def testComments(self):
+        self.assertMinifies("/* x { y: z } */ a { b: c /* ; */ d }",
+                            "a{b:c d}")
+        self.assertMinifies("a { b: c } /* unterminated", "a{b:c}")
+
+    def testIEHack(self):
+        self.assertMinifies("html > /* */ body { a: b }",
+                            "html >/**/ body{a:b}")
+
+    def testStrings(self):
+        self.assertMinifies('a { content: "x  ;  }  /* */" }',
+                            'a{content:"x  ;  }  /* */"}')
+
+    def testUrls(self):
+        self.assertMinifies('a { background: url("x.png") }',
+                            "a{background:url(x.png)}")
+        self.assertMinifies("a { background: url('a b.png') }",
+                            "a{background:url('a b.png')}")
+        self.assertMinifies("a { b: url(data:image/png;base64,AA==) }",
+                            "a{b:url(data:image/png;base64,AA==)}")
+
+    def testAtRules(self):
+        self.assertMinifies('@charset "utf-8";\n@import url("a.css") print;\n'
+                            "a { b: c }",
+                            '@charset "utf-8";@import url(a.css) print;a{b:c}')
+        self.assertMinifies("@font-face { font-family: X; src: url(x.ttf) }",
+                            "@font-face{font-family:X;src:url(x.ttf)}")
+
+    def testNestedBlocks(self):
+        self.assertMinifies("@media screen, print {\n  a { b: c }\n  d { }\n}\n"
+                            "e { f: g }",
+                            "@media screen,print{a{b:c}}e{f:g}")
+        self.assertMinifies("@keyframes k { from { a: b } to { a: c } }",
+                            "@keyframes k{from{a:b}to{a:c}}")
+        self.assertMinifies("@media print { }", "")
+
+    def testUnbalancedBraces(self):
+        self.assertMinifies("a { b: c }} d { e: f", "a{b:c}d{e:f}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -30,15 +30,26 @@
 # SOFTWARE.
 # */
 
-def jsmin(js):
-    from StringIO import StringIO
-    ins = StringIO(js)
-    outs = StringIO()
-    JavascriptMinify().minify(ins, outs)
-    str = outs.getvalue()
-    if len(str) > 0 and str[0] == '\n':
-        str = str[1:]
-    return str
+import re
+import string
+
+def jsmin(js, engine='fast'):
+    return ''.join(jsmin_chunks([js], engine))
+
+def jsmin_chunks(chunks, engine='fast'):
+    """Minify an iterable of strings, yielding the minified output in chunks.
+
+    Only a small buffer of input and output is held in memory at a time.
+    engine is a key of ENGINES; both engines produce identical output.
+    """
+    first = True
+    for chunk in ENGINES[engine]().minify_chunks(chunks):
+        if first and chunk:
+            first = False
+            if chunk[0] == '\n':
+                chunk = chunk[1:]
+        if chunk:
+            yield chunk
 
 def isAlphanum(c):
     """return true if the character is a letter, digit, underscore,
@@ -48,6 +59,46 @@ def isAlphanum(c):
             (c >= 'A' and c <= 'Z') or c == '_' or c == '$' or c == '\\' or
             (c is not None and ord(c) > 126))
 
+class ChunkReader(object):
+    """File-like object that reads from an iterable of strings."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+
+    def read(self, size):
+        while self.pos + size > len(self.buffer):
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                break
+            self.buffer = self.buffer[self.pos:] + chunk
+            self.pos = 0
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        pass
+
+class ChunkBuffer(object):
+    """File-like object that collects writes until they are taken."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+
+    def take(self):
+        data = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
 class UnterminatedComment(Exception):
     pass
 
@@ -170,37 +221,40 @@ class JavascriptMinify(object):
         self._action(3)
 
         while self.theA != '\000':
-            if self.theA == ' ':
+            self._step()
+
+    def _step(self):
+        if self.theA == ' ':
+            if isAlphanum(self.theB):
+                self._action(1)
+            else:
+                self._action(2)
+        elif self.theA == '\n':
+            if self.theB in ['{', '[', '(', '+', '-']:
+                self._action(1)
+            elif self.theB == ' ':
+                self._action(3)
+            else:
                 if isAlphanum(self.theB):
                     self._action(1)
                 else:
                     self._action(2)
-            elif self.theA == '\n':
-                if self.theB in ['{', '[', '(', '+', '-']:
+        else:
+            if self.theB == ' ':
+                if isAlphanum(self.theA):
                     self._action(1)
-                elif self.theB == ' ':
+                else:
                     self._action(3)
+            elif self.theB == '\n':
+                if self.theA in ['}', ']', ')', '+', '-', '"', '\'']:
+                    self._action(1)
                 else:
-                    if isAlphanum(self.theB):
-                        self._action(1)
-                    else:
-                        self._action(2)
-            else:
-                if self.theB == ' ':
                     if isAlphanum(self.theA):
                         self._action(1)
                     else:
                         self._action(3)
-                elif self.theB == '\n':
-                    if self.theA in ['}', ']', ')', '+', '-', '"', '\'']:
-                        self._action(1)
-                    else:
-                        if isAlphanum(self.theA):
-                            self._action(1)
-                        else:
-                            self._action(3)
-                else:
-                    self._action(1)
+            else:
+                self._action(1)
 
     def minify(self, instream, outstream):
         self.instream = instream
@@ -212,6 +266,265 @@ class JavascriptMinify(object):
         self._jsmin()
         self.instream.close()
 
+    def minify_chunks(self, chunks, chunk_size=8192):
+        """Like minify(), but read from and yield to iterables of strings."""
+        self.instream = ChunkReader(chunks)
+        self.outstream = output = ChunkBuffer()
+        self.theB = None
+        self.theLookahead = None
+
+        self.theA = '\n'
+        self._action(3)
+        while self.theA != '\000':
+            self._step()
+            if output.size >= chunk_size:
+                yield output.take()
+        yield output.take()
+
+# _get() turns control characters into spaces and carriage returns into
+# linefeeds.  FastJavascriptMinify applies the same translation to whole chunks.
+_CONTROL = ''.join([chr(i) for i in range(32)])
+_TRANSLATED = ''.join([(c in '\r\n') and '\n' or ' ' for c in _CONTROL])
+_STR_TABLE = string.maketrans(_CONTROL, _TRANSLATED)
+_UNICODE_TABLE = dict((ord(c), unicode(t))
+                      for (c, t) in zip(_CONTROL, _TRANSLATED))
+
+# Characters after which a '/' starts a regular expression literal.
+_REGEXP_PRECEDERS = frozenset('(,=:[?!&|;{}\n')
+
+# Characters that keep a following linefeed.
+_KEEP_NEWLINE_AFTER = frozenset('}])+-"\'')
+
+# Characters that keep a preceding linefeed.
+_KEEP_NEWLINE_BEFORE = frozenset('{[(+-')
+
+class FastJavascriptMinify(object):
+    """A faster JavascriptMinify with identical output.
+
+    This runs the same state machine as JavascriptMinify, but over a buffer of
+    pre-translated text instead of calling read(1) for every character.  Runs
+    of ordinary characters, blanks, string and regular expression bodies and
+    comments are each handled with one regular expression match or find().
+    """
+
+    _plain = re.compile(r'[^\x00-\x20\'"/]+')
+    _spaces = re.compile(r' +')
+    _blanks = re.compile(r'[ \n]+')
+    _string_bodies = {
+        "'": re.compile(r"[^'\\\n]+"),
+        '"': re.compile(r'[^"\\\n]+'),
+    }
+    _regexp_body = re.compile(r'[^/\\\n]+')
+
+    def _fill(self):
+        """Append the next input chunk to the buffer.  Return False at EOF."""
+        for chunk in self.chunks:
+            if not chunk:
+                continue
+            if isinstance(chunk, unicode):
+                chunk = chunk.translate(_UNICODE_TABLE)
+            else:
+                chunk = chunk.translate(_STR_TABLE)
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+            return True
+        return False
+
+    def _get(self):
+        if self.pos >= len(self.buf) and not self._fill():
+            return '\000'
+        c = self.buf[self.pos]
+        self.pos += 1
+        return c
+
+    def _peek(self):
+        if self.pos >= len(self.buf) and not self._fill():
+            return '\000'
+        return self.buf[self.pos]
+
+    def _copy_run(self, regexp):
+        """Copy the longest match of regexp at the read position to output."""
+        while True:
+            m = regexp.match(self.buf, self.pos)
+            if m is None:
+                return
+            self.out.append(m.group())
+            self.pos = m.end()
+            if self.pos < len(self.buf) or not self._fill():
+                return
+
+    def _skip_run(self, regexp):
+        """Skip the match of regexp at the read position and return it."""
+        skipped = []
+        while True:
+            m = regexp.match(self.buf, self.pos)
+            if m is None:
+                break
+            skipped.append(m.group())
+            self.pos = m.end()
+            if self.pos < len(self.buf) or not self._fill():
+                break
+        return ''.join(skipped)
+
+    def _next(self):
+        """Like JavascriptMinify._next(), finding comment ends with find()."""
+        pos = self.pos
+        if pos < len(self.buf):
+            c = self.buf[pos]
+            self.pos = pos + 1
+        else:
+            c = self._get()
+        if c == '/' and self.theA != '\\':
+            p = self._peek()
+            if p == '/':
+                self.pos += 1
+                while True:
+                    end = self.buf.find('\n', self.pos)
+                    if end >= 0:
+                        self.pos = end + 1
+                        return '\n'
+                    self.pos = len(self.buf)
+                    if not self._fill():
+                        return '\000'
+            if p == '*':
+                self.pos += 1
+                while True:
+                    end = self.buf.find('*/', self.pos)
+                    if end >= 0:
+                        self.pos = end + 2
+                        return ' '
+                    # Keep the last character, it may be the '*' of a '*/'.
+                    self.pos = max(self.pos, len(self.buf) - 1)
+                    if not self._fill():
+                        raise UnterminatedComment()
+        return c
+
+    def _string(self):
+        """Copy a string literal, leaving its closing quote in theA."""
+        quote = self.theA
+        out = self.out.append
+        out(quote)
+        body = self._string_bodies[quote]
+        while True:
+            self._copy_run(body)
+            c = self._get()
+            if c == quote:
+                break
+            if c <= '\n':
+                raise UnterminatedStringLiteral()
+            if c == '\\':
+                out(c)
+                c = self._get()
+            out(c)
+
+    def _regexp(self):
+        """Copy a regular expression literal, leaving its final '/' in theA."""
+        out = self.out.append
+        out(self.theA)
+        out(self.theB)
+        while True:
+            self._copy_run(self._regexp_body)
+            c = self._get()
+            if c == '/':
+                break
+            elif c == '\\':
+                out(c)
+                c = self._get()
+            elif c <= '\n':
+                raise UnterminatedRegularExpression()
+            out(c)
+        self.theA = '/'
+
+    def _action(self, action):
+        """Same as JavascriptMinify._action()."""
+        if action <= 1:
+            self.out.append(self.theA)
+        if action <= 2:
+            self.theA = self.theB
+            if self.theA == "'" or self.theA == '"':
+                self._string()
+        if action <= 3:
+            self.theB = self._next()
+            if self.theB == '/' and self.theA in _REGEXP_PRECEDERS:
+                self._regexp()
+                self.theB = self._next()
+
+    def minify(self, instream, outstream):
+        chunks = iter(lambda: instream.read(8192), '')
+        for chunk in self.minify_chunks(chunks):
+            outstream.write(chunk)
+        instream.close()
+
+    def minify_chunks(self, chunks, chunk_size=8192):
+        self.chunks = iter(chunks)
+        self.buf = ''
+        self.pos = 0
+        self.out = out = []
+        plain = self._plain.match
+
+        self.theA = '\n'
+        self._action(3)
+        while self.theA != '\000':
+            a = self.theA
+            b = self.theB
+            if a == ' ' or a == '\n':
+                if b == ' ' or b == '\n':
+                    # Every blank after a blank is dropped one action at a
+                    # time, and theA turns into a linefeed if we see one.
+                    newline = (a == '\n' or b == '\n')
+                    if '\n' in self._skip_run(self._blanks):
+                        newline = True
+                    self.theA = newline and '\n' or ' '
+                    self._action(3)
+                elif a == '\n' and b in _KEEP_NEWLINE_BEFORE:
+                    self._action(1)
+                elif isAlphanum(b):
+                    self._action(1)
+                else:
+                    self._action(2)
+            elif b == ' ' or b == '\n':
+                if isAlphanum(a) or (b == '\n' and a in _KEEP_NEWLINE_AFTER):
+                    self._action(1)
+                else:
+                    # Spaces after a punctuator are dropped, and so are
+                    # linefeeds unless the punctuator keeps them.
+                    if a in _KEEP_NEWLINE_AFTER:
+                        self._skip_run(self._spaces)
+                    else:
+                        self._skip_run(self._blanks)
+                    self._action(3)
+            elif b != "'" and b != '"':
+                m = plain(self.buf, self.pos)
+                if m is None:
+                    self._action(1)
+                else:
+                    # Each character of a run of ordinary characters would
+                    # take one action(1), so we copy the whole run at once.
+                    run = m.group()
+                    out.append(a)
+                    out.append(b)
+                    out.append(run[:-1])
+                    self.pos = m.end()
+                    self.theA = run[-1]
+                    self._action(3)
+            else:
+                self._action(1)
+            if len(out) >= 256:
+                # Join the pieces, so the buffer's length is the length of
+                # its first and only item.
+                chunk = ''.join(out)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    del out[:]
+                else:
+                    out[:] = [chunk]
+        yield ''.join(out)
+
+ENGINES = {
+    'fast': FastJavascriptMinify,
+    'reference': JavascriptMinify,
+}
+
 if __name__ == '__main__':
     import sys
     jsm = JavascriptMinify()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""Differential tests for the fast jsmin engine against the reference one."""
+
+import random
+import unittest
+
+from jsmin import FastJavascriptMinify, jsmin, jsmin_chunks
+
+
+# Snippets exercising every branch of the state machine, including the inputs
+# that make it raise.
+CORPUS = [
+    "",
+    "\n",
+    "var a = 1;",
+    "var  a\t=\t1 ;\r\n",
+    "function foo(a, b) {\n    return a + b;\n}\n",
+    "if (a)\n{\n  b();\n}\nelse\n  c();\n",
+    "a\n++b\n--c\n(d)\n[e]\n{f}\n",
+    "x = y\n+ z\n- w",
+    "return\n'str'\n\"str\"\n)\n]\n}\n",
+    "var s = 'it\\'s', t = \"a \\\"b\\\" c\";",
+    "var s = 'a\\\nb';",
+    "var s = 'tab\there';",
+    "var s = 'unterminated",
+    "var s = 'broken\nline';",
+    "var s = \"escape at end\\",
+    "// only a comment",
+    "a = 1; // trailing comment\nb = 2;",
+    "a = 1; /* block\n comment */ b = 2;",
+    "a = /* inline */ b;",
+    "/**/x/***/y/* * / */z",
+    "a = 1; /* unterminated",
+    "a = 1; /*/ not closed",
+    "var r = /ab+c/g, s = /[/]\\//;",
+    "f(/x/); g(a, /y/); h = !/z/.test(s);",
+    "a ? /b/ : /c/; a && /d/; a || /e/;",
+    "{ /f/ } ; /g/\n/h/",
+    "var r = /unterminated",
+    "var r = /broken\n/;",
+    "var r = /escape at end\\",
+    "a = b / c / d;",
+    "a = b\n/ c;",
+    "a\\/b",
+    "a = b /= c;",
+    "x = '\\\\'; y = 1",
+    "$foo_bar = _baz$ + \\u0041;",
+    "var caf\xc3\xa9 = '\xc3\xa9';",
+    u"var caf\xe9 = '\u2603';",
+    "a\x00b\x0bc\x1fd",
+    "a  \n  \n  b",
+    "a; \n \n ;b",
+    "a} \n \n }b",
+    "a + \n + b",
+    "a - -b; a + +b; a++ + ++b",
+    "  \n\n  leading blanks",
+    "trailing blanks  \n\n  ",
+    "a = [1, 2, 3]\n[0]",
+    "a = 'x'\n'y'",
+    "\"use strict\";\nvar a;",
+]
+
+# Characters and tokens the fuzzer builds programs from.  Most tokens are well
+# formed so that plenty of programs minify without raising.
+ALPHABET = (list("abcxyz019_$\\") + list("\n\r\t ") * 3 +
+            list("(){}[];,=:?!&|+-<>./*'\"") + ["\x00", "\x0b", "\xc3\xa9"])
+
+TOKENS = ["/* c */", "/**/", "// c\n", "'s'", '"s"', "'\\''", '"\\/"',
+          "/re/g", "/[\\/]/", "a / b", "return", "var", "  ", "\n\n", "\r\n",
+          "//", "/*", "*/", "\\/"]
+
+
+def minify(js, engine, chunk_size=None):
+    """Return the minified output or the name of the exception raised."""
+    if chunk_size:
+        chunks = [js[i:i + chunk_size] for i in range(0, len(js), chunk_size)]
+    else:
+        chunks = [js]
+    try:
+        return "".join(jsmin_chunks(chunks, engine))
+    except Exception, e:
+        return e.__class__.__name__
+
+
+def random_program(rng, length):
+    parts = []
+    for _ in xrange(length):
+        if rng.random() < 0.3:
+            parts.append(rng.choice(TOKENS))
+        else:
+            parts.append(rng.choice(ALPHABET))
+    return "".join(parts)
+
+
+class JsminTest(unittest.TestCase):
+
+    def assertSameOutput(self, js):
+        expected = minify(js, "reference")
+        self.assertEqual(minify(js, "fast"), expected, repr(js))
+        for chunk_size in (1, 2, 3, 7):
+            actual = minify(js, "fast", chunk_size)
+            self.assertEqual(actual, expected, repr((js, chunk_size)))
+
+    def testCorpus(self):
+        for js in CORPUS:
+            self.assertSameOutput(js)
+
+    def testRandomPrograms(self):
+        rng = random.Random(1234)
+        for _ in xrange(2000):
+            self.assertSameOutput(random_program(rng, rng.randrange(1, 60)))
+
+    def testLongRuns(self):
+        js = "var " + "a" * 20000 + " = '" + "b" * 20000 + "';" + " " * 20000
+        self.assertSameOutput(js)
+
+    def testChunkSize(self):
+        # Every chunk but the last is at least chunk_size long.
+        js = "var a = 1;\n" * 20000
+        chunks = list(FastJavascriptMinify().minify_chunks([js], 8192))
+        self.assert_(len(chunks) > 2)
+        for chunk in chunks[:-1]:
+            self.assert_(8192 <= len(chunk) < 8192 + 4096, len(chunk))
+        self.assertEqual("".join(chunks), "\n" + "var a=1;" * 20000)
+
+    def testJsminDefault(self):
+        self.assertEqual(jsmin("var  a = 1 ;\n"), "var a=1;")
+        self.assertEqual(jsmin("var  a = 1 ;\n", "reference"), "var a=1;")
+
+
+if __name__ == "__main__":
+    unittest.main()
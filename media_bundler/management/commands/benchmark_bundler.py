@@ -0,0 +1,113 @@
+# media_bundler/management/commands/benchmark_bundler.py
+
+"""
+A Django management command to benchmark the media bundler.
+
+Run it before and after a change with the same corpus options, saving the first
+run with --output and comparing the second with --baseline, to see whether the
+change made bundling slower.
+"""
+
+from optparse import make_option
+import shutil
+import sys
+import tempfile
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from media_bundler.benchmark import (BENCHMARKS, DEFAULT_THRESHOLD,
+                                     compare_results, load_results,
+                                     make_corpus, run_benchmarks,
+                                     save_results)
+
+
+class Command(NoArgsCommand):
+
+    """Times the bundling pipeline on a synthetic corpus."""
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--js-files", type="int", dest="js_files", default=20,
+                    help="Number of JavaScript files in the corpus."),
+        make_option("--css-files", type="int", dest="css_files", default=20,
+                    help="Number of CSS files in the corpus."),
+        make_option("--icons", type="int", dest="icons", default=200,
+                    help="Number of PNG icons in the corpus."),
+        make_option("--seed", type="int", dest="seed", default=0,
+                    help="Seed for generating the corpus."),
+        make_option("--repeat", type="int", dest="repeat", default=3,
+                    help="Number of times to run each benchmark.  The best "
+                         "time is reported."),
+        make_option("--only", action="append", dest="only", default=[],
+                    help="Only run this benchmark.  Can be repeated."),
+        make_option("--output", dest="output", default=None,
+                    help="Write the results to this JSON file."),
+        make_option("--baseline", dest="baseline", default=None,
+                    help="Compare the results with this JSON file, and fail "
+                         "if any benchmark's throughput regressed."),
+        make_option("--threshold", type="float", dest="threshold",
+                    default=DEFAULT_THRESHOLD,
+                    help="Fraction of the baseline's throughput a benchmark "
+                         "may lose before it counts as a regression.  "
+                         "Defaults to %s." % DEFAULT_THRESHOLD),
+        make_option("--keep-corpus", action="store_true",
+                    dest="keep_corpus", default=False,
+                    help="Don't delete the generated corpus afterwards."),
+    )
+
+    def handle_noargs(self, **options):
+        names = options.get("only") or []
+        known = [name for (name, _) in BENCHMARKS]
+        for name in names:
+            if name not in known:
+                raise CommandError("Unknown benchmark %r, expected one of: %s"
+                                   % (name, ", ".join(known)))
+        if options.get("icons", 200) < 1:
+            raise CommandError("The corpus needs at least one icon.")
+        baseline = None
+        if options.get("baseline"):
+            try:
+                baseline = load_results(options["baseline"])
+            except (IOError, ValueError), e:
+                raise CommandError("Can't read the baseline: %s" % e)
+        verbosity = int(options.get("verbosity", 1))
+        root = tempfile.mkdtemp(prefix="bundler-benchmark-")
+        try:
+            corpus = make_corpus(root, options.get("js_files", 20),
+                                 options.get("css_files", 20),
+                                 options.get("icons", 200),
+                                 options.get("seed", 0))
+            def report(name, result):
+                if verbosity >= 1:
+                    sys.stdout.write("%-20s %11.6fs %14.1f %s/s\n" %
+                                     (name, result["seconds"],
+                                      result["throughput"] or 0,
+                                      result["unit"]))
+            results = run_benchmarks(corpus, names, options.get("repeat", 3),
+                                     report)
+        finally:
+            if options.get("keep_corpus"):
+                sys.stdout.write("Corpus left in %s\n" % root)
+            else:
+                shutil.rmtree(root, ignore_errors=True)
+        if options.get("output"):
+            save_results(results, options["output"])
+        if baseline:
+            self.check_baseline(results, baseline, options.get("threshold"),
+                                verbosity)
+
+    def check_baseline(self, results, baseline, threshold, verbosity):
+        try:
+            comparisons = compare_results(results, baseline, threshold)
+        except ValueError, e:
+            raise CommandError(str(e))
+        regressed = []
+        for (name, old, new, change, is_regression) in comparisons:
+            if verbosity >= 1:
+                sys.stdout.write("%-20s %+6.1f%% vs baseline%s\n" %
+                                 (name, 100 * change,
+                                  is_regression and "  REGRESSED" or ""))
+            if is_regression:
+                regressed.append(name)
+        if regressed:
+            raise CommandError("Throughput regressed by more than %d%%: %s" %
+                               (100 * threshold, ", ".join(regressed)))
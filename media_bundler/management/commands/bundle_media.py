@@ -7,30 +7,203 @@ This command should be integrated into any build or deploy process used with
 the project.
 """
 
-from django.core.management.base import NoArgsCommand
+from __future__ import with_statement
+
+from optparse import make_option
+import os
+import sys
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.core.management.base import CommandError, NoArgsCommand
 
 from media_bundler.conf import bundler_settings
 from media_bundler import bundler
+from media_bundler import staging
+from media_bundler import stats
 from media_bundler import versioning
+from media_bundler.build import BundleBuilder, SourceError
+from media_bundler.manifest import BuildManifest
+from media_bundler.retention import collect_garbage
+from media_bundler.staging import Stage
+from media_bundler.watch import (get_affected_bundles, get_source_index,
+                                 make_watcher, watch)
 
 
 class Command(NoArgsCommand):
 
     """Bundles your media as specified in settings.py."""
 
+    option_list = NoArgsCommand.option_list + (
+        make_option("--force", action="store_true", dest="force",
+                    default=False,
+                    help="Rebuild every bundle, even if the build manifest "
+                         "says it is up to date."),
+        make_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                    help="Number of bundles to build in parallel.  Use 0 for "
+                         "one job per CPU."),
+        make_option("--gzip", action="store_true", dest="gzip",
+                    default=False,
+                    help="Also write maximally compressed .gz copies of "
+                         "JavaScript and CSS bundles, for servers that can "
+                         "serve them directly."),
+        make_option("--gc", action="store_true", dest="gc", default=False,
+                    help="Delete old versioned bundles, keeping the newest "
+                         "--keep versions of each and the current one."),
+        make_option("--keep", type="int", dest="keep", default=5,
+                    help="Number of versions of each bundle to keep with "
+                         "--gc.  Defaults to 5."),
+        make_option("--dry-run", action="store_true", dest="dry_run",
+                    default=False,
+                    help="With --gc, only list the files that would be "
+                         "deleted."),
+        make_option("--staged", action="store_true", dest="staged",
+                    default=False,
+                    help="Write everything to staging directories and only "
+                         "publish the new bundles once they have all been "
+                         "built, so the site never sees a partial build."),
+        make_option("--stats-json", dest="stats_json", default=None,
+                    metavar="PATH",
+                    help="Write the build stats of the rebuilt bundles to "
+                         "this JSON file."),
+        make_option("--profile", dest="profile_dir", default=None,
+                    metavar="DIR",
+                    help="Profile each stage of every rebuilt bundle, and "
+                         "write the profiles to this directory as "
+                         "<bundle>.<stage>.prof."),
+        make_option("--watch", action="store_true", dest="watch",
+                    default=False,
+                    help="After building, keep watching the source files and "
+                         "rebuild the bundles that use a file when it "
+                         "changes."),
+        make_option("--poll", action="store_true", dest="poll",
+                    default=False,
+                    help="With --watch, poll the files for changes even if "
+                         "pyinotify is installed."),
+        make_option("--interval", type="float", dest="interval",
+                    default=1.0,
+                    help="With --watch, seconds between polls for changes.  "
+                         "Defaults to 1."),
+        make_option("--debounce", type="float", dest="debounce",
+                    default=0.2,
+                    help="With --watch, seconds to wait for more changes "
+                         "before rebuilding.  Defaults to 0.2."),
+    )
+
     def handle_noargs(self, **options):
-        version_file = bundler_settings.BUNDLE_VERSION_FILE
-        if version_file:
-            vers_str = bundler_settings.BUNDLE_VERSIONER
-            versioner = versioning.VERSIONERS[vers_str]()
+        if bundler_settings.BUNDLE_VERSION_FILE:
+            versioner_name = bundler_settings.BUNDLE_VERSIONER
         else:
-            versioner = None
-        # We do the image bundles first because they generate CSS that may get
-        # bundled by a CssBundle.
-        def key(bundle):
-            return -int(isinstance(bundle, bundler.PngSpriteBundle))
-        bundles = sorted(bundler.get_bundles().itervalues(), key=key)
-        for bundle in bundles:
-            bundle.make_bundle(versioner)
-        if versioner:
-            versioning.write_versions(versioner.versions)
+            versioner_name = None
+        if options.get("gc") and not versioner_name:
+            raise CommandError("--gc requires BUNDLE_VERSION_FILE to be set.")
+        verbosity = int(options.get("verbosity", 1))
+        manifest_file = bundler_settings.BUNDLE_MANIFEST_FILE
+        manifest = BuildManifest(manifest_file) if manifest_file else None
+        bundles = bundler.get_bundles().values()
+        profile_dir = options.get("profile_dir")
+        if profile_dir:
+            profile_dir = os.path.abspath(profile_dir)
+            if not os.path.isdir(profile_dir):
+                os.makedirs(profile_dir)
+            options["profile_dir"] = profile_dir
+        builder = self.build(bundles, versioner_name, manifest,
+                             options.get("force", False), options)
+        if options.get("gc"):
+            dry_run = options.get("dry_run", False)
+            removed = collect_garbage(bundler.get_bundles().values(),
+                                      builder.versioner.versions, manifest,
+                                      options.get("keep", 5), dry_run)
+            if verbosity >= 1:
+                verb = "Would remove" if dry_run else "Removed"
+                for path in removed:
+                    sys.stdout.write("%s %s\n" % (verb, path))
+        if options.get("watch"):
+            self.watch(bundles, versioner_name, manifest, options)
+
+    def build(self, bundles, versioner_name, manifest, force, options):
+        """Build the out of date bundles among bundles.
+
+        The new versions are merged into the version file and the manifest is
+        saved, so bundles that aren't rebuilt keep theirs.
+        """
+        verbosity = int(options.get("verbosity", 1))
+        version_files = []
+        if versioner_name:
+            version_files.append(bundler_settings.BUNDLE_VERSION_FILE)
+        stage = None
+        if options.get("staged"):
+            paths = [path for bundle in bundles
+                     for path in bundle.get_output_paths()]
+            stage = Stage(paths + version_files)
+            stage.create()
+            staging.activate(stage)
+        try:
+            builder = BundleBuilder(bundles,
+                                    versioner_name=versioner_name,
+                                    manifest=manifest,
+                                    force=force,
+                                    jobs=options.get("jobs", 1),
+                                    gzip=options.get("gzip", False),
+                                    verbosity=verbosity,
+                                    profile_dir=options.get("profile_dir"))
+            try:
+                builder.run()
+            except SourceError, e:
+                raise CommandError(str(e))
+            if builder.versioner:
+                versioning.write_versions(builder.versioner.versions,
+                                          builder.removed_versions)
+            if stage:
+                # The version file goes last, once everything it refers to
+                # has been published.
+                stage.publish(last=version_files)
+        finally:
+            if stage:
+                staging.activate(None)
+                stage.discard()
+        if builder.stats and verbosity >= 1:
+            sys.stdout.write(stats.format_table(builder.stats) + "\n")
+        if options.get("stats_json"):
+            with open(options["stats_json"], "w") as output:
+                json.dump({"format": stats.STATS_FORMAT,
+                           "bundles": builder.stats},
+                          output, indent=1, sort_keys=True)
+                output.write("\n")
+        if manifest:
+            manifest.prune(bundler.get_bundles())
+            manifest.save()
+        return builder
+
+    def watch(self, bundles, versioner_name, manifest, options):
+        """Rebuild the bundles affected by each change until interrupted."""
+        verbosity = int(options.get("verbosity", 1))
+        index = get_source_index(bundles)
+        bundles_by_name = dict((bundle.name, bundle) for bundle in bundles)
+        watcher = make_watcher(index.keys(), options.get("poll", False))
+        def rebuild(changed):
+            names = get_affected_bundles(bundles, index, changed)
+            if verbosity >= 2:
+                for path in sorted(changed):
+                    sys.stdout.write("Changed %s\n" % path)
+            if not names:
+                return
+            try:
+                self.build([bundles_by_name[name] for name in sorted(names)],
+                           versioner_name, manifest, False, options)
+            except Exception, e:
+                # Keep watching, the next save will probably fix it.
+                sys.stderr.write("Build failed: %s\n" % e)
+        if verbosity >= 1:
+            sys.stdout.write("Watching %d files for changes, press Ctrl-C "
+                             "to stop.\n" % len(index))
+        try:
+            watch(watcher, rebuild, options.get("interval", 1.0),
+                  options.get("debounce", 0.2))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
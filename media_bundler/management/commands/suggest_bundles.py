@@ -0,0 +1,264 @@
+# media_bundler/management/commands/suggest_bundles.py
+
+"""
+A Django management command to suggest how to split media into bundles.
+
+It scans the project's templates for the bundler's tags to find the files
+each page uses, and prints a MEDIA_BUNDLES setting that regroups the files of
+the Javascript and CSS bundles to keep the bytes and requests per page down.
+See media_bundler.partition for how the groups are chosen.
+"""
+
+from __future__ import with_statement
+
+from optparse import make_option
+import os
+import sys
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+
+from media_bundler.conf import bundler_settings
+from media_bundler.partition import (find_templates, get_cost, get_page_usage,
+                                     load_weights, partition_files,
+                                     scan_template)
+
+
+PARTITIONED_TYPES = ("javascript", "css")
+
+
+def get_template_dirs():
+    """Return the directories Django loads templates from."""
+    dirs = list(settings.TEMPLATE_DIRS)
+    try:
+        from django.template.loaders.app_directories import app_template_dirs
+    except ImportError:
+        app_template_dirs = ()
+    dirs.extend(app_template_dirs)
+    return dirs
+
+
+def get_family(attrs):
+    """Return a key shared by the bundles whose files may be regrouped.
+
+    Those are the bundles that only differ in their names and files.
+    """
+    options = dict((key, value) for (key, value) in attrs.iteritems()
+                   if key not in ("name", "files"))
+    return json.dumps(options, sort_keys=True)
+
+
+def format_bundle(attrs):
+    keys = ["type", "name", "path", "url"]
+    keys.extend(sorted(key for key in attrs
+                       if key not in keys and key != "files"))
+    lines = []
+    for key in keys:
+        if key in attrs:
+            lines.append("%r: %r," % (key, attrs[key]))
+    lines.append("%r: (" % "files")
+    lines.extend("    %r," % file for file in attrs["files"])
+    lines[0] = "    {" + lines[0]
+    lines[1:] = ["     " + line for line in lines[1:]]
+    lines.append("     )},")
+    return "\n".join(lines)
+
+
+class Command(NoArgsCommand):
+
+    """Suggests a MEDIA_BUNDLES setting from how templates use the media."""
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--template-dir", action="append", dest="template_dirs",
+                    default=[],
+                    help="Scan this directory for templates instead of "
+                         "TEMPLATE_DIRS and the apps' template directories.  "
+                         "Can be repeated."),
+        make_option("--weights", dest="weights", default=None,
+                    metavar="PATH",
+                    help="Weigh pages by the request counts in this file, "
+                         "one \"count template_name\" per line, as written "
+                         "by `sort | uniq -c` on a log of rendered "
+                         "templates.  Only the templates listed are counted "
+                         "as pages."),
+        make_option("--request-bytes", type="int", dest="request_bytes",
+                    default=4096,
+                    help="How many bytes of download an extra request is "
+                         "worth.  Higher values make bigger bundles.  "
+                         "Defaults to 4096."),
+        make_option("--output", dest="output", default=None,
+                    help="Write the setting to this file instead of "
+                         "standard output."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        dirs = options.get("template_dirs") or get_template_dirs()
+        scanned = {}
+        for (name, path) in sorted(find_templates(dirs).iteritems()):
+            with open(path) as input:
+                source = input.read()
+            (uses, parents, skipped) = scan_template(source)
+            for tag in skipped:
+                if verbosity >= 2:
+                    sys.stderr.write("Skipped %s in %s: the arguments aren't "
+                                     "literal strings.\n" % (tag, name))
+            scanned[name] = (uses, parents)
+        if not scanned:
+            raise CommandError("No templates found in %s." % ", ".join(dirs))
+        weights = None
+        if options.get("weights"):
+            try:
+                weights = load_weights(options["weights"])
+            except (IOError, ValueError), e:
+                raise CommandError("Can't read the weights: %s" % e)
+            pages = [name for name in sorted(weights) if name in scanned]
+            if not pages:
+                raise CommandError("None of the weighted templates were "
+                                   "found.")
+        else:
+            pages = None
+        usage = get_page_usage(scanned, pages)
+
+        bundles = list(bundler_settings.MEDIA_BUNDLES)
+        by_name = dict((attrs["name"], attrs) for attrs in bundles)
+        # Files are identified by their family and name, since bundles of the
+        # same family share a directory.
+        families = {}
+        owners = {}
+        sizes = {}
+        for attrs in bundles:
+            if attrs["type"] not in PARTITIONED_TYPES:
+                continue
+            family = get_family(attrs)
+            for file_name in attrs["files"]:
+                file = (family, file_name)
+                if file in owners:
+                    continue
+                families.setdefault(family, []).append(file)
+                owners[file] = attrs["name"]
+                path = os.path.join(attrs["path"], file_name)
+                # Generated files, like sprite CSS, may not exist yet.
+                sizes[file] = 0
+                if os.path.exists(path):
+                    sizes[file] = os.path.getsize(path)
+        page_files = []
+        for page in sorted(usage):
+            used = set()
+            for (bundle_name, file_name) in usage[page]:
+                attrs = by_name.get(bundle_name)
+                if attrs is None:
+                    sys.stderr.write("Unknown bundle %r in %s.\n" %
+                                     (bundle_name, page))
+                    continue
+                if attrs["type"] not in PARTITIONED_TYPES:
+                    continue
+                family = get_family(attrs)
+                if file_name is None:
+                    used.update((family, name) for name in attrs["files"])
+                elif file_name in attrs["files"]:
+                    used.add((family, file_name))
+                else:
+                    sys.stderr.write("File %r is not in bundle %r in %s.\n" %
+                                     (file_name, bundle_name, page))
+            weight = weights[page] if weights is not None else 1
+            page_files.append((weight, used))
+
+        old_groups = [[(get_family(attrs), file_name)
+                       for file_name in attrs["files"]]
+                      for attrs in bundles
+                      if attrs["type"] in PARTITIONED_TYPES]
+        new_groups = {}
+        for (family, files) in families.iteritems():
+            new_groups[family] = partition_files(files, page_files, sizes,
+                                                 options.get("request_bytes",
+                                                             4096))
+        output = self.format_setting(bundles, new_groups, owners,
+                                     get_cost(old_groups, page_files, sizes),
+                                     get_cost([group for groups
+                                               in new_groups.itervalues()
+                                               for group in groups],
+                                              page_files, sizes),
+                                     len(page_files))
+        if options.get("output"):
+            with open(options["output"], "w") as out:
+                out.write(output)
+        else:
+            sys.stdout.write(output)
+
+    def format_setting(self, bundles, new_groups, owners, old_cost, new_cost,
+                       page_count):
+        names = self.name_groups(bundles, new_groups, owners)
+        lines = [
+            "# Suggested by 'manage.py suggest_bundles' from %d pages." %
+            page_count,
+            "# Javascript and CSS per page before minifying: %d bytes in "
+            "%.2f requests," % new_cost,
+            "# was %d bytes in %.2f requests." % old_cost,
+        ]
+        moved = sorted((owners[file], file[1], names[id(group)])
+                       for groups in new_groups.itervalues()
+                       for group in groups for file in group
+                       if names[id(group)] != owners[file])
+        if moved:
+            lines.append("#")
+            lines.append("# Templates need to name the new bundles of these "
+                         "files:")
+            lines.extend("#   %s %s -> %s" % move for move in moved)
+        lines.append("")
+        lines.append("MEDIA_BUNDLES = (")
+        done = set()
+        for attrs in bundles:
+            if attrs["type"] not in PARTITIONED_TYPES:
+                lines.append(format_bundle(attrs))
+                continue
+            family = get_family(attrs)
+            if family in done:
+                continue
+            done.add(family)
+            for group in new_groups[family]:
+                new_attrs = dict(attrs)
+                new_attrs["name"] = names[id(group)]
+                new_attrs["files"] = tuple(file_name
+                                           for (_, file_name) in group)
+                lines.append(format_bundle(new_attrs))
+        lines.append(")")
+        return "\n".join(lines) + "\n"
+
+    def name_groups(self, bundles, new_groups, owners):
+        """Name each group, keeping the names of bundles that didn't change.
+
+        Other groups are named after the bundle of their first file.  Returns
+        a dict keyed on the ids of the groups.
+        """
+        original = dict((attrs["name"], tuple(attrs["files"]))
+                        for attrs in bundles)
+        taken = set(original)
+        names = {}
+        groups = [group for family in sorted(new_groups)
+                  for group in new_groups[family]]
+        for group in groups:
+            owner = owners[group[0]]
+            if tuple(file_name for (_, file_name) in group) == original[owner]:
+                names[id(group)] = owner
+        kept = set(names.itervalues())
+        for group in groups:
+            if id(group) in names:
+                continue
+            owner = owners[group[0]]
+            if owner not in kept:
+                # The first group to take files from a bundle keeps its name.
+                names[id(group)] = owner
+                kept.add(owner)
+                continue
+            index = 2
+            while "%s-%d" % (owner, index) in taken:
+                index += 1
+            names[id(group)] = "%s-%d" % (owner, index)
+            taken.add(names[id(group)])
+        return names
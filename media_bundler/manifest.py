@@ -0,0 +1,157 @@
+# media_bundler/manifest.py
+
+"""
+Build manifest for incremental bundling.
+
+The manifest remembers, for every bundle, a fingerprint of everything that went
+into building it (bundle type, build options, and the name, size, mtime and
+content hash of each source file) along with the version it produced.  The
+bundle_media command compares a fresh fingerprint against the manifest and
+skips any bundle whose inputs and outputs are still current.  The manifest also
+keeps a short history of the versions each bundle has produced, newest first,
+which the garbage collector uses to decide which versioned files to keep.
+"""
+
+from __future__ import with_statement
+
+from hashlib import sha1
+import os
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+
+MANIFEST_FORMAT = 1
+
+# How many past versions of each bundle to remember.
+HISTORY_LENGTH = 50
+
+
+def hash_file(path, chunk_size=2**14):
+    """Return the SHA-1 hex digest of a file's contents."""
+    m = sha1()
+    with open(path, "rb") as input:
+        chunk = input.read(chunk_size)
+        while chunk:
+            m.update(chunk)
+            chunk = input.read(chunk_size)
+    return m.hexdigest()
+
+
+def fingerprint_file(path, previous=None):
+    """Return the [size, mtime, digest] of a file.
+
+    previous is an earlier fingerprint of the same file, whose hash is reused
+    if the size and mtime still match.
+    """
+    st = os.stat(path)
+    if previous and previous[0] == st.st_size and previous[1] == st.st_mtime:
+        digest = previous[2]
+    else:
+        digest = hash_file(path)
+    return [st.st_size, st.st_mtime, digest]
+
+
+def fingerprint_bundle(bundle, previous=None, extra=None):
+    """Return a JSON-serializable fingerprint of a bundle's inputs.
+
+    Content hashes are expensive, so if a file's size and mtime match the ones
+    recorded in the previous fingerprint, we reuse the recorded hash.
+    """
+    old_files = {}
+    if previous:
+        for (name, size, mtime, digest) in previous.get("files", ()):
+            old_files[name] = (size, mtime, digest)
+    files = []
+    for (name, path) in zip(bundle.files, bundle.get_input_paths()):
+        files.append([name] + fingerprint_file(path, old_files.get(name)))
+    options = bundle.get_build_options()
+    if extra:
+        options.update(extra)
+    return {"type": bundle.type, "options": options, "files": files}
+
+
+def _changed_files(old_files, new_files):
+    old = dict((f[0], f[3]) for f in old_files)
+    return [f[0] for f in new_files if old.get(f[0]) != f[3]]
+
+
+class BuildManifest(object):
+
+    """Persistent record of bundle fingerprints and the versions they built."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as input:
+                data = json.load(input)
+        except (IOError, ValueError):
+            # A missing or corrupt manifest just means we rebuild everything.
+            return
+        if data.get("format") == MANIFEST_FORMAT:
+            self.entries = data.get("bundles", {})
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as output:
+            json.dump({"format": MANIFEST_FORMAT, "bundles": self.entries},
+                      output, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def prune(self, names):
+        """Forget bundles that are no longer configured."""
+        for name in set(self.entries) - set(names):
+            del self.entries[name]
+
+    def get_history(self, name):
+        """Return the versions a bundle has had, newest first."""
+        entry = self.entries.get(name) or {}
+        return entry.get("history", [])
+
+    def record(self, bundle, fingerprint, version=None):
+        history = self.get_history(bundle.name)
+        if version:
+            history = [version] + [v for v in history if v != version]
+        entry = dict(fingerprint)
+        entry["version"] = version
+        entry["history"] = history[:HISTORY_LENGTH]
+        self.entries[bundle.name] = entry
+
+    def rebuild_reason(self, bundle, fingerprint, version=None):
+        """Return why a bundle needs rebuilding, or None if it is current.
+
+        version is the versioned filename currently published for the bundle,
+        or None if versioning is disabled.
+        """
+        entry = self.entries.get(bundle.name)
+        if entry is None:
+            return "new bundle"
+        if entry.get("type") != fingerprint["type"]:
+            return "bundle type changed"
+        if entry.get("options") != fingerprint["options"]:
+            return "options changed"
+        old_names = [f[0] for f in entry.get("files", ())]
+        if old_names != [f[0] for f in fingerprint["files"]]:
+            return "file list changed"
+        changed = _changed_files(entry["files"], fingerprint["files"])
+        if changed:
+            return "changed: " + ", ".join(changed)
+        for path in bundle.get_output_paths():
+            if not os.path.exists(path):
+                return "output missing: " + os.path.basename(path)
+        if entry.get("version") != version:
+            return "version out of date"
+        if version:
+            versioned_path = os.path.join(bundle.path, version)
+            if not os.path.exists(versioned_path):
+                return "output missing: " + version
+        return None
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Tests for deciding which bundles need rebuilding."""
+
+import os
+import unittest
+
+from test_support import BundleTestCase
+
+from media_bundler.bundler import Bundle
+from media_bundler.manifest import BuildManifest, fingerprint_bundle
+
+
+class RebuildReasonTest(BundleTestCase):
+
+    def setUp(self):
+        super(RebuildReasonTest, self).setUp()
+        self.write("a.js", "var a;")
+        self.write("b.js", "var b;")
+        self.write("app.js", "var a;var b;")
+        self.bundle = self.make_bundle(["a.js", "b.js"])
+        self.manifest = BuildManifest(self.path("manifest.json"))
+        self.manifest.record(self.bundle, fingerprint_bundle(self.bundle))
+
+    def make_bundle(self, files, url="/media/"):
+        return Bundle.from_dict({"type": "javascript", "name": "app",
+                                 "path": self.dir, "url": url,
+                                 "files": files})
+
+    def get_reason(self, bundle=None, version=None, extra=None):
+        bundle = bundle or self.bundle
+        fingerprint = fingerprint_bundle(bundle,
+                                         self.manifest.get(bundle.name), extra)
+        return self.manifest.rebuild_reason(bundle, fingerprint, version)
+
+    def set_mtime(self, filename, mtime):
+        os.utime(self.path(filename), (mtime, mtime))
+
+    def testUpToDate(self):
+        self.assertEqual(self.get_reason(), None)
+
+    def testNewBundle(self):
+        manifest = BuildManifest(self.path("other.json"))
+        self.assertEqual(manifest.rebuild_reason(
+            self.bundle, fingerprint_bundle(self.bundle)), "new bundle")
+
+    def testChanged(self):
+        self.write("b.js", "var c;")
+        self.assertEqual(self.get_reason(), "changed: b.js")
+
+    def testFileListChanged(self):
+        self.assertEqual(self.get_reason(self.make_bundle(["b.js", "a.js"])),
+                         "file list changed")
+        self.assertEqual(self.get_reason(self.make_bundle(["a.js"])),
+                         "file list changed")
+
+    def testOptionsChanged(self):
+        self.assertEqual(self.get_reason(self.make_bundle(["a.js", "b.js"],
+                                                          "/static/")),
+                         "options changed")
+        self.assertEqual(self.get_reason(extra={"gzip": True}),
+                         "options changed")
+
+    def testOutputMissing(self):
+        os.remove(self.path("app.js"))
+        self.assertEqual(self.get_reason(), "output missing: app.js")
+
+    def testVersionOutOfDate(self):
+        self.write("app.0123456789.js", "var a;var b;")
+        self.assertEqual(self.get_reason(version="app.0123456789.js"),
+                         "version out of date")
+        self.manifest.record(self.bundle, fingerprint_bundle(self.bundle),
+                             "app.0123456789.js")
+        self.assertEqual(self.get_reason(version="app.0123456789.js"), None)
+        os.remove(self.path("app.0123456789.js"))
+        self.assertEqual(self.get_reason(version="app.0123456789.js"),
+                         "output missing: app.0123456789.js")
+
+    def testTouchedFileNotChanged(self):
+        # A new mtime alone isn't a change, and the new mtime is recorded.
+        self.set_mtime("a.js", 1000000000)
+        self.assertEqual(self.get_reason(), None)
+        fingerprint = fingerprint_bundle(self.bundle, self.manifest.get("app"))
+        self.assertEqual(fingerprint["files"][0][2], 1000000000)
+        self.assertEqual(fingerprint["files"][0][3],
+                         self.manifest.get("app")["files"][0][3])
+
+    def testStoredHashReused(self):
+        # Files whose size and mtime still match aren't hashed again.
+        entry = self.manifest.get("app")
+        entry["files"][0][3] = "stored"
+        fingerprint = fingerprint_bundle(self.bundle, entry)
+        self.assertEqual(fingerprint["files"][0][3], "stored")
+        self.set_mtime("a.js", 1000000000)
+        fingerprint = fingerprint_bundle(self.bundle, entry)
+        self.assertNotEqual(fingerprint["files"][0][3], "stored")
+
+
+if __name__ == '__main__':
+    unittest.main()
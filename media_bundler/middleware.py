@@ -0,0 +1,68 @@
+# media_bundler/middleware.py
+
+"""
+Middleware sending preload hints for the bundles a page links.
+
+The {% javascript %}, {% css %} and {% load_bundle %} tags record every URL
+they link in the request's PreloadHints, which the preload context processor
+makes available to templates.  PreloadMiddleware then turns them into a Link
+header, so browsers and proxies can start fetching bundles before they have
+parsed the page.  To use it, add "media_bundler.context_processors.preload" to
+TEMPLATE_CONTEXT_PROCESSORS and "media_bundler.middleware.PreloadMiddleware"
+to MIDDLEWARE_CLASSES, and render pages with a RequestContext.
+"""
+
+from media_bundler.conf import bundler_settings
+
+
+class PreloadHints(object):
+
+    """The URLs to preload for one request, in the order they were linked."""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.hints = []
+        self.urls = set()
+
+    def add(self, url, preload_as):
+        if url in self.urls:
+            return
+        if self.limit is not None and len(self.hints) >= self.limit:
+            return
+        self.urls.add(url)
+        self.hints.append((url, preload_as))
+
+    def get_link_header(self):
+        return ", ".join("<%s>; rel=preload; as=%s" % hint
+                         for hint in self.hints)
+
+
+def get_preload_hints(request):
+    """Return the PreloadHints of a request, creating them if need be."""
+    hints = getattr(request, "_bundle_preload_hints", None)
+    if hints is None:
+        hints = PreloadHints(bundler_settings.BUNDLE_PRELOAD_LIMIT)
+        request._bundle_preload_hints = hints
+    return hints
+
+
+def add_preload_hint(context, url, preload_as):
+    """Record a URL to preload if the template is rendering for a request."""
+    hints = context.get("_bundle_preload_hints")
+    if hints is not None:
+        hints.add(url, preload_as)
+
+
+class PreloadMiddleware(object):
+
+    """Adds a Link header preloading the bundles the response linked."""
+
+    def process_response(self, request, response):
+        hints = getattr(request, "_bundle_preload_hints", None)
+        if hints is None or not hints.hints:
+            return response
+        header = hints.get_link_header()
+        if response.has_header("Link"):
+            header = response["Link"] + ", " + header
+        response["Link"] = header
+        return response
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""Tests for preload hints."""
+
+import unittest
+
+import test_support  # Configures Django.
+
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+
+from media_bundler.middleware import (PreloadHints, PreloadMiddleware,
+                                      get_preload_hints)
+
+
+class PreloadHintsTest(unittest.TestCase):
+
+    def testLimit(self):
+        hints = PreloadHints(2)
+        hints.add("/a.js", "script")
+        hints.add("/a.js", "script")
+        hints.add("/b.css", "style")
+        hints.add("/c.js", "script")
+        self.assertEqual(hints.get_link_header(),
+                         "</a.js>; rel=preload; as=script, "
+                         "</b.css>; rel=preload; as=style")
+
+    def testNoLimit(self):
+        hints = PreloadHints()
+        for index in range(100):
+            hints.add("/%d.js" % index, "script")
+        self.assertEqual(len(hints.hints), 100)
+
+
+class PreloadMiddlewareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().get("/")
+
+    def process(self, response):
+        return PreloadMiddleware().process_response(self.request, response)
+
+    def testHeader(self):
+        get_preload_hints(self.request).add("/a.js", "script")
+        response = self.process(HttpResponse())
+        self.assertEqual(response["Link"], "</a.js>; rel=preload; as=script")
+
+    def testAppended(self):
+        get_preload_hints(self.request).add("/a.js", "script")
+        response = HttpResponse()
+        response["Link"] = "</feed>; rel=alternate"
+        response = self.process(response)
+        self.assertEqual(response["Link"], "</feed>; rel=alternate, "
+                                           "</a.js>; rel=preload; as=script")
+
+    def testNoHints(self):
+        response = self.process(HttpResponse())
+        self.assertFalse(response.has_header("Link"))
+        get_preload_hints(self.request)
+        response = self.process(HttpResponse())
+        self.assertFalse(response.has_header("Link"))
+
+
+if __name__ == '__main__':
+    unittest.main()
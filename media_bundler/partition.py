@@ -0,0 +1,203 @@
+# media_bundler/partition.py
+
+"""
+Suggesting bundle splits from how templates use media files.
+
+Every page pays for each bundle it links twice over: once in bytes, for all of
+the bundle's files whether the page uses them or not, and once more for the
+request itself.  Given the files each page uses, and optionally how often each
+page is requested, partition_files() looks for a grouping of files into
+bundles that keeps the expected cost per page low.
+
+It starts from the classes of files that are used by exactly the same pages,
+which can always be bundled together for free, and then greedily merges the
+pair of groups whose merger saves the most, until no merger saves anything.
+Merging groups A and B saves a request on every page that uses both, and costs
+the size of B on pages that only use A and the other way around.  A request is
+counted as request_bytes bytes.
+
+The usage comes from scanning templates for the bundler's tags.  Pages are the
+templates that no other template extends or includes, and each page uses the
+files that it and the templates it extends or includes link.
+"""
+
+from __future__ import with_statement
+
+import os
+import re
+
+
+TAG_RE = re.compile(r"{%\s*(javascript|css|load_bundle|extends|include)\s+"
+                    r"(.*?)\s*%}")
+ARG_RE = re.compile(r"""("[^"]*"|'[^']*'|\S+)""")
+
+
+def _literal(arg):
+    """Return the value of a quoted tag argument, or None for variables."""
+    if len(arg) >= 2 and arg[0] == arg[-1] and arg[0] in "\"'":
+        return arg[1:-1]
+    return None
+
+
+def scan_template(source):
+    """Find the media a template links and the templates it builds on.
+
+    Returns a tuple of a list of (bundle_name, file_name) pairs, with a
+    file_name of None for {% load_bundle %}, a list of the templates it
+    extends or includes, and a list of the tags whose arguments aren't
+    literal strings, which can't be followed.
+    """
+    uses = []
+    parents = []
+    skipped = []
+    for match in TAG_RE.finditer(source):
+        (tag, args) = match.groups()
+        needed = 2 if tag in ("javascript", "css") else 1
+        args = [_literal(arg) for arg in ARG_RE.findall(args)[:needed]]
+        if len(args) < needed or None in args:
+            skipped.append(match.group(0))
+        elif tag in ("extends", "include"):
+            parents.append(args[0])
+        elif tag == "load_bundle":
+            uses.append((args[0], None))
+        else:
+            uses.append(tuple(args))
+    return (uses, parents, skipped)
+
+
+def find_templates(dirs):
+    """Return a dict of the template names and paths under dirs.
+
+    Earlier directories win, like Django's template loaders.
+    """
+    templates = {}
+    for dir in dirs:
+        for (dirpath, dirnames, filenames) in os.walk(dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.startswith("."):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, dir).replace(os.sep, "/")
+                templates.setdefault(name, path)
+    return templates
+
+
+def get_page_usage(scanned, pages=None):
+    """Return a dict mapping each page to the set of media it uses.
+
+    scanned maps template names to the (uses, parents) of scan_template().
+    pages are the templates that are rendered as pages, which defaults to the
+    ones no other template extends or includes.
+    """
+    if pages is None:
+        parents = set(parent for (uses, template_parents)
+                      in scanned.itervalues()
+                      for parent in template_parents)
+        pages = [name for name in scanned if name not in parents]
+    usage = {}
+    for page in pages:
+        used = set()
+        seen = set()
+        queue = [page]
+        while queue:
+            name = queue.pop()
+            if name in seen or name not in scanned:
+                continue
+            seen.add(name)
+            (uses, template_parents) = scanned[name]
+            used.update(uses)
+            queue.extend(template_parents)
+        usage[page] = used
+    return usage
+
+
+def load_weights(path):
+    """Read page weights from lines of "count template_name".
+
+    This is the format of `sort | uniq -c` on a log of rendered template
+    names.  Counts for the same template are added up.
+    """
+    weights = {}
+    with open(path) as input:
+        for line in input:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            (count, name) = line.split(None, 1)
+            weights[name] = weights.get(name, 0) + float(count)
+    return weights
+
+
+def get_cost(groups, pages, sizes):
+    """Return the expected (bytes, requests) of a page for a grouping.
+
+    groups is a list of lists of files, and pages a list of (weight, files)
+    pairs.  Each page fetches every group that has a file it uses.
+    """
+    group_of = {}
+    group_sizes = []
+    for (index, group) in enumerate(groups):
+        for file in group:
+            group_of[file] = index
+        group_sizes.append(sum(sizes[file] for file in group))
+    total_weight = sum(weight for (weight, used) in pages)
+    if not total_weight:
+        return (0.0, 0.0)
+    total_bytes = total_requests = 0.0
+    for (weight, used) in pages:
+        fetched = set(group_of[file] for file in used if file in group_of)
+        total_bytes += weight * sum(group_sizes[index] for index in fetched)
+        total_requests += weight * len(fetched)
+    return (total_bytes / total_weight, total_requests / total_weight)
+
+
+def partition_files(files, pages, sizes, request_bytes):
+    """Group files into bundles, keeping the expected cost of a page low.
+
+    files is a list of files, in the order they should appear in bundles,
+    pages a list of (weight, files) pairs and sizes a dict of file sizes.
+    Returns a list of groups, each a list of files in their original order,
+    ordered by their first file.
+    """
+    weights = [weight for (weight, used) in pages]
+    file_pages = dict((file, set()) for file in files)
+    for (index, (weight, used)) in enumerate(pages):
+        for file in used:
+            if file in file_pages:
+                file_pages[file].add(index)
+    # Each group is a [files, pages, size] list.
+    classes = {}
+    groups = []
+    for file in files:
+        key = frozenset(file_pages[file])
+        if key not in classes:
+            classes[key] = [[], key, 0]
+            groups.append(classes[key])
+        classes[key][0].append(file)
+        classes[key][2] += sizes[file]
+    def weigh(page_set):
+        return sum(weights[index] for index in page_set)
+    while True:
+        best = None
+        for i in xrange(len(groups)):
+            (a_files, a_pages, a_size) = groups[i]
+            a_weight = weigh(a_pages)
+            for j in xrange(i + 1, len(groups)):
+                (b_files, b_pages, b_size) = groups[j]
+                both = weigh(a_pages & b_pages)
+                change = (b_size * (a_weight - both) +
+                          a_size * (weigh(b_pages) - both) -
+                          request_bytes * both)
+                if change < 0 and (best is None or change < best[0]):
+                    best = (change, i, j)
+        if best is None:
+            break
+        (change, i, j) = best
+        (b_files, b_pages, b_size) = groups.pop(j)
+        groups[i] = [groups[i][0] + b_files, groups[i][1] | b_pages,
+                     groups[i][2] + b_size]
+    order = dict((file, index) for (index, file) in enumerate(files))
+    result = [sorted(group[0], key=order.get) for group in groups]
+    result.sort(key=lambda group: order[group[0]])
+    return result
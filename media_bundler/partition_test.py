@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Tests for suggesting bundle splits."""
+
+import unittest
+
+from partition import get_cost, get_page_usage, partition_files, scan_template
+
+
+class ScanTemplateTest(unittest.TestCase):
+
+    def testScan(self):
+        source = """{% extends "base.html" %}
+            {% javascript "scripts" "a.js" %}{% css 'styles' 'a.css' %}
+            {%load_bundle "more"%}{% include "widget.html" with x=1 %}
+            {% javascript bundle "b.js" %}"""
+        (uses, parents, skipped) = scan_template(source)
+        self.assertEqual(uses, [("scripts", "a.js"), ("styles", "a.css"),
+                                ("more", None)])
+        self.assertEqual(parents, ["base.html", "widget.html"])
+        self.assertEqual(skipped, ['{% javascript bundle "b.js" %}'])
+
+    def testPageUsage(self):
+        scanned = {
+            "base.html": ([("s", "a.js")], []),
+            "home.html": ([("s", "b.js")], ["base.html", "widget.html"]),
+            "widget.html": ([("s", "c.js")], []),
+        }
+        self.assertEqual(get_page_usage(scanned),
+                         {"home.html": set([("s", "a.js"), ("s", "b.js"),
+                                            ("s", "c.js")])})
+
+
+class PartitionTest(unittest.TestCase):
+
+    sizes = {"a": 1000, "b": 1000, "c": 50000, "d": 10}
+
+    def testUsedTogether(self):
+        # Files that are always used together are bundled together, in their
+        # original order.
+        pages = [(1, set("ab")), (1, set("ba"))]
+        self.assertEqual(partition_files(list("ba"), pages, self.sizes, 0),
+                         [["b", "a"]])
+
+    def testRarelyUsedFileSplit(self):
+        # c is big and only one page in a hundred uses it.
+        pages = [(99, set("ab")), (1, set("abc"))]
+        groups = partition_files(list("abc"), pages, self.sizes, 4096)
+        self.assertEqual(groups, [["a", "b"], ["c"]])
+        self.assert_(get_cost(groups, pages, self.sizes)[0] <
+                     get_cost([list("abc")], pages, self.sizes)[0])
+
+    def testSmallFilesMerged(self):
+        # d is tiny, so saving a request is worth sending it everywhere.
+        pages = [(1, set("ab")), (1, set("abd"))]
+        self.assertEqual(partition_files(list("abd"), pages, self.sizes,
+                                         4096),
+                         [["a", "b", "d"]])
+        self.assertEqual(partition_files(list("abd"), pages, self.sizes, 1),
+                         [["a", "b"], ["d"]])
+
+    def testUnusedFilesKeptApart(self):
+        pages = [(1, set("a"))]
+        self.assertEqual(partition_files(list("abd"), pages, self.sizes,
+                                         4096),
+                         [["a"], ["b", "d"]])
+
+    def testCost(self):
+        pages = [(3, set("a")), (1, set("ac"))]
+        (size, requests) = get_cost([["a", "b"], ["c"]], pages, self.sizes)
+        self.assertEqual(size, (3 * 2000 + 52000) / 4.0)
+        self.assertEqual(requests, 5 / 4.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+# media_bundler/pngtools.py
+
+"""
+Low-level PNG helpers for building sprites: reading image sizes, and the PNG
+optimizers.
+"""
+
+from __future__ import with_statement
+
+import binascii
+from cStringIO import StringIO
+from distutils.spawn import find_executable
+import os
+import struct
+import subprocess
+import zlib
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+
+PNG_SIGNATURE = "\x89PNG\r\n\x1a\n"
+
+
+class PngError(Exception):
+
+    """Raised for files that aren't valid PNGs."""
+
+
+def read_png_size(path):
+    """Return the (width, height) of a PNG from its IHDR chunk.
+
+    Only the first 24 bytes of the file are read, so this is much cheaper than
+    decoding the image.
+    """
+    with open(path, "rb") as input:
+        header = input.read(24)
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or \
+            header[12:16] != "IHDR":
+        raise PngError("%s is not a PNG file." % path)
+    return struct.unpack(">II", header[16:24])
+
+
+def write_chunk(output, type, data):
+    output.write(struct.pack(">I", len(data)))
+    output.write(type)
+    output.write(data)
+    output.write(struct.pack(">I", zlib.crc32(type + data) & 0xffffffffL))
+
+
+def crush_png(path):
+    """Optimize a PNG in place with pngcrush, removing ancillary chunks."""
+    tmp_path = path + '.crushed'
+    args = ['pngcrush', '-rem', 'alla', path, tmp_path]
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    # communicate() keeps reading the output, so pngcrush can't block on a
+    # full pipe.
+    (output, _) = proc.communicate()
+    if proc.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise Exception('pngcrush returned error code: %r\nOutput was:\n\n'
+                        '%s' % (proc.returncode, output))
+    os.rename(tmp_path, path)
+
+
+# The built-in optimizer re-encodes the image with each of the PNG filter types
+# below applied to every row, and compresses each result with the quick
+# SCREEN_SETTINGS.  Then it compresses the best of them with the slow
+# ZLIB_SETTINGS, which often take ten times longer for a few percent.
+# Filtering a byte at a time is far too slow in Python, so the filters work
+# on whole images at once, as big integers with one 16-bit lane per byte.
+# "adaptive" picks the best filter row by row, which needs the Paeth filter,
+# so it is left to PIL's PNG encoder, which does it in C.
+FILTER_TYPES = (0, 1, 2, 3, "adaptive")
+
+SCREEN_SETTINGS = (
+    (6, zlib.Z_DEFAULT_STRATEGY),
+)
+
+ZLIB_SETTINGS = (
+    (9, zlib.Z_DEFAULT_STRATEGY),
+)
+
+# Images with less raw data than this aren't worth starting a process pool for.
+PARALLEL_MIN_BYTES = 2**18
+
+
+def _to_lanes(data, guard=0):
+    """Pack bytes into an int with one 16-bit lane per byte.
+
+    The high byte of every lane is set to guard.  With a guard of 1, a lane
+    can have up to 256 subtracted from it without borrowing from the next.
+    """
+    if not data:
+        return 0
+    lanes = bytearray(2 * len(data))
+    lanes[0::2] = chr(guard) * len(data)
+    lanes[1::2] = data
+    return int(binascii.hexlify(lanes), 16)
+
+
+def _from_lanes(value, length):
+    """Return the low bytes of the lanes of an int from _to_lanes()."""
+    if not length:
+        return ""
+    return binascii.unhexlify("%0*x" % (4 * length, value))[1::2]
+
+
+def _shift_rows(raw, offset, stride):
+    """Shift every row of raw right by offset bytes, filling with zeros."""
+    shifted = bytearray(len(raw))
+    shifted[offset:] = raw[:-offset]
+    zeros = "\0" * offset
+    for start in xrange(0, len(raw), stride):
+        shifted[start:start + len(zeros)] = zeros
+    return shifted
+
+
+def filter_image(raw, width, height, bpp, filter_type):
+    """Return the scanlines of raw pixel data, all filtered the same way.
+
+    filter_type is 0 (None), 1 (Sub), 2 (Up) or 3 (Average).
+    """
+    stride = width * bpp
+    if filter_type == 0:
+        filtered = raw
+    else:
+        low_bytes = _to_lanes("\xff" * len(raw))
+        pixels = _to_lanes(raw, 1)
+        left = _to_lanes(_shift_rows(raw, bpp, stride))
+        up = _to_lanes("\0" * stride + raw[:-stride])
+        if filter_type == 1:
+            predicted = left
+        elif filter_type == 2:
+            predicted = up
+        else:
+            # Bits shifted down from the next lane are masked off.
+            predicted = ((left + up) >> 1) & low_bytes
+        filtered = _from_lanes((pixels - predicted) & low_bytes, len(raw))
+    type = chr(filter_type)
+    return "".join(type + filtered[y * stride:(y + 1) * stride]
+                   for y in xrange(height))
+
+
+def read_chunks(data):
+    """Yield the (type, data) of each chunk of a PNG file's contents."""
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(data):
+        (length, type) = struct.unpack(">I4s", data[offset:offset + 8])
+        yield (type, data[offset + 8:offset + 8 + length])
+        offset += 12 + length
+
+
+def _encode_adaptive(raw, width, height, mode, settings):
+    """Return the smallest compressed stream PIL's encoder makes."""
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+    frombytes = getattr(Image, "frombytes", None) or Image.fromstring
+    image = frombytes(mode, (width, height), raw)
+    best = None
+    for (level, strategy) in settings:
+        output = StringIO()
+        image.save(output, "PNG", compress_level=level, compress_type=strategy)
+        data = "".join(chunk for (type, chunk)
+                       in read_chunks(output.getvalue()) if type == "IDAT")
+        if best is None or len(data) < len(best):
+            best = data
+    return best
+
+
+def _encode_trial((raw, width, height, mode, filter_type, settings)):
+    """Filter the image one way and return the smallest compressed stream."""
+    if filter_type == "adaptive":
+        return _encode_adaptive(raw, width, height, mode, settings)
+    filtered = filter_image(raw, width, height, len(mode), filter_type)
+    best = None
+    for (level, strategy) in settings:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS,
+                                      9, strategy)
+        data = compressor.compress(filtered) + compressor.flush()
+        if best is None or len(data) < len(best):
+            best = data
+    return best
+
+
+def _get_pixels(image):
+    """Return an image's mode and raw pixel data.
+
+    Fully opaque RGBA images are stored as RGB.
+    """
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    if image.mode == "RGBA":
+        (_, _, _, alpha) = image.split()
+        if alpha.getextrema() == (255, 255):
+            image = image.convert("RGB")
+    tobytes = getattr(image, "tobytes", None) or image.tostring
+    return (image.mode, tobytes())
+
+
+def _can_use_pool():
+    # Pool workers are daemons, and daemons can't have children, so a sprite
+    # built in a bundle_media worker process optimizes in that process.  The
+    # parallelism then comes from building several bundles at once.
+    return (multiprocessing is not None and
+            not multiprocessing.current_process().daemon)
+
+
+def optimize_png(path, jobs=None, filter_types=FILTER_TYPES):
+    """Optimize a PNG in place with the built-in optimizer.
+
+    Tries every filter type, in parallel where possible, then the slower
+    zlib settings on the best one, and writes the smallest encoding with
+    only the critical chunks.  The
+    file is left alone if it is already smaller.  jobs defaults to one
+    process per CPU.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+    with open(path, "rb") as input:
+        image = Image.open(input)
+        image.load()
+    (width, height) = image.size
+    (mode, raw) = _get_pixels(image)
+    del image
+    trials = [(raw, width, height, mode, filter_type, SCREEN_SETTINGS)
+              for filter_type in filter_types]
+    if jobs is None and _can_use_pool() and len(raw) >= PARALLEL_MIN_BYTES:
+        jobs = multiprocessing.cpu_count()
+    if jobs and jobs > 1 and _can_use_pool():
+        pool = multiprocessing.Pool(min(jobs, len(trials)))
+        try:
+            results = pool.map(_encode_trial, trials)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = map(_encode_trial, trials)
+    (idat, best_type) = min(zip(results, filter_types),
+                            key=lambda (data, filter_type): len(data))
+    idat = min([idat, _encode_trial((raw, width, height, mode, best_type,
+                                     ZLIB_SETTINGS))], key=len)
+    color_type = 6 if mode == "RGBA" else 2
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    tmp_path = path + ".optimized"
+    with open(tmp_path, "wb") as output:
+        output.write(PNG_SIGNATURE)
+        write_chunk(output, "IHDR", ihdr)
+        write_chunk(output, "IDAT", idat)
+        write_chunk(output, "IEND", "")
+    if os.path.getsize(tmp_path) < os.path.getsize(path):
+        os.rename(tmp_path, path)
+    else:
+        os.remove(tmp_path)
+
+
+def _has_pngcrush():
+    return find_executable('pngcrush') is not None
+
+
+def get_png_optimizer(name):
+    """Return the PNG optimizer for the BUNDLE_PNG_OPTIMIZER setting.
+
+    "auto" picks pngcrush if it is installed, and doesn't optimize
+    otherwise, since the built-in optimizer still takes seconds for large
+    sheets.  None disables optimization.
+    """
+    if name == "auto":
+        name = "pngcrush" if _has_pngcrush() else None
+    if name is None:
+        return None
+    try:
+        return PNG_OPTIMIZERS[name]
+    except KeyError:
+        raise ValueError("Unknown PNG optimizer %r, expected one of: auto, %s"
+                         % (name, ", ".join(sorted(PNG_OPTIMIZERS))))
+
+
+PNG_OPTIMIZERS = {
+    'pngcrush': crush_png,
+    'builtin': optimize_png,
+}
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""Tests for the PNG helpers."""
+
+from __future__ import with_statement
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+import pngtools
+from pngtools import (FILTER_TYPES, filter_image, get_png_optimizer,
+                      optimize_png, read_png_size)
+
+
+def filter_bytes(raw, width, height, bpp, filter_type):
+    """The PNG filters, a byte at a time, to check filter_image() against."""
+    stride = width * bpp
+    prev = bytearray(stride)
+    lines = []
+    for y in xrange(height):
+        row = bytearray(raw[y * stride:(y + 1) * stride])
+        out = bytearray(stride)
+        for i in xrange(stride):
+            left = row[i - bpp] if i >= bpp else 0
+            predicted = (0, left, prev[i], (left + prev[i]) >> 1)[filter_type]
+            out[i] = (row[i] - predicted) & 0xff
+        lines.append(chr(filter_type) + str(out))
+        prev = row
+    return "".join(lines)
+
+
+class PngToolsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def makeImage(self, mode, size, seed=0):
+        rng = random.Random(seed)
+        image = Image.new(mode, size)
+        # Blocks of noise and flat color, so every filter has something to do.
+        for x in xrange(size[0]):
+            for y in xrange(size[1]):
+                if (x // 8 + y // 8) % 2:
+                    pixel = tuple(rng.randrange(256) for _ in mode)
+                else:
+                    pixel = tuple((x * 7 + y * 3 + i * 50) % 256
+                                  for i in xrange(len(mode)))
+                image.putpixel((x, y), pixel)
+        path = os.path.join(self.dir, "%s.png" % mode)
+        image.save(path)
+        return (image, path)
+
+    def assertSamePixels(self, image, path):
+        with open(path, "rb") as input:
+            optimized = Image.open(input)
+            optimized.load()
+        self.assertEqual(optimized.size, image.size)
+        self.assertEqual(list(optimized.convert(image.mode).getdata()),
+                         list(image.getdata()))
+
+    def testReadPngSize(self):
+        (_, path) = self.makeImage("RGBA", (37, 21))
+        self.assertEqual(read_png_size(path), (37, 21))
+
+    def testOptimizeKeepsPixels(self):
+        for mode in ("RGBA", "RGB"):
+            (image, path) = self.makeImage(mode, (40, 30))
+            size = os.path.getsize(path)
+            optimize_png(path, jobs=1)
+            self.assertSamePixels(image, path)
+            self.assert_(os.path.getsize(path) <= size)
+
+    def testFiltersMatchBytewise(self):
+        rng = random.Random(1)
+        for (width, height, bpp) in ((1, 1, 3), (5, 3, 4), (33, 17, 4)):
+            raw = "".join(chr(rng.randrange(256))
+                          for _ in xrange(width * height * bpp))
+            for filter_type in (0, 1, 2, 3):
+                self.assertEqual(
+                    filter_image(raw, width, height, bpp, filter_type),
+                    filter_bytes(raw, width, height, bpp, filter_type))
+
+    def testAutoNeedsPngcrush(self):
+        has_pngcrush = pngtools._has_pngcrush
+        try:
+            pngtools._has_pngcrush = lambda: False
+            self.assertEqual(get_png_optimizer("auto"), None)
+            pngtools._has_pngcrush = lambda: True
+            self.assertEqual(get_png_optimizer("auto"), pngtools.crush_png)
+        finally:
+            pngtools._has_pngcrush = has_pngcrush
+
+    def testEveryFilterRoundTrips(self):
+        (image, path) = self.makeImage("RGBA", (19, 13))
+        for filter_type in FILTER_TYPES:
+            copy_path = path + ".copy"
+            shutil.copy(path, copy_path)
+            # Pad the input so the optimized file always replaces it.
+            with open(copy_path, "ab") as output:
+                output.write("\0" * 100000)
+            optimize_png(copy_path, jobs=1, filter_types=(filter_type,))
+            self.assertSamePixels(image, copy_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
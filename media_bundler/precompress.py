@@ -0,0 +1,73 @@
+# media_bundler/precompress.py
+
+"""
+Precompression of bundles.
+
+Web servers like nginx with gzip_static can serve a file's .gz sibling
+directly instead of compressing the file on every request.  We write those
+siblings at maximum compression, but only keep them when they are actually
+smaller than the original.
+"""
+
+from __future__ import with_statement
+
+import os
+import struct
+import zlib
+
+
+# Gzip header: magic, deflate, no flags, no mtime (so the output only depends
+# on the input), maximum compression, unknown OS.
+GZIP_HEADER = "\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff"
+
+
+def get_gzip_path(path):
+    return path + ".gz"
+
+
+def write_gzip(input, output, chunk_size=2**16):
+    """Compress the input file into the output file and return its size."""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS, 9)
+    crc = zlib.crc32("")
+    size = 0
+    written = len(GZIP_HEADER)
+    output.write(GZIP_HEADER)
+    chunk = input.read(chunk_size)
+    while chunk:
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        data = compressor.compress(chunk)
+        output.write(data)
+        written += len(data)
+        chunk = input.read(chunk_size)
+    data = compressor.flush() + struct.pack("<LL", crc & 0xffffffffL,
+                                            size & 0xffffffffL)
+    output.write(data)
+    return written + len(data)
+
+
+def remove_precompressed(path):
+    """Remove a stale .gz sibling of path, if there is one."""
+    try:
+        os.remove(get_gzip_path(path))
+    except OSError:
+        pass
+
+
+def precompress(path):
+    """Write path's .gz sibling and return its size.
+
+    If compression doesn't make the file smaller, we remove any existing .gz
+    sibling and return None.
+    """
+    gzip_path = get_gzip_path(path)
+    tmp_path = gzip_path + ".tmp"
+    with open(path, "rb") as input:
+        with open(tmp_path, "wb") as output:
+            gzip_size = write_gzip(input, output)
+    if gzip_size < os.path.getsize(path):
+        os.rename(tmp_path, gzip_path)
+        return gzip_size
+    os.remove(tmp_path)
+    remove_precompressed(path)
+    return None
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""Tests for precompressing bundles."""
+
+from cStringIO import StringIO
+import gzip
+import os
+import unittest
+
+from test_support import BundleTestCase
+
+from media_bundler.build import precompress_bundle
+from media_bundler.precompress import GZIP_HEADER, write_gzip
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+class WriteGzipTest(unittest.TestCase):
+
+    def compress(self, data, **kwargs):
+        output = StringIO()
+        size = write_gzip(StringIO(data), output, **kwargs)
+        self.assertEqual(size, len(output.getvalue()))
+        return output.getvalue()
+
+    def testRoundTrip(self):
+        data = "".join("var a%d = %d;\n" % (i, i * i) for i in range(10000))
+        self.assertEqual(gunzip(self.compress(data, chunk_size=1000)), data)
+        self.assertEqual(gunzip(self.compress("")), "")
+
+    def testDeterministicHeader(self):
+        compressed = self.compress("var a;")
+        # No filename flag and no mtime, so the output only depends on the
+        # input.
+        self.assertEqual(compressed[:10], GZIP_HEADER)
+        self.assertEqual(ord(compressed[3]), 0)
+        self.assertEqual(compressed[4:8], "\0\0\0\0")
+        self.assertEqual(self.compress("var a;"), compressed)
+
+
+class PrecompressBundleTest(BundleTestCase):
+
+    def setUp(self):
+        super(PrecompressBundleTest, self).setUp()
+        self.bundle = self.add_bundle(type="javascript", name="app",
+                                      files=["a.js"])
+        self.data = "var a = 1;\n" * 100
+        self.write("app.js", self.data)
+
+    def testKeptWhenSmaller(self):
+        size = precompress_bundle(self.bundle)
+        self.assertEqual(size, os.path.getsize(self.path("app.js.gz")))
+        self.assertEqual(gunzip(self.read("app.js.gz")), self.data)
+
+    def testDroppedWhenNotSmaller(self):
+        self.write("app.js.gz", "stale")
+        self.write("app.js", "a")
+        self.assertEqual(precompress_bundle(self.bundle), None)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["app.js"])
+
+    def testStaleRemovedWithoutGzip(self):
+        precompress_bundle(self.bundle)
+        self.assertEqual(precompress_bundle(self.bundle, gzip=False), None)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["app.js"])
+
+    def testVersionedCopy(self):
+        self.write("app.0123456789.js", self.data)
+        precompress_bundle(self.bundle, "app.0123456789.js")
+        self.assertEqual(self.read("app.0123456789.js.gz"),
+                         self.read("app.js.gz"))
+        self.assert_(os.path.samefile(self.path("app.0123456789.js.gz"),
+                                      self.path("app.js.gz")))
+
+    def testNotCompressible(self):
+        sprite = self.add_bundle(type="png-sprite", name="icons",
+                                 files=["a.png"], css_file="icons.css")
+        self.write("icons.png", self.data)
+        self.assertEqual(precompress_bundle(sprite), None)
+        self.assertFalse(os.path.exists(self.path("icons.png.gz")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# media_bundler/retention.py
+
+"""
+Garbage collection of old versioned bundles.
+
+Every build with versioning enabled leaves a name.<version>.ext file next to
+the bundle, and pages rendered before a deploy may still refer to recent ones.
+We keep the newest few versions of each bundle and delete the rest, along with
+their .gz siblings.  The version currently listed in BUNDLE_VERSIONS is never
+deleted.  The sheets of a sprite that was split over several are versioned, and
+collected, separately, including sheets that later builds no longer have.
+"""
+
+import os
+import re
+
+from media_bundler.precompress import get_gzip_path
+
+
+def get_versioned_re(bundle):
+    """Return a regexp matching the versioned filenames of a bundle.
+
+    Versions are hex digests or mtimes, so they are at least 8 hex digits.
+    """
+    return re.compile(r"^%s\.[0-9a-f]{8,}%s$" %
+                      (re.escape(bundle.name),
+                       re.escape(bundle.get_extension())))
+
+
+def find_versioned_files(bundle):
+    """Return the versioned filenames of a bundle that exist on disk."""
+    versioned_re = get_versioned_re(bundle)
+    try:
+        filenames = os.listdir(bundle.path)
+    except OSError:
+        return []
+    return [f for f in filenames if versioned_re.match(f)]
+
+
+def rank_versions(bundle, filenames, history=()):
+    """Order versioned filenames from newest to oldest.
+
+    Versions in the build manifest's history come first, in its order, and
+    any others follow from the newest modification time to the oldest.
+    """
+    filenames = set(filenames)
+    ranked = [f for f in history if f in filenames]
+    rest = filenames.difference(ranked)
+    def mtime(filename):
+        return os.stat(os.path.join(bundle.path, filename)).st_mtime
+    ranked.extend(sorted(rest, key=mtime, reverse=True))
+    return ranked
+
+
+def get_garbage(bundle, current=None, keep=5, history=()):
+    """Return the paths of a bundle's versioned files that can be deleted."""
+    ranked = rank_versions(bundle, find_versioned_files(bundle), history)
+    garbage = []
+    for filename in ranked[keep:]:
+        if filename == current:
+            continue
+        path = os.path.join(bundle.path, filename)
+        garbage.append(path)
+        if os.path.exists(get_gzip_path(path)):
+            garbage.append(get_gzip_path(path))
+    return garbage
+
+
+def get_stale_sheets(bundle, sheets):
+    """Return the extra sheets of a sprite that its last build no longer has.
+
+    A sprite packed onto fewer sheets than before leaves the versioned files
+    of the dropped sheets behind, which aren't among sheets.
+    """
+    sheet_re = re.compile(r"^%s-(\d+)\.[0-9a-f]{8,}%s$" %
+                          (re.escape(bundle.name),
+                           re.escape(bundle.get_extension())))
+    try:
+        filenames = os.listdir(bundle.path)
+    except OSError:
+        return []
+    current = set(sheet.name for sheet in sheets)
+    indexes = set()
+    for filename in filenames:
+        match = sheet_re.match(filename)
+        if match and int(match.group(1)) > 0:
+            indexes.add(int(match.group(1)))
+    stale = [bundle.get_sheet(index) for index in sorted(indexes)]
+    return [sheet for sheet in stale if sheet.name not in current]
+
+
+def collect_garbage(bundles, versions, manifest=None, keep=5, dry_run=False):
+    """Delete old versioned files and return the paths that were deleted.
+
+    versions maps bundle names to their current versioned filenames.  With
+    dry_run, nothing is deleted, but the paths that would be are returned.
+    """
+    removed = []
+    versioned = []
+    for bundle in bundles:
+        parts = bundle.get_versioned_bundles()
+        versioned.extend(parts)
+        if hasattr(bundle, "get_sheet"):
+            versioned.extend(get_stale_sheets(bundle, parts))
+    for bundle in sorted(versioned, key=lambda bundle: bundle.name):
+        history = manifest.get_history(bundle.name) if manifest else ()
+        garbage = get_garbage(bundle, versions.get(bundle.name), keep, history)
+        for path in garbage:
+            if not dry_run:
+                os.remove(path)
+            removed.append(path)
+    return removed
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""Tests for collecting old versioned bundles."""
+
+import os
+import time
+import unittest
+
+from test_support import BundleTestCase
+
+from media_bundler.manifest import BuildManifest
+from media_bundler.retention import collect_garbage
+
+
+class FakeBundle(object):
+
+    def __init__(self, name, path, extension=".js"):
+        self.name = name
+        self.path = path
+        self.extension = extension
+
+    def get_extension(self):
+        return self.extension
+
+    def get_versioned_bundles(self):
+        return [self]
+
+
+class FakeSprite(FakeBundle):
+
+    def __init__(self, name, path, sheets):
+        super(FakeSprite, self).__init__(name, path, ".png")
+        self.sheets = sheets
+
+    def get_sheet(self, index):
+        if index == 0:
+            return self
+        return FakeBundle("%s-%d" % (self.name, index), self.path, ".png")
+
+    def get_versioned_bundles(self):
+        return [self.get_sheet(index) for index in range(self.sheets)]
+
+
+class CollectGarbageTest(BundleTestCase):
+
+    def setUp(self):
+        super(CollectGarbageTest, self).setUp()
+        self.manifest = BuildManifest(self.path("manifest.json"))
+        self.bundle = FakeBundle("app", self.dir)
+
+    def touch(self, filename, age=0):
+        path = self.path(filename)
+        open(path, "w").close()
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def remaining(self):
+        return sorted(f for f in os.listdir(self.dir) if f != "manifest.json")
+
+    def testKeepsNewestInHistory(self):
+        # The manifest's history wins over modification times.
+        for (age, version) in enumerate("abcd"):
+            self.touch("app.%s.js" % (version * 8), age)
+        self.manifest.entries["app"] = {
+            "history": ["app.cccccccc.js", "app.dddddddd.js"]}
+        removed = collect_garbage([self.bundle], {}, self.manifest, keep=2)
+        self.assertEqual(sorted(map(os.path.basename, removed)),
+                         ["app.aaaaaaaa.js", "app.bbbbbbbb.js"])
+        self.assertEqual(self.remaining(),
+                         ["app.cccccccc.js", "app.dddddddd.js"])
+
+    def testKeepsNewestByMtime(self):
+        for (age, version) in enumerate("abc"):
+            self.touch("app.%s.js" % (version * 8), age * 10)
+        collect_garbage([self.bundle], {}, keep=1)
+        self.assertEqual(self.remaining(), ["app.aaaaaaaa.js"])
+
+    def testNeverRemovesCurrent(self):
+        # The published version is kept even when it is old and missing from
+        # the history.
+        self.touch("app.aaaaaaaa.js", 100)
+        self.touch("app.bbbbbbbb.js")
+        self.manifest.entries["app"] = {"history": ["app.bbbbbbbb.js"]}
+        removed = collect_garbage([self.bundle],
+                                  {"app": "app.aaaaaaaa.js"},
+                                  self.manifest, keep=0)
+        self.assertEqual(map(os.path.basename, removed), ["app.bbbbbbbb.js"])
+        self.assertEqual(self.remaining(), ["app.aaaaaaaa.js"])
+
+    def testRemovesGzipSiblings(self):
+        self.touch("app.aaaaaaaa.js")
+        self.touch("app.aaaaaaaa.js.gz")
+        self.touch("app.bbbbbbbb.js", 10)
+        self.touch("app.bbbbbbbb.js.gz", 10)
+        removed = collect_garbage([self.bundle], {}, keep=1)
+        self.assertEqual(sorted(map(os.path.basename, removed)),
+                         ["app.bbbbbbbb.js", "app.bbbbbbbb.js.gz"])
+        self.assertEqual(self.remaining(),
+                         ["app.aaaaaaaa.js", "app.aaaaaaaa.js.gz"])
+
+    def testDryRun(self):
+        self.touch("app.aaaaaaaa.js")
+        self.touch("app.bbbbbbbb.js", 10)
+        removed = collect_garbage([self.bundle], {}, keep=1, dry_run=True)
+        self.assertEqual(map(os.path.basename, removed), ["app.bbbbbbbb.js"])
+        self.assertEqual(self.remaining(),
+                         ["app.aaaaaaaa.js", "app.bbbbbbbb.js"])
+
+    def testIgnoresOtherFiles(self):
+        for filename in ("app.js", "app.js.gz", "app.1234.js",
+                         "app.xyzxyzxyz.js", "app.aaaaaaaa.css",
+                         "apps.aaaaaaaa.js", "app.aaaaaaaa.js.tmp"):
+            self.touch(filename, 100)
+        before = self.remaining()
+        self.assertEqual(collect_garbage([self.bundle], {}, keep=0), [])
+        self.assertEqual(self.remaining(), before)
+
+    def testStaleSheets(self):
+        # The sprite is down to two sheets, but a third is still on disk.
+        sprite = FakeSprite("icons", self.dir, 2)
+        for name in ("icons", "icons-1", "icons-2"):
+            self.touch("%s.aaaaaaaa.png" % name)
+            self.touch("%s.bbbbbbbb.png" % name, 10)
+        removed = collect_garbage([sprite], {}, keep=1)
+        self.assertEqual(sorted(map(os.path.basename, removed)),
+                         ["icons-1.bbbbbbbb.png", "icons-2.bbbbbbbb.png",
+                          "icons.bbbbbbbb.png"])
+        removed = collect_garbage([sprite], {}, keep=0)
+        self.assertEqual(self.remaining(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
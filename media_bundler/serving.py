@@ -0,0 +1,300 @@
+# media_bundler/serving.py
+
+"""
+Building bundles on demand for media_bundler.views.
+
+Each bundle is built the first time one of its files is requested, into a
+temporary directory that is thrown away once the files have been read, so the
+live media directories are never touched.  Bundles that the requested one
+depends on, like the sprites whose css_file a CSS bundle includes, are built
+along with it.  The built files are kept in a size-bounded LRU cache keyed on
+the fingerprints of their sources, so a bundle is rebuilt when a source
+changes.  Build keys are only recomputed every BUILD_KEY_CHECK_INTERVAL
+seconds, so a page that links many bundles doesn't stat every source for each.
+
+Only one build runs at a time, because the active stage is a module global,
+and concurrent requests for the same bundle wait for the one build to finish
+rather than starting their own.
+"""
+
+from __future__ import with_statement
+
+from hashlib import sha1
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from media_bundler.conf import bundler_settings
+from media_bundler import bundler
+from media_bundler import staging
+from media_bundler.build import get_dependencies
+from media_bundler.manifest import fingerprint_file
+from media_bundler.staging import Stage
+
+
+SHEET_NAME_RE = re.compile(r"^(.+)-(\d+)$")
+
+# How many seconds a bundle's build key is trusted before its sources are
+# checked again.
+BUILD_KEY_CHECK_INTERVAL = 1
+
+
+class LRUCache(object):
+
+    """A thread-safe cache holding at most max_size bytes.
+
+    Every value is cached along with its size in bytes, and the least
+    recently used values are evicted to make room for new ones.  Entries live
+    in a doubly linked list of [prev, next, key, size, value] lists, most
+    recently used first.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._head = []
+        self._head[:] = [self._head, self._head, None, 0, None]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _unlink(self, entry):
+        (prev, next) = entry[:2]
+        prev[1] = next
+        next[0] = prev
+
+    def _link_first(self, entry):
+        head = self._head
+        entry[0] = head
+        entry[1] = head[1]
+        head[1][0] = entry
+        head[1] = entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._unlink(entry)
+            self._link_first(entry)
+            return entry[4]
+
+    def set(self, key, size, value):
+        """Cache value, unless size alone is more than the cache holds."""
+        with self._lock:
+            self._discard(key)
+            if size > self.max_size:
+                return
+            entry = [None, None, key, size, value]
+            self._link_first(entry)
+            self._entries[key] = entry
+            self.size += size
+            while self.size > self.max_size:
+                self._discard(self._head[0][2])
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unlink(entry)
+            self.size -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._head[:] = [self._head, self._head, None, 0, None]
+            self.size = 0
+
+
+_cache = None
+_dependencies = None
+_build_lock = threading.Lock()
+_flights_lock = threading.Lock()
+_flights = {}
+# The last fingerprint of every source path, so unchanged files aren't hashed
+# again on every request.
+_fingerprints = {}
+# The last build key of every bundle name, and when to check it again.
+_build_keys = {}
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(bundler_settings.BUNDLE_SERVE_CACHE_SIZE)
+    return _cache
+
+
+def get_bundle_dependencies():
+    """Return the dependencies between the bundles, which never change."""
+    global _dependencies
+    if _dependencies is None:
+        _dependencies = get_dependencies(bundler.get_bundles().values())
+    return _dependencies
+
+
+def find_bundle(filename):
+    """Return the bundle that builds filename and its unversioned filename.
+
+    filename may be versioned, and may be one of the extra sheets of a
+    sprite bundle.  Returns (None, None) if no bundle builds it.
+    """
+    bundles = bundler.get_bundles()
+    (base, extension) = os.path.splitext(filename)
+    names = [base]
+    if "." in base:
+        names.append(base.rsplit(".", 1)[0])
+    for name in names:
+        bundle = bundles.get(name)
+        if bundle is None:
+            match = SHEET_NAME_RE.match(name)
+            if match and isinstance(bundles.get(match.group(1)),
+                                    bundler.PngSpriteBundle):
+                bundle = bundles[match.group(1)]
+        if bundle is not None and bundle.get_extension() == extension:
+            return (bundle, name + extension)
+    return (None, None)
+
+
+def _get_needed(names, dependencies):
+    """Return names and every bundle they need, directly or not."""
+    needed = set(names)
+    queue = list(names)
+    while queue:
+        for other in dependencies[queue.pop()]:
+            if other not in needed:
+                needed.add(other)
+                queue.append(other)
+    return needed
+
+
+def get_build_key(bundle):
+    """Return a key that changes whenever the bundle would build differently.
+
+    It covers the bundle's settings and the fingerprints of its sources, and
+    the keys of the bundles it depends on in place of the sources they
+    generate.  A key is reused for BUILD_KEY_CHECK_INTERVAL seconds.
+    """
+    now = time.time()
+    cached = _build_keys.get(bundle.name)
+    if cached is not None and now < cached[1]:
+        return cached[0]
+    key = _compute_build_key(bundle)
+    _build_keys[bundle.name] = (key, now + BUILD_KEY_CHECK_INTERVAL)
+    return key
+
+
+def _compute_build_key(bundle):
+    bundles = bundler.get_bundles()
+    dependencies = get_bundle_dependencies()
+    generated = set(os.path.abspath(path)
+                    for name in dependencies[bundle.name]
+                    for path in bundles[name].get_output_paths())
+    digest = sha1(json.dumps([bundle.type, bundle.name,
+                              bundle.get_build_options()], sort_keys=True))
+    for path in bundle.get_paths():
+        path = os.path.abspath(path)
+        if path in generated:
+            continue
+        fingerprint = fingerprint_file(path, _fingerprints.get(path))
+        _fingerprints[path] = fingerprint
+        digest.update("\0%s\0%s" % (path, fingerprint[2]))
+    for name in sorted(dependencies[bundle.name]):
+        digest.update("\0%s" % get_build_key(bundles[name]))
+    return digest.hexdigest()
+
+
+def get_etag(key, filename):
+    return '"%s"' % sha1("%s\0%s" % (key, filename)).hexdigest()
+
+
+def build_files(bundle):
+    """Build bundle and the bundles it needs in a throwaway stage.
+
+    The stage is kept in a temporary directory outside the media directories.
+
+    Returns a dict mapping the name of each built bundle to a dict of the
+    filenames and contents of the files it versions.
+    """
+    bundles = bundler.get_bundles()
+    dependencies = get_bundle_dependencies()
+    remaining = dict((name, set(dependencies[name]))
+                     for name in _get_needed([bundle.name], dependencies))
+    paths = [path for name in remaining
+             for path in bundles[name].get_output_paths()]
+    root_dir = tempfile.mkdtemp(prefix="bundle-serve-")
+    stage = Stage(paths, root_dir=root_dir)
+    built = {}
+    try:
+        stage.create()
+        staging.activate(stage)
+        while remaining:
+            ready = sorted(name for (name, needs) in remaining.iteritems()
+                           if not needs)
+            for name in ready:
+                bundles[name].make_bundle(None)
+                built[name] = _read_files(bundles[name])
+                del remaining[name]
+            for needs in remaining.itervalues():
+                needs.difference_update(ready)
+    finally:
+        staging.activate(None)
+        shutil.rmtree(root_dir, ignore_errors=True)
+    return built
+
+
+def _read_files(bundle):
+    files = {}
+    for part in bundle.get_versioned_bundles():
+        with open(staging.output_path(part.get_bundle_path()), "rb") as input:
+            files[part.get_bundle_filename()] = input.read()
+    return files
+
+
+def get_files(bundle, key):
+    """Return the files of a bundle whose build key is key, building it if
+    it isn't cached.
+
+    Concurrent calls for the same key share a single build.
+    """
+    cache = get_cache()
+    files = cache.get(key)
+    if files is not None:
+        return files
+    with _flights_lock:
+        lock = _flights.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            files = cache.get(key)
+            if files is None:
+                files = _build_and_cache(bundle, key)
+    finally:
+        with _flights_lock:
+            if _flights.get(key) is lock:
+                del _flights[key]
+    return files
+
+
+def _build_and_cache(bundle, key):
+    bundles = bundler.get_bundles()
+    with _build_lock:
+        built = build_files(bundle)
+    # The bundles it needed were built too, so they are cached as well.
+    cache = get_cache()
+    for (name, files) in built.iteritems():
+        if name != bundle.name:
+            cache.set(get_build_key(bundles[name]),
+                      sum(len(content) for content in files.itervalues()),
+                      files)
+    files = built[bundle.name]
+    cache.set(key, sum(len(content) for content in files.itervalues()), files)
+    return files
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""Tests for serving bundles on demand."""
+
+import os
+import threading
+import time
+import unittest
+
+from test_support import BundleTestCase
+
+from django.test.client import RequestFactory
+
+from media_bundler import serving
+from media_bundler.serving import LRUCache
+from media_bundler.views import serve_bundle
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def testEvictsBySize(self):
+        cache = LRUCache(10)
+        cache.set("a", 4, "A")
+        cache.set("b", 4, "B")
+        self.assertEqual(cache.get("a"), "A")
+        # b is now the least recently used, and a 4 byte value doesn't fit
+        # next to the other two.
+        cache.set("c", 4, "C")
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), "A")
+        self.assertEqual(cache.get("c"), "C")
+        self.assertEqual((len(cache), cache.size), (2, 8))
+        cache.set("d", 10, "D")
+        self.assertEqual((len(cache), cache.size), (1, 10))
+
+    def testReplaceAndOversize(self):
+        cache = LRUCache(10)
+        cache.set("a", 4, "A")
+        cache.set("a", 6, "AA")
+        self.assertEqual((cache.get("a"), cache.size), ("AA", 6))
+        # A value too big for the cache isn't cached, and drops the old one.
+        cache.set("a", 11, "AAA")
+        self.assertEqual((cache.get("a"), cache.size), (None, 0))
+        cache.set("b", 2, "B")
+        cache.clear()
+        self.assertEqual((cache.get("b"), len(cache), cache.size),
+                         (None, 0, 0))
+
+
+class ServingTestCase(BundleTestCase):
+
+    def setUp(self):
+        super(ServingTestCase, self).setUp()
+        self.write("a.js", "var a;\n")
+        self.bundle = self.add_bundle(type="javascript", name="scripts",
+                                      files=["a.js"])
+        self.saved = (serving._cache, serving._dependencies,
+                      serving.build_files)
+        serving._cache = LRUCache(2**20)
+        serving._dependencies = None
+        serving._build_keys.clear()
+        self.builds = []
+        build_files = serving.build_files
+        def counting_build_files(bundle):
+            self.builds.append(bundle.name)
+            return build_files(bundle)
+        serving.build_files = counting_build_files
+
+    def tearDown(self):
+        (serving._cache, serving._dependencies,
+         serving.build_files) = self.saved
+        serving._build_keys.clear()
+        super(ServingTestCase, self).tearDown()
+
+
+class GetFilesTest(ServingTestCase):
+
+    def testSingleFlight(self):
+        # Slow the build down so every thread asks for it while it runs.
+        build_files = serving.build_files
+        def slow_build_files(bundle):
+            time.sleep(0.1)
+            return build_files(bundle)
+        serving.build_files = slow_build_files
+        key = serving.get_build_key(self.bundle)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                       serving.get_files(self.bundle, key)))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.builds, ["scripts"])
+        self.assertEqual(results, [{"scripts.js": "var a;\n"}] * 4)
+        self.assertEqual(serving._flights, {})
+
+    def testBuiltOutsideMediaDir(self):
+        listings = []
+        make_bundle = self.bundle.make_bundle
+        def listing_make_bundle(versioner):
+            make_bundle(versioner)
+            listings.append(sorted(os.listdir(self.dir)))
+        self.bundle.make_bundle = listing_make_bundle
+        self.assertEqual(serving.get_files(self.bundle,
+                                           serving.get_build_key(self.bundle)),
+                         {"scripts.js": "var a;\n"})
+        self.assertEqual(listings, [["a.js"]])
+
+    def testBuildKeyRechecked(self):
+        key = serving.get_build_key(self.bundle)
+        self.write("a.js", "var b;\n")
+        # Within the interval the sources aren't checked again.
+        self.assertEqual(serving.get_build_key(self.bundle), key)
+        serving._build_keys["scripts"] = (key, 0)
+        self.assertNotEqual(serving.get_build_key(self.bundle), key)
+
+
+class ServeBundleTest(ServingTestCase):
+
+    def get(self, filename, etag=None):
+        headers = {}
+        if etag:
+            headers["HTTP_IF_NONE_MATCH"] = etag
+        request = RequestFactory().get("/bundles/" + filename, **headers)
+        return serve_bundle(request, filename)
+
+    def testNotModified(self):
+        response = self.get("scripts.js")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, "var a;\n")
+        self.assert_("javascript" in response["Content-Type"])
+        etag = response["ETag"]
+        # Revalidating doesn't build or read the cache.
+        serving._cache.clear()
+        response = self.get("scripts.js", etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.builds, ["scripts"])
+        # A versioned URL is the same file.
+        self.assertEqual(self.get("scripts.0123456789.js", etag).status_code,
+                         304)
+
+    def testChangedSource(self):
+        etag = self.get("scripts.js")["ETag"]
+        self.write("a.js", "var b;\n")
+        serving._build_keys.clear()
+        response = self.get("scripts.js", etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, "var b;\n")
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.builds, ["scripts", "scripts"])
+
+    def testUnknownFile(self):
+        from django.http import Http404
+        self.assertRaises(Http404, self.get, "other.js")
+        self.assertRaises(Http404, self.get, "scripts.css")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# media_bundler/staging.py
+
+"""
+Staged builds.
+
+In a staged build, every file the build writes goes to a hidden staging
+directory next to its real location instead of the live media directories.
+Once every bundle has built, the staged files are published with renames, which
+are atomic because the staging directory is on the same filesystem.  New files,
+like versioned bundles, are published before files that replace live ones, and
+the version file goes last, so a running site never refers to a file that isn't
+there yet.
+
+The active stage is kept in a module global, like the bundle and version
+caches, and the build code asks for output_path() and input_path() instead of
+using bundle paths directly.
+
+A stage that is only thrown away, like the ones the serving views build in,
+can keep its staging directories under a root directory of its own instead, so
+nothing is ever written to the media directories.
+"""
+
+import binascii
+import os
+import shutil
+
+
+STAGE_DIR_PREFIX = ".bundle-stage-"
+
+
+class Stage(object):
+
+    """A set of staging directories for one build.
+
+    paths are the files the build may write.  A staging directory is made
+    next to each of them, or in root_dir if it is set.  Publishing from a
+    root_dir on another filesystem isn't atomic, so it is meant for stages
+    that are discarded.
+    """
+
+    def __init__(self, paths, token=None, root_dir=None):
+        if token is None:
+            token = "%d-%s" % (os.getpid(), binascii.hexlify(os.urandom(4)))
+        self.token = token
+        self.root_dir = root_dir
+        self.dirs = sorted(set(os.path.dirname(os.path.abspath(path))
+                               for path in paths))
+
+    def get_stage_dir(self, dir):
+        if self.root_dir:
+            return os.path.join(self.root_dir, "%s%s-%d" % (
+                STAGE_DIR_PREFIX, self.token, self.dirs.index(dir)))
+        return os.path.join(dir, STAGE_DIR_PREFIX + self.token)
+
+    def get_output_path(self, path):
+        """Return where the build should write path."""
+        (dir, basename) = os.path.split(os.path.abspath(path))
+        if dir not in self.dirs:
+            return path
+        return os.path.join(self.get_stage_dir(dir), basename)
+
+    def get_input_path(self, path):
+        """Return the staged copy of path if this build wrote one."""
+        staged_path = self.get_output_path(path)
+        if staged_path != path and os.path.exists(staged_path):
+            return staged_path
+        return path
+
+    def create(self):
+        for dir in self.dirs:
+            os.mkdir(self.get_stage_dir(dir))
+
+    def publish(self, last=()):
+        """Move every staged file into place.
+
+        Staged files that don't replace a live file are published first, then
+        the ones that do, and then the paths in last, in order.
+        """
+        last = [os.path.abspath(path) for path in last]
+        new = []
+        replacing = []
+        for dir in self.dirs:
+            stage_dir = self.get_stage_dir(dir)
+            for basename in sorted(os.listdir(stage_dir)):
+                path = os.path.join(dir, basename)
+                if path in last:
+                    continue
+                if os.path.exists(path):
+                    replacing.append(path)
+                else:
+                    new.append(path)
+        for path in new + replacing + last:
+            staged_path = self.get_output_path(path)
+            if os.path.exists(staged_path):
+                os.rename(staged_path, path)
+        self.discard()
+
+    def discard(self):
+        """Remove the staging directories and anything left in them."""
+        for dir in self.dirs:
+            shutil.rmtree(self.get_stage_dir(dir), ignore_errors=True)
+
+
+_stage = None
+
+def activate(stage):
+    """Make stage the active stage, or deactivate staging with None."""
+    global _stage
+    _stage = stage
+
+
+def get_active_stage():
+    return _stage
+
+
+def output_path(path):
+    """Return where the active build should write path."""
+    if _stage is None:
+        return path
+    return _stage.get_output_path(path)
+
+
+def input_path(path):
+    """Return the path to read path from during the active build."""
+    if _stage is None:
+        return path
+    return _stage.get_input_path(path)
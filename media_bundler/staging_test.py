@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""Tests for staged builds."""
+
+from cStringIO import StringIO
+import os
+import unittest
+
+from test_support import BundleTestCase
+
+from media_bundler import staging
+from media_bundler.build import BundleBuilder, SourceError
+from media_bundler.staging import STAGE_DIR_PREFIX, Stage
+
+
+class StageTest(BundleTestCase):
+
+    def setUp(self):
+        super(StageTest, self).setUp()
+        self.write("app.js", "old")
+        self.write("versions.json", "{}")
+
+    def tearDown(self):
+        staging.activate(None)
+        super(StageTest, self).tearDown()
+
+    def testPaths(self):
+        stage = Stage([self.path("app.js")], "test")
+        stage.create()
+        staged = os.path.join(self.dir, STAGE_DIR_PREFIX + "test", "app.js")
+        self.assertEqual(stage.get_output_path(self.path("app.js")), staged)
+        # Nothing is staged yet, so reads come from the live file.
+        self.assertEqual(stage.get_input_path(self.path("app.js")),
+                         self.path("app.js"))
+        self.write(staged, "new")
+        self.assertEqual(stage.get_input_path(self.path("app.js")), staged)
+        self.assertEqual(stage.get_output_path("/elsewhere/app.js"),
+                         "/elsewhere/app.js")
+        stage.discard()
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ["app.js", "versions.json"])
+
+    def testRootDir(self):
+        os.mkdir(self.path("root"))
+        os.mkdir(self.path("css"))
+        stage = Stage([self.path("app.js"), self.path("css/app.css")],
+                      "test", root_dir=self.path("root"))
+        stage.create()
+        self.assertEqual(stage.get_output_path(self.path("app.js")),
+                         self.path("root/%stest-0/app.js" % STAGE_DIR_PREFIX))
+        self.assertEqual(stage.get_output_path(self.path("css/app.css")),
+                         self.path("root/%stest-1/app.css" % STAGE_DIR_PREFIX))
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ["app.js", "css", "root", "versions.json"])
+        self.assertEqual(os.listdir(self.path("css")), [])
+        stage.discard()
+        self.assertEqual(os.listdir(self.path("root")), [])
+
+    def testPublishOrder(self):
+        paths = [self.path(f) for f in
+                 ("app.js", "app.0123456789.js", "versions.json")]
+        stage = Stage(paths)
+        stage.create()
+        for path in paths:
+            self.write(stage.get_output_path(path), "new")
+        renamed = []
+        rename = os.rename
+        def record_rename(src, dst):
+            renamed.append(os.path.basename(dst))
+            rename(src, dst)
+        staging.os.rename = record_rename
+        try:
+            stage.publish(last=[self.path("versions.json")])
+        finally:
+            staging.os.rename = rename
+        # New files first, then the ones they replace, then the version file.
+        self.assertEqual(renamed, ["app.0123456789.js", "app.js",
+                                   "versions.json"])
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ["app.0123456789.js", "app.js", "versions.json"])
+        self.assertEqual(self.read("app.js"), "new")
+
+    def testFailedBuild(self):
+        # The second bundle's source is missing, so the build fails after the
+        # first has been written to the stage.
+        self.write("a.js", "var a;")
+        bundles = [self.add_bundle(type="javascript", name=name,
+                                   files=[source])
+                   for (name, source) in (("app", "a.js"),
+                                          ("broken", "missing.js"))]
+        stage = Stage([path for bundle in bundles
+                       for path in bundle.get_output_paths()])
+        stage.create()
+        staging.activate(stage)
+        try:
+            builder = BundleBuilder(bundles, stdout=StringIO())
+            self.assertRaises(SourceError, builder.run)
+            self.assertEqual(builder.rebuilt.keys(), ["app"])
+            self.assert_(os.path.exists(
+                stage.get_output_path(self.path("app.js"))))
+        finally:
+            staging.activate(None)
+            stage.discard()
+        self.assertEqual(self.read("app.js"), "old")
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ["a.js", "app.js", "versions.json"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+# media_bundler/stats.py
+
+"""
+Build statistics.
+
+While a bundle builds, the pipeline wraps each stage of the work (concatenating
+or minifying sources, packing, pasting, encoding and optimizing sprites,
+hashing and copying versioned files, and gzipping) in stage(), which adds its
+wall and CPU time to the active BuildStats.  The active stats are kept in a
+module global, like the active stage in staging, and stage() does nothing when
+there aren't any.  BuildStats can also run every stage under cProfile and dump
+one profile per stage.
+
+Peak memory is the peak resident set size during the bundle's build.  Linux
+lets a process start its peak over, so each build resets it when it starts.
+Elsewhere the peak would include the bundles built before it in the same
+process, so it isn't reported.
+"""
+
+from __future__ import with_statement
+
+from contextlib import contextmanager
+import cProfile
+import os
+import time
+
+
+STATS_FORMAT = 1
+
+
+def cpu_time():
+    """Return the user and system CPU time of this process."""
+    (user, system) = os.times()[:2]
+    return user + system
+
+
+def reset_peak_rss():
+    """Start the peak resident set size of this process over.
+
+    Returns whether it could, which only Linux allows, through
+    /proc/self/clear_refs.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as output:
+            output.write("5")
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes, or None.
+
+    This is the peak since the last reset_peak_rss().
+    """
+    try:
+        with open("/proc/self/status") as input:
+            for line in input:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+
+class BuildStats(object):
+
+    """Timings and sizes for one bundle build.
+
+    If profile_dir is set, each stage runs under cProfile, and finish() dumps
+    the profiles there as <bundle>.<stage>.prof.
+    """
+
+    def __init__(self, name, profile_dir=None):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.stages = []
+        self._stages = {}
+        self._profiles = {}
+        self._current = None
+        self.wall = self.cpu = None
+        self.input_bytes = self.output_bytes = None
+        self.peak_rss = None
+
+    def start(self):
+        self._rss_reset = reset_peak_rss()
+        self._start = (time.time(), cpu_time())
+
+    @contextmanager
+    def stage(self, name):
+        if self._current is not None:
+            # Nested stages count towards the outer one.
+            yield
+            return
+        if name not in self._stages:
+            self._stages[name] = [0.0, 0.0, 0]
+            self.stages.append(name)
+        profile = None
+        if self.profile_dir:
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+        self._current = name
+        start = (time.time(), cpu_time())
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            totals = self._stages[name]
+            totals[0] += time.time() - start[0]
+            totals[1] += cpu_time() - start[1]
+            totals[2] += 1
+            self._current = None
+
+    def finish(self, input_paths, output_paths):
+        """Record the totals and sizes, and dump any profiles."""
+        self.wall = time.time() - self._start[0]
+        self.cpu = cpu_time() - self._start[1]
+        self.input_bytes = sum(os.path.getsize(path) for path in input_paths)
+        self.output_bytes = sum(os.path.getsize(path)
+                                for path in output_paths)
+        if self._rss_reset:
+            self.peak_rss = peak_rss()
+        for (name, profile) in self._profiles.iteritems():
+            filename = "%s.%s.prof" % (self.name, name)
+            profile.dump_stats(os.path.join(self.profile_dir, filename))
+
+    def get_ratio(self):
+        if not self.input_bytes:
+            return None
+        return float(self.output_bytes) / self.input_bytes
+
+    def to_dict(self):
+        """Return the stats as a JSON-serializable dict."""
+        return {
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "input_bytes": self.input_bytes,
+            "output_bytes": self.output_bytes,
+            "ratio": self.get_ratio(),
+            "peak_rss": self.peak_rss,
+            "stages": [{"name": name,
+                        "wall": self._stages[name][0],
+                        "cpu": self._stages[name][1],
+                        "calls": self._stages[name][2]}
+                       for name in self.stages],
+        }
+
+
+_stats = None
+
+def activate(stats):
+    """Make stats the active BuildStats, or stop recording with None."""
+    global _stats
+    _stats = stats
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed code as a stage of the active build, if any."""
+    if _stats is None:
+        yield
+    else:
+        with _stats.stage(name):
+            yield
+
+
+def _format_bytes(size):
+    if size is None:
+        return "-"
+    if size < 1024:
+        return "%d B" % size
+    for unit in ("KB", "MB", "GB"):
+        size /= 1024.0
+        if size < 1024 or unit == "GB":
+            return "%.1f %s" % (size, unit)
+
+
+def format_table(bundle_stats):
+    """Return a summary table of a dict of bundle names to stats dicts."""
+    lines = ["%-24s %8s %8s %10s %10s %6s %9s" %
+             ("Bundle", "Wall", "CPU", "In", "Out", "Ratio", "Peak RSS")]
+    for name in sorted(bundle_stats):
+        stats = bundle_stats[name]
+        ratio = stats["ratio"]
+        lines.append("%-24s %7.3fs %7.3fs %10s %10s %6s %9s" % (
+            name, stats["wall"], stats["cpu"],
+            _format_bytes(stats["input_bytes"]),
+            _format_bytes(stats["output_bytes"]),
+            "-" if ratio is None else "%.1f%%" % (100 * ratio),
+            _format_bytes(stats["peak_rss"])))
+        for stage_stats in stats["stages"]:
+            lines.append("  %-22s %7.3fs %7.3fs" % (
+                stage_stats["name"], stage_stats["wall"], stage_stats["cpu"]))
+    return "\n".join(lines)
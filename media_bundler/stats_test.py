@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""Tests for build stats."""
+
+import unittest
+
+from test_support import BundleTestCase
+
+from media_bundler import stats
+from media_bundler.stats import BuildStats, format_table
+
+
+class FakeClock(object):
+
+    """Stands in for the time module, with CPU time at half the wall time."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def cpu_time(self):
+        return self.now / 2
+
+
+class BuildStatsTest(BundleTestCase):
+
+    def setUp(self):
+        super(BuildStatsTest, self).setUp()
+        self.clock = FakeClock()
+        self.saved = (stats.time, stats.cpu_time)
+        (stats.time, stats.cpu_time) = (self.clock, self.clock.cpu_time)
+        self.write("a.js", "x" * 10)
+        self.write("app.js", "x" * 5)
+
+    def tearDown(self):
+        (stats.time, stats.cpu_time) = self.saved
+        stats.activate(None)
+        super(BuildStatsTest, self).tearDown()
+
+    def build(self):
+        build_stats = BuildStats("app")
+        build_stats.start()
+        with build_stats.stage("minify"):
+            self.clock.now += 2
+            # Nested stages count towards the outer one.
+            with build_stats.stage("hash"):
+                self.clock.now += 1
+        self.clock.now += 1
+        with build_stats.stage("minify"):
+            self.clock.now += 1
+        build_stats.finish([self.path("a.js")], [self.path("app.js")])
+        return build_stats
+
+    def testStages(self):
+        self.assertEqual(self.build().to_dict()["stages"],
+                         [{"name": "minify", "wall": 4.0, "cpu": 2.0,
+                           "calls": 2}])
+
+    def testToDict(self):
+        result = self.build().to_dict()
+        self.assertEqual(sorted(result),
+                         ["cpu", "input_bytes", "output_bytes", "peak_rss",
+                          "ratio", "stages", "wall"])
+        self.assertEqual((result["wall"], result["cpu"]), (5.0, 2.5))
+        self.assertEqual((result["input_bytes"], result["output_bytes"],
+                          result["ratio"]), (10, 5, 0.5))
+
+    def testInactive(self):
+        # Without active stats, stages are just run.
+        with stats.stage("minify"):
+            self.clock.now += 1
+        build_stats = BuildStats("app")
+        stats.activate(build_stats)
+        build_stats.start()
+        with stats.stage("minify"):
+            self.clock.now += 1
+        stats.activate(None)
+        with stats.stage("minify"):
+            self.clock.now += 1
+        self.assertEqual(build_stats._stages, {"minify": [1.0, 0.5, 1]})
+
+
+class PeakRssTest(BundleTestCase):
+
+    def setUp(self):
+        super(PeakRssTest, self).setUp()
+        self.saved = stats.reset_peak_rss
+        self.write("app.js", "")
+
+    def tearDown(self):
+        stats.reset_peak_rss = self.saved
+        super(PeakRssTest, self).tearDown()
+
+    def finish(self):
+        build_stats = BuildStats("app")
+        build_stats.start()
+        build_stats.finish([], [self.path("app.js")])
+        return build_stats.peak_rss
+
+    def testReset(self):
+        if not stats.reset_peak_rss():
+            return  # Not on Linux.
+        # Each build starts the peak over, so 64 MB used before doesn't count.
+        big = "x" * (64 * 1024 * 1024)
+        del big
+        peak = stats.peak_rss()
+        self.assert_(0 < self.finish() < peak - 32 * 1024 * 1024)
+
+    def testUnsupported(self):
+        stats.reset_peak_rss = lambda: False
+        self.assertEqual(self.finish(), None)
+
+
+class FormatTableTest(unittest.TestCase):
+
+    def testMissingValues(self):
+        self.assertEqual(format_table({"app": {
+            "wall": 1.5, "cpu": 0.25, "input_bytes": 0, "output_bytes": 2048,
+            "ratio": None, "peak_rss": None,
+            "stages": [{"name": "concatenate", "wall": 1.0, "cpu": 0.25,
+                        "calls": 1}]}}).splitlines()[1:],
+            ["app                        1.500s   0.250s        0 B     2.0 KB"
+             "      -         -",
+             "  concatenate              1.000s   0.250s"])
+
+
+if __name__ == '__main__':
+    unittest.main()
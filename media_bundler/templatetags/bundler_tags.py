@@ -4,11 +4,20 @@
 Template tags for the django media bundler.
 """
 
+from __future__ import with_statement
+
+import os
+import re
+import urlparse
+
 from django import template
+from django.conf import settings
 from django.template import Variable
 
 from media_bundler import bundler
+from media_bundler import versioning
 from media_bundler.conf import bundler_settings
+from media_bundler.middleware import add_preload_hint
 
 register = template.Library()
 
@@ -46,46 +55,175 @@ def resolve_variable(var, context):
         return var
 
 
+def literal_value(var):
+    """Return the value of a literal tag argument, or None for variables."""
+    if isinstance(var, Variable):
+        return var.literal
+    return var
+
+
+def lookup_bundle(bundle_name, file_name):
+    """Return the named bundle, checking that it contains file_name."""
+    try:
+        bundle = bundler.get_bundles()[bundle_name]
+    except KeyError:
+        raise template.TemplateSyntaxError("Unknown bundle %r." % bundle_name)
+    if file_name not in bundle.file_set:
+        msg = "File %r is not in bundle %r." % (file_name, bundle_name)
+        raise template.TemplateSyntaxError(msg)
+    return bundle
+
+
+CSS_URL_RE = re.compile(r"""(url\(\s*(["']?))([^"')\s]+)""", re.IGNORECASE)
+
+
+def absolutize_css_urls(css, base_url):
+    """Resolve the relative url()s in a stylesheet against base_url.
+
+    Relative URLs in a linked stylesheet are relative to the stylesheet, but
+    once it is inlined they would be relative to the page instead.
+    """
+    def absolutize(match):
+        url = match.group(3)
+        if url.startswith("#"):
+            return match.group(0)  # A fragment of the document itself.
+        return match.group(1) + urlparse.urljoin(base_url, url)
+    return CSS_URL_RE.sub(absolutize, css)
+
+
+# Contents of bundles with an inline_threshold, keyed by bundle name, or None
+# for bundles that should be linked instead.  Replaced with a new dict whenever
+# the versions change.
+_inline_contents = {}
+_inline_contents_generation = None
+
+
+def get_inline_content(bundle, generation, versions):
+    """Return the contents of a bundle to inline, or None to link it."""
+    global _inline_contents, _inline_contents_generation
+    contents = _inline_contents
+    if generation != _inline_contents_generation:
+        contents = _inline_contents = {}
+        _inline_contents_generation = generation
+    try:
+        return contents[bundle.name]
+    except KeyError:
+        pass
+    content = None
+    path = bundle.get_published_path(versions)
+    try:
+        if os.path.getsize(path) < bundle.inline_threshold:
+            with open(path) as input:
+                content = input.read().decode(settings.FILE_CHARSET)
+    except (IOError, OSError):
+        pass  # Not built yet, so fall back to linking it.
+    if content is not None and isinstance(bundle, bundler.CssBundle):
+        content = absolutize_css_urls(content, bundle.get_bundle_url(versions))
+    contents[bundle.name] = content
+    return content
+
+
 class BundleNode(template.Node):
 
     """Base class for any nodes that are linking bundles.
 
     Subclasses must define class variables TAG and CONTEXT_VAR.  They can
-    optionally override the method 'really_render(url)' to control tag-specific
-    rendering behavior.
+    optionally override the method 'really_render(context, tag)' to control
+    tag-specific rendering behavior.  Subclasses that define INLINE_TAG, and
+    INLINE_END, the closing tag that must not appear in inlined content, can
+    inline bundles smaller than their inline_threshold.  PRELOAD_AS is the
+    "as" value of preload hints for linked files.
+
+    When the bundle and file names are literals, they are looked up and checked
+    once, when the template is parsed.  The URL and tag are computed on first
+    use and cached until the bundle versions change.
     """
 
     TAG = None
 
+    INLINE_TAG = None
+
+    INLINE_END = None
+
+    PRELOAD_AS = None
+
     CONTEXT_VAR = None
 
+    @classmethod
+    def is_deferred(cls):
+        """Return whether tags are moved to {% deferred_content %}."""
+        return False
+
     def __init__(self, bundle_name, file_name):
         super(BundleNode, self).__init__()
         self.bundle_name = bundle_name
         self.file_name = file_name
+        self.bundle = None
+        literal_bundle_name = literal_value(bundle_name)
+        literal_file_name = literal_value(file_name)
+        if literal_bundle_name is not None and literal_file_name is not None:
+            self.bundle = lookup_bundle(literal_bundle_name, literal_file_name)
+            self.file_name = literal_file_name
+        self._cached = None
 
     def render(self, context):
-        bundle_name = resolve_variable(self.bundle_name, context)
-        file_name = resolve_variable(self.file_name, context)
-        bundle = bundler.get_bundles()[bundle_name]
-        if file_name not in bundle.files:
-            msg = "File %r is not in bundle %r." % (file_name,
-                                                    bundle_name)
-            raise template.TemplateSyntaxError(msg)
+        bundle = self.bundle
+        file_name = self.file_name
+        if bundle is None:
+            bundle_name = resolve_variable(self.bundle_name, context)
+            file_name = resolve_variable(self.file_name, context)
+            bundle = lookup_bundle(bundle_name, file_name)
+        (url, tag, preload_as) = self.get_url_and_tag(bundle, file_name)
         url_set = context_set_default(context, self.CONTEXT_VAR, set())
-        if bundler_settings.USE_BUNDLES:
-            url = bundle.get_bundle_url()
-        else:
-            url = bundle.url + file_name
         if url in url_set:
             return ""  # Don't add a bundle or css url twice.
         else:
             url_set.add(url)
-            return self.really_render(context, url, bundle_name, file_name)
-
-    def really_render(self, context, url, bundle_name, file_name):
+            if preload_as:
+                add_preload_hint(context, url, preload_as)
+            return self.really_render(context, tag)
+
+    def get_url_and_tag(self, bundle, file_name):
+        """Return the URL to link, the tag linking it and its preload type.
+
+        The preload type is None if the URL shouldn't be preloaded.
+        """
+        (generation, versions) = versioning.get_versions_snapshot()
+        key = (bundle.name, file_name, bundler_settings.USE_BUNDLES,
+               generation)
+        cached = self._cached
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        tag = None
+        if bundler_settings.USE_BUNDLES:
+            url = bundle.get_bundle_url(versions)
+            tag = self.make_inline_tag(bundle, generation, versions)
+        else:
+            url = bundle.url + file_name
+        preload_as = None
+        if tag is None:
+            tag = self.TAG % url
+            if bundle.preload:
+                preload_as = self.PRELOAD_AS
+        result = (url, tag, preload_as)
+        self._cached = (key, result)
+        return result
+
+    def make_inline_tag(self, bundle, generation, versions):
+        """Return a tag inlining a built bundle if it is small, or None.
+
+        The URL is still used to dedupe inlined bundles.
+        """
+        if bundle.inline_threshold and self.INLINE_TAG:
+            content = get_inline_content(bundle, generation, versions)
+            if content is not None and \
+                    self.INLINE_END not in content.lower():
+                return self.INLINE_TAG % content
+        return None
+
+    def really_render(self, context, tag):
         """Implement bundle type specific rendering behavior."""
-        return self.TAG % url
+        return tag
 
 
 @register.tag
@@ -101,15 +239,24 @@ class JavascriptNode(BundleNode):
 
     TAG = '<script type="text/javascript" src="%s"></script>'
 
+    INLINE_TAG = '<script type="text/javascript">%s</script>'
+
+    INLINE_END = '</script'
+
+    PRELOAD_AS = 'script'
+
     CONTEXT_VAR = "_script_urls"
 
     def __init__(self, bundle_name, script_name):
         super(JavascriptNode, self).__init__(bundle_name, script_name)
 
-    def really_render(self, context, url, bundle_name, file_name):
-        content = super(JavascriptNode, self).really_render(context, url,
-                bundle_name, file_name)
-        if bundler_settings.DEFER_JAVASCRIPT:
+    @classmethod
+    def is_deferred(cls):
+        return bundler_settings.DEFER_JAVASCRIPT
+
+    def really_render(self, context, tag):
+        content = super(JavascriptNode, self).really_render(context, tag)
+        if self.is_deferred():
             deferred = context_set_default(context, "_deferred_content", [])
             deferred.append(content)
             return ""
@@ -130,6 +277,12 @@ class CssNode(BundleNode):
 
     TAG = '<link rel="stylesheet" type="text/css" href="%s"/>'
 
+    INLINE_TAG = '<style type="text/css">%s</style>'
+
+    INLINE_END = '</style'
+
+    PRELOAD_AS = 'style'
+
     CONTEXT_VAR = "_css_urls"
 
     def __init__(self, bundle_name, css_name):
@@ -177,6 +330,41 @@ class DeferredContentNode(template.Node):
         return "\n".join(context.get("_deferred_content", ()))
 
 
+# Tag lists for whole bundles, keyed by handler, bundle name, USE_BUNDLES,
+# DEFER_JAVASCRIPT and the versions generation.  Replaced with a new dict
+# whenever the versions change.
+_tag_lists = {}
+_tag_lists_generation = None
+
+
+def get_tag_list(type_handler, bundle):
+    """Return the distinct (url, tag, preload_as) triples for a bundle.
+
+    The list is built once per versions generation and shared by every
+    {% load_bundle %} of the bundle.
+    """
+    global _tag_lists, _tag_lists_generation
+    generation = versioning.get_versions_snapshot()[0]
+    tag_lists = _tag_lists
+    if generation != _tag_lists_generation:
+        tag_lists = _tag_lists = {}
+        _tag_lists_generation = generation
+    key = (type_handler, bundle.name, bundler_settings.USE_BUNDLES,
+           bundler_settings.DEFER_JAVASCRIPT, generation)
+    tags = tag_lists.get(key)
+    if tags is None:
+        tags = []
+        seen = set()
+        for file_name in bundle.files:
+            node = type_handler(bundle.name, file_name)
+            result = node.get_url_and_tag(bundle, file_name)
+            if result[0] not in seen:
+                seen.add(result[0])
+                tags.append(result)
+        tag_lists[key] = tags
+    return tags
+
+
 class MultiBundleNode(template.Node):
 
     """Node loading a complete bundle by name."""
@@ -193,16 +381,34 @@ class MultiBundleNode(template.Node):
             if hasattr(self, attr_name):
                 setattr(self, attr_name, attr_value)
 
-    def render(self, context):
-        bundle_name = self.bundle_name_var.resolve(context)
-        bundle = bundler.get_bundles()[bundle_name]
-        type_handler = self.bundle_type_handlers[bundle.type]
+        self.bundle = None
+        if self.bundle_name_var.literal is not None:
+            self.bundle = self.get_bundle(self.bundle_name_var.literal)
 
-        def process_file(file_name):
-            return type_handler(self.bundle_name_var,
-                                file_name).render(context)
+    def get_bundle(self, bundle_name):
+        try:
+            return bundler.get_bundles()[bundle_name]
+        except KeyError:
+            msg = "Unknown bundle %r." % bundle_name
+            raise template.TemplateSyntaxError(msg)
 
-        tags = [process_file(file_name) for file_name in bundle.files]
+    def render(self, context):
+        bundle = self.bundle
+        if bundle is None:
+            bundle = self.get_bundle(self.bundle_name_var.resolve(context))
+        type_handler = self.bundle_type_handlers[bundle.type]
+        url_set = context_set_default(context, type_handler.CONTEXT_VAR, set())
+        tags = []
+        for (url, tag, preload_as) in get_tag_list(type_handler, bundle):
+            if url not in url_set:
+                url_set.add(url)
+                if preload_as:
+                    add_preload_hint(context, url, preload_as)
+                tags.append(tag)
+        if tags and type_handler.is_deferred():
+            deferred = context_set_default(context, "_deferred_content", [])
+            deferred.extend(tags)
+            return ""
         return "\n".join(tags)
 
 
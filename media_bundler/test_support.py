@@ -0,0 +1,68 @@
+# media_bundler/test_support.py
+
+"""
+Shared setup for the tests.
+
+The tests are run as scripts from this directory, so importing this module puts
+the package on the path and configures Django before any media_bundler module
+that reads settings is imported.
+"""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure(DEBUG=False, INSTALLED_APPS=("media_bundler",))
+
+from media_bundler import bundler
+from media_bundler.conf import bundler_settings
+
+
+class BundleTestCase(unittest.TestCase):
+
+    """Runs each test in a fresh media directory with no bundles.
+
+    Settings changed with set_setting() are restored after the test.
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved_settings = {}
+        self.saved_bundles = bundler._bundles
+        self.bundles = bundler._bundles = {}
+
+    def tearDown(self):
+        for (name, value) in self.saved_settings.iteritems():
+            setattr(bundler_settings, name, value)
+        bundler._bundles = self.saved_bundles
+        shutil.rmtree(self.dir)
+
+    def set_setting(self, name, value):
+        self.saved_settings.setdefault(name, getattr(bundler_settings, name))
+        setattr(bundler_settings, name, value)
+
+    def path(self, filename):
+        return os.path.join(self.dir, filename)
+
+    def write(self, filename, content):
+        with open(self.path(filename), "w") as output:
+            output.write(content)
+
+    def read(self, filename):
+        with open(self.path(filename)) as input:
+            return input.read()
+
+    def add_bundle(self, **attrs):
+        attrs.setdefault("path", self.dir)
+        attrs.setdefault("url", "/media/")
+        bundle = bundler.Bundle.from_dict(attrs)
+        self.bundles[bundle.name] = bundle
+        return bundle
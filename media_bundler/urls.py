@@ -0,0 +1,20 @@
+# media_bundler/urls.py
+
+"""
+URLs for serving bundles on demand.
+
+Include these under the URL you set BUNDLE_SERVE_URL to, for example:
+
+    url(r"^bundles/", include("media_bundler.urls")),
+"""
+
+try:
+    from django.conf.urls import patterns, url
+except ImportError:
+    from django.conf.urls.defaults import patterns, url  # Django < 1.4
+
+
+urlpatterns = patterns("media_bundler.views",
+    url(r"^(?P<filename>[^/]+)$", "serve_bundle",
+        name="media_bundler_serve_bundle"),
+)
@@ -17,41 +17,140 @@ from __future__ import with_statement
 from hashlib import md5, sha1
 import os
 import shutil
+import time
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
 
 from media_bundler.conf import bundler_settings
+from media_bundler import staging
+from media_bundler import stats
 
 
-_bundle_versions = None
+class VersionSnapshot(dict):
 
-def get_bundle_versions():
-    global _bundle_versions
+    """A read-only mapping of bundle names to versioned filenames.
+
+    Snapshots are never changed once published, so threads that are rendering
+    templates can keep using one while another thread reloads the versions.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Bundle version snapshots are read-only.")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+NO_VERSIONS = VersionSnapshot()
+
+# The published versions, as a (generation, versions) tuple so that readers
+# always see a matching pair.  The generation goes up every time the versions
+# change, which lets other modules key caches on it.
+_snapshot = None
+_snapshot_mtime = None
+_next_check = 0
+
+
+def _is_json(path):
+    return path.endswith('.json')
+
+
+def get_versions_snapshot():
+    """Return the current (generation, versions) pair.
+
+    The version file is loaded the first time this is called, and reloaded
+    if its mtime changes, checking at most every
+    BUNDLE_VERSION_RELOAD_INTERVAL seconds.
+    """
+    global _next_check
     if not bundler_settings.BUNDLE_VERSION_FILE:
-        _bundle_versions = {}  # Should this be None?
-    if _bundle_versions is None:
+        return (0, NO_VERSIONS)
+    if _snapshot is None:
         update_versions()
-    return _bundle_versions
+        return _snapshot
+    interval = bundler_settings.BUNDLE_VERSION_RELOAD_INTERVAL
+    if interval is not None:
+        now = time.time()
+        if now >= _next_check:
+            _next_check = now + interval
+            if _get_mtime(bundler_settings.BUNDLE_VERSION_FILE) != \
+                    _snapshot_mtime:
+                update_versions()
+    return _snapshot
 
 
-def update_versions():
-    """Executes the bundle versions file and updates the cache."""
-    global _bundle_versions
+def get_bundle_versions():
+    return get_versions_snapshot()[1]
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _publish(versions, mtime):
+    global _snapshot, _snapshot_mtime
+    generation = _snapshot[0] + 1 if _snapshot else 1
+    _snapshot_mtime = mtime
+    _snapshot = (generation, VersionSnapshot(versions))
+
+
+def load_versions(path):
+    """Read a version file, in JSON or as a Python module.
+
+    Raises ValueError if the file can't be parsed.
+    """
+    if _is_json(path):
+        with open(path) as input:
+            return json.load(input)
     vars = {}
     try:
-        execfile(bundler_settings.BUNDLE_VERSION_FILE, vars)
-    except IOError:
-        _bundle_versions = {}
-    else:
-        _bundle_versions = vars['BUNDLE_VERSIONS']
-
-
-def write_versions(versions):
-    global _bundle_versions
-    _bundle_versions = _bundle_versions.copy()
-    _bundle_versions.update(versions)
-    with open(bundler_settings.BUNDLE_VERSION_FILE, 'w') as output:
-        versions_str = '\n'.join('    %r: %r,' % (name, vers)
-                                 for (name, vers) in versions.iteritems())
-        output.write('''\
+        execfile(path, vars)
+        return vars['BUNDLE_VERSIONS']
+    except (SyntaxError, NameError, KeyError), e:
+        raise ValueError("Bad version file %s: %s" % (path, e))
+
+
+def update_versions():
+    """Loads the bundle versions file and updates the cache."""
+    path = bundler_settings.BUNDLE_VERSION_FILE
+    mtime = _get_mtime(path)
+    try:
+        versions = load_versions(path)
+    except (IOError, ValueError):
+        # The file is missing, or was caught half-written by something other
+        # than bundle_media.  Keep what we have until it changes again.
+        if _snapshot is not None:
+            return
+        versions = {}
+    _publish(versions, mtime)
+
+
+def write_versions(versions, removed=()):
+    """Merge versions into the current versions and write them all out.
+
+    The names in removed are dropped from the current versions first.
+    """
+    merged = dict(get_bundle_versions())
+    for name in removed:
+        merged.pop(name, None)
+    merged.update(versions)
+    path = staging.output_path(bundler_settings.BUNDLE_VERSION_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as output:
+        if _is_json(path):
+            json.dump(merged, output, indent=0, sort_keys=True,
+                      separators=(',', ': '))
+            output.write('\n')
+        else:
+            versions_str = '\n'.join('    %r: %r,' % (name, merged[name])
+                                     for name in sorted(merged))
+            output.write('''\
 #!/usr/bin/env python
 
 """
@@ -64,6 +163,28 @@ BUNDLE_VERSIONS = {
 %s
 }
 ''' % versions_str)
+    os.rename(tmp_path, path)
+    _publish(merged, _get_mtime(path))
+
+
+def link_or_copy(src, dst):
+    """Make dst a hard link to src, or a copy where links aren't supported.
+
+    Bundles are always written to a temporary file and renamed into place, so
+    rebuilding a bundle never changes the contents of an older link to it.
+    """
+    tmp_path = dst + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except (AttributeError, OSError):
+        shutil.copyfile(src, tmp_path)
+    os.rename(tmp_path, dst)
+    # Renaming a link onto another link to the same file does nothing, which
+    # happens when a sprite sheet is kept as it was.
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
 
 
 class VersioningError(Exception):
@@ -71,33 +192,65 @@ class VersioningError(Exception):
     """This exception is raised when version creation fails."""
 
 
+class HashingWriter(object):
+
+    """Wraps an output file, hashing everything written through it."""
+
+    def __init__(self, output, hash_method):
+        self.output = output
+        self.hash = hash_method()
+
+    def write(self, data):
+        self.hash.update(data)
+        self.output.write(data)
+
+    def flush(self):
+        self.output.flush()
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
 class VersioningBase(object):
 
     def __init__(self):
         self.versions = get_bundle_versions().copy()
 
-    def get_version(self, source_files):
+    def get_writer(self, output):
+        """Return a file to write the bundle through, in place of output."""
+        return output
+
+    def get_version(self, bundle, writer=None, digest=None):
         raise NotImplementedError
 
-    def update_bundle_version(self, bundle):
-        version = self.get_version(bundle)
-        orig_path = bundle.get_bundle_path()
+    def update_bundle_version(self, bundle, writer=None, digest=None):
+        """Version a freshly written bundle.
+
+        writer is the file returned by get_writer() that the bundle was
+        written through, if any, and digest the SHA-1 hex digest of the
+        bundle, if the caller has already computed it.
+        """
+        with stats.stage("hash"):
+            version = self.get_version(bundle, writer, digest)
+        orig_path = staging.output_path(bundle.get_bundle_path())
         dir, basename = os.path.split(orig_path)
         if '.' in basename:
             name, _, extension = basename.rpartition('.')
             versioned_basename = '.'.join((name, version, extension))
         else:
-            versioned_basename += '.' + version
+            versioned_basename = basename + '.' + version
         self.versions[bundle.name] = versioned_basename
         versioned_path = os.path.join(dir, versioned_basename)
-        shutil.copy(orig_path, versioned_path)
+        with stats.stage("copy"):
+            link_or_copy(orig_path, versioned_path)
 
 
 class MtimeVersioning(VersioningBase):
 
-    def get_version(self, bundle):
+    def get_version(self, bundle, writer=None, digest=None):
         """Return the modification time for the newest source file."""
-        return str(max(int(os.stat(f).st_mtime) for f in bundle.get_paths()))
+        return str(max(int(os.stat(f).st_mtime)
+                       for f in bundle.get_input_paths()))
 
 
 class HashVersioningBase(VersioningBase):
@@ -106,9 +259,16 @@ class HashVersioningBase(VersioningBase):
         super(HashVersioningBase, self).__init__()
         self.hash_method = hash_method
 
-    def get_version(self, bundle):
-        buf = open(bundle.get_bundle_path())
-        return self.get_hash(buf)
+    def get_writer(self, output):
+        return HashingWriter(output, self.hash_method)
+
+    def get_version(self, bundle, writer=None, digest=None):
+        if isinstance(writer, HashingWriter):
+            return writer.hexdigest()
+        if digest is not None and self.hash_method is sha1:
+            return digest
+        with open(staging.output_path(bundle.get_bundle_path()), 'rb') as buf:
+            return self.get_hash(buf)
 
     def get_hash(self, f, chunk_size=2**14):
         """Compute the hash of a file."""
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""Tests for loading and writing bundle versions."""
+
+import os
+import unittest
+
+from test_support import BundleTestCase
+
+from media_bundler import versioning
+from media_bundler.versioning import (get_bundle_versions,
+                                      get_versions_snapshot, load_versions,
+                                      write_versions)
+
+
+class VersionsTestCase(BundleTestCase):
+
+    def setUp(self):
+        super(VersionsTestCase, self).setUp()
+        self.saved_snapshot = (versioning._snapshot,
+                               versioning._snapshot_mtime,
+                               versioning._next_check)
+        versioning._snapshot = None
+        versioning._next_check = 0
+        self.set_setting("BUNDLE_VERSION_RELOAD_INTERVAL", 0)
+        self.set_setting("BUNDLE_VERSION_FILE", self.path("versions.json"))
+        self.mtime = 1000000000
+
+    def tearDown(self):
+        (versioning._snapshot, versioning._snapshot_mtime,
+         versioning._next_check) = self.saved_snapshot
+        super(VersionsTestCase, self).tearDown()
+
+    def write_file(self, content, filename="versions.json"):
+        """Write the version file with a new mtime."""
+        self.write(filename, content)
+        self.mtime += 10
+        os.utime(self.path(filename), (self.mtime, self.mtime))
+
+
+class LoadVersionsTest(VersionsTestCase):
+
+    def testJson(self):
+        self.write_file('{"app": "app.1.js"}')
+        self.assertEqual(get_versions_snapshot(), (1, {"app": "app.1.js"}))
+
+    def testPython(self):
+        self.set_setting("BUNDLE_VERSION_FILE", self.path("versions.py"))
+        self.write_file("BUNDLE_VERSIONS = {'app': 'app.1.js'}\n",
+                        "versions.py")
+        self.assertEqual(get_bundle_versions(), {"app": "app.1.js"})
+
+    def testMissing(self):
+        self.assertEqual(get_versions_snapshot(), (1, {}))
+
+    def testReadOnly(self):
+        self.write_file('{"app": "app.1.js"}')
+        versions = get_bundle_versions()
+        self.assertRaises(TypeError, versions.__setitem__, "app", "app.2.js")
+        self.assertRaises(TypeError, versions.__delitem__, "app")
+        for method in ("clear", "pop", "popitem", "setdefault", "update"):
+            self.assertRaises(TypeError, getattr(versions, method), "app")
+        self.assertEqual(versions, {"app": "app.1.js"})
+        # Copies are plain dicts.
+        copy = versions.copy()
+        copy["app"] = "app.2.js"
+        self.assertEqual(versions, {"app": "app.1.js"})
+
+
+class ReloadTest(VersionsTestCase):
+
+    def testReloadedOnNewMtime(self):
+        self.write_file('{"app": "app.1.js"}')
+        (generation, versions) = get_versions_snapshot()
+        self.assert_(get_versions_snapshot()[1] is versions)
+        self.write_file('{"app": "app.2.js"}')
+        self.assertEqual(get_versions_snapshot(),
+                         (generation + 1, {"app": "app.2.js"}))
+        self.write_file('{"app": "app.3.js"}')
+        self.assertEqual(get_versions_snapshot(),
+                         (generation + 2, {"app": "app.3.js"}))
+
+    def testSameMtimeNotReloaded(self):
+        self.write_file('{"app": "app.1.js"}')
+        snapshot = get_versions_snapshot()
+        self.write("versions.json", '{"app": "app.2.js"}')
+        os.utime(self.path("versions.json"), (self.mtime, self.mtime))
+        self.assert_(get_versions_snapshot() is snapshot)
+
+    def testInterval(self):
+        self.set_setting("BUNDLE_VERSION_RELOAD_INTERVAL", 60)
+        self.write_file('{"app": "app.1.js"}')
+        get_bundle_versions()
+        # This check finds nothing new and puts the next one off a minute.
+        get_bundle_versions()
+        self.write_file('{"app": "app.2.js"}')
+        self.assertEqual(get_bundle_versions(), {"app": "app.1.js"})
+        versioning._next_check = 0
+        self.assertEqual(get_bundle_versions(), {"app": "app.2.js"})
+
+    def testNoReload(self):
+        self.set_setting("BUNDLE_VERSION_RELOAD_INTERVAL", None)
+        self.write_file('{"app": "app.1.js"}')
+        get_bundle_versions()
+        self.write_file('{"app": "app.2.js"}')
+        self.assertEqual(get_bundle_versions(), {"app": "app.1.js"})
+
+    def testBrokenFileKeepsSnapshot(self):
+        self.write_file('{"app": "app.1.js"}')
+        snapshot = get_versions_snapshot()
+        # Caught half-written.
+        self.write_file('{"app": "app')
+        self.assert_(get_versions_snapshot() is snapshot)
+        os.remove(self.path("versions.json"))
+        self.assert_(get_versions_snapshot() is snapshot)
+        self.write_file('{"app": "app.2.js"}')
+        self.assertEqual(get_versions_snapshot(),
+                         (snapshot[0] + 1, {"app": "app.2.js"}))
+
+    def testBrokenPythonFileKeepsSnapshot(self):
+        self.set_setting("BUNDLE_VERSION_FILE", self.path("versions.py"))
+        self.write_file("BUNDLE_VERSIONS = {'app': 'app.1.js'}\n",
+                        "versions.py")
+        snapshot = get_versions_snapshot()
+        for content in ("BUNDLE_VERSIONS = {\n    'app': 'app",
+                        "BUNDLE_VER", ""):
+            self.write_file(content, "versions.py")
+            self.assert_(get_versions_snapshot() is snapshot, content)
+
+
+class WriteVersionsTest(VersionsTestCase):
+
+    def testMerged(self):
+        self.write_file('{"app": "app.1.js", "lib": "lib.1.js"}')
+        generation = get_versions_snapshot()[0]
+        write_versions({"app": "app.2.js", "new": "new.1.js"})
+        merged = {"app": "app.2.js", "lib": "lib.1.js", "new": "new.1.js"}
+        self.assertEqual(get_versions_snapshot(), (generation + 1, merged))
+        self.assertEqual(load_versions(self.path("versions.json")), merged)
+        self.assertFalse(os.path.exists(self.path("versions.json.tmp")))
+
+    def testPython(self):
+        self.set_setting("BUNDLE_VERSION_FILE", self.path("versions.py"))
+        write_versions({"app": "app.1.js"})
+        write_versions({"lib": "lib.1.js"})
+        self.assertEqual(load_versions(self.path("versions.py")),
+                         {"app": "app.1.js", "lib": "lib.1.js"})
+
+
+if __name__ == '__main__':
+    unittest.main()
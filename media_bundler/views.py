@@ -0,0 +1,51 @@
+# media_bundler/views.py
+
+"""
+A view that serves bundles, building them on demand.
+
+Include media_bundler.urls in your URLconf and set BUNDLE_SERVE_URL to where
+you included it, and bundles are linked to this view instead of their media
+directories.  See media_bundler.serving for how they are built and cached.
+"""
+
+import mimetypes
+
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+
+from media_bundler import serving
+
+
+def _etag_matches(request, etag):
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    etags = [value.strip() for value in header.split(",")]
+    return "*" in etags or etag in etags
+
+
+def serve_bundle(request, filename):
+    """Serve a bundle file, building the bundle if it isn't cached.
+
+    The ETag changes with the bundle's sources, so clients that revalidate get
+    a 304 without the bundle being built.
+    """
+    (bundle, unversioned) = serving.find_bundle(filename)
+    if bundle is None:
+        raise Http404("No bundle builds %s." % filename)
+    filename = unversioned
+    key = serving.get_build_key(bundle)
+    etag = serving.get_etag(key, filename)
+    if _etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        files = serving.get_files(bundle, key)
+        if filename not in files:
+            # A sprite sheet that the bundle doesn't have.
+            raise Http404("No bundle builds %s." % filename)
+        content_type = (mimetypes.guess_type(filename)[0] or
+                        "application/octet-stream")
+        response = HttpResponse(files[filename], content_type=content_type)
+    response["ETag"] = etag
+    # The URLs aren't versioned, so make browsers check for a new build.
+    response["Cache-Control"] = "no-cache"
+    return response
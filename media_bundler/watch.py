@@ -0,0 +1,139 @@
+# media_bundler/watch.py
+
+"""
+Watching bundle sources for changes.
+
+The watcher keeps an index from each source path to the bundles that list it,
+so a change only rebuilds those bundles and the bundles that depend on them.
+Sources that are generated by another bundle, like the css_file of a sprite
+bundle, aren't watched; the bundle that generates them is, and its dependents
+are rebuilt along with it.
+
+Changes are picked up with pyinotify if it is installed, and by polling the
+modification times and sizes of the sources otherwise.
+"""
+
+import os
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from media_bundler.build import _normpath, get_dependencies, get_dependents
+
+
+def get_source_index(bundles):
+    """Return a dict mapping each source path to the names of its bundles.
+
+    Paths generated by one of the bundles are left out.
+    """
+    generated = set(_normpath(path) for bundle in bundles
+                    for path in bundle.get_output_paths())
+    index = {}
+    for bundle in bundles:
+        for path in bundle.get_paths():
+            path = _normpath(path)
+            if path not in generated:
+                index.setdefault(path, set()).add(bundle.name)
+    return index
+
+
+def get_affected_bundles(bundles, index, paths):
+    """Return the names of the bundles to rebuild when paths change."""
+    names = set()
+    for path in paths:
+        names.update(index.get(path, ()))
+    return get_dependents(get_dependencies(bundles), names)
+
+
+def _get_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+class PollingWatcher(object):
+
+    """Notices changed files by comparing their mtimes and sizes."""
+
+    def __init__(self, paths):
+        self.signatures = dict((path, _get_signature(path)) for path in paths)
+
+    def wait(self, timeout):
+        """Wait timeout seconds and return the set of paths that changed."""
+        time.sleep(timeout)
+        changed = set()
+        for (path, signature) in self.signatures.iteritems():
+            new_signature = _get_signature(path)
+            if new_signature != signature:
+                self.signatures[path] = new_signature
+                changed.add(path)
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+
+    """Notices changed files through inotify.
+
+    The directories of the files are watched rather than the files, so that
+    editors that save by writing a new file and renaming it over the old one
+    are noticed too.
+    """
+
+    def __init__(self, paths):
+        self.paths = set(paths)
+        self.changed = set()
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.manager, self._handle_event)
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_DELETE | pyinotify.IN_ATTRIB)
+        for dir in set(os.path.dirname(path) for path in self.paths):
+            self.manager.add_watch(dir, mask)
+
+    def _handle_event(self, event):
+        if event.pathname in self.paths:
+            self.changed.add(event.pathname)
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds and return the set of changed paths."""
+        if self.notifier.check_events(int(timeout * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+        (changed, self.changed) = (self.changed, set())
+        return changed
+
+    def close(self):
+        self.notifier.stop()
+
+
+def make_watcher(paths, polling=False):
+    """Return an InotifyWatcher if pyinotify is available, or a poller."""
+    if pyinotify is None or polling:
+        return PollingWatcher(paths)
+    return InotifyWatcher(paths)
+
+
+def watch(watcher, callback, interval=1.0, debounce=0.2):
+    """Call callback with the set of changed paths whenever files change.
+
+    Changes are collected until none have been seen for debounce seconds, so
+    a burst of saves only calls callback once.  interval is how often a
+    polling watcher looks for changes.  This never returns.
+    """
+    while True:
+        changed = watcher.wait(interval)
+        if not changed:
+            continue
+        while True:
+            more = watcher.wait(debounce)
+            if not more:
+                break
+            changed.update(more)
+        callback(changed)
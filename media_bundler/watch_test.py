@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Tests for watching bundle sources."""
+
+import os
+import unittest
+
+from test_support import BundleTestCase
+
+from media_bundler.watch import (PollingWatcher, get_affected_bundles,
+                                 get_source_index, watch)
+
+
+class SourceIndexTest(BundleTestCase):
+
+    def setUp(self):
+        super(SourceIndexTest, self).setUp()
+        self.add_bundle(type="png-sprite", name="icons", files=["a.png"],
+                        css_file=self.path("icons.css"))
+        self.add_bundle(type="css", name="styles",
+                        files=["a.css", "icons.css"])
+        self.add_bundle(type="css", name="all", files=["styles.css", "b.css"])
+        self.add_bundle(type="javascript", name="scripts", files=["a.js"])
+        self.index = get_source_index(self.bundles.values())
+
+    def testGeneratedLeftOut(self):
+        self.assertEqual(self.index,
+                         {self.path("a.png"): set(["icons"]),
+                          self.path("a.css"): set(["styles"]),
+                          self.path("b.css"): set(["all"]),
+                          self.path("a.js"): set(["scripts"])})
+
+    def testDependentsAffected(self):
+        def affected(*filenames):
+            return get_affected_bundles(self.bundles.values(), self.index,
+                                        [self.path(f) for f in filenames])
+        self.assertEqual(affected("a.png"), set(["icons", "styles", "all"]))
+        self.assertEqual(affected("a.css"), set(["styles", "all"]))
+        self.assertEqual(affected("b.css", "a.js"), set(["all", "scripts"]))
+        self.assertEqual(affected("other.css"), set())
+
+
+class PollingWatcherTest(BundleTestCase):
+
+    def setUp(self):
+        super(PollingWatcherTest, self).setUp()
+        for filename in ("a.js", "b.js", "c.js"):
+            self.write(filename, "var a;")
+            self.set_mtime(filename, 1000000000)
+        self.watcher = PollingWatcher([self.path(f) for f in
+                                       ("a.js", "b.js", "c.js", "d.js")])
+
+    def set_mtime(self, filename, mtime):
+        os.utime(self.path(filename), (mtime, mtime))
+
+    def testChanges(self):
+        self.assertEqual(self.watcher.wait(0), set())
+        # a.js has a new size but the same mtime, b.js just a new mtime.
+        self.write("a.js", "var ab;")
+        self.set_mtime("a.js", 1000000000)
+        self.set_mtime("b.js", 1000000010)
+        os.remove(self.path("c.js"))
+        self.write("d.js", "var d;")
+        self.assertEqual(self.watcher.wait(0),
+                         set(self.path(f) for f in
+                             ("a.js", "b.js", "c.js", "d.js")))
+        self.assertEqual(self.watcher.wait(0), set())
+
+
+class StopWatching(Exception):
+    pass
+
+
+class ScriptedWatcher(object):
+
+    """Returns each set of changes in turn, then stops the watch."""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.timeouts = []
+
+    def wait(self, timeout):
+        self.timeouts.append(timeout)
+        if not self.changes:
+            raise StopWatching
+        return set(self.changes.pop(0))
+
+
+class DebounceTest(unittest.TestCase):
+
+    def testBurstMerged(self):
+        watcher = ScriptedWatcher([[], ["a"], ["b"], ["a", "c"], [], [],
+                                   ["d"], []])
+        calls = []
+        self.assertRaises(StopWatching, watch, watcher, calls.append,
+                          interval=1.0, debounce=0.2)
+        self.assertEqual(calls, [set(["a", "b", "c"]), set(["d"])])
+        self.assertEqual(watcher.timeouts,
+                         [1.0, 1.0, 0.2, 0.2, 0.2, 1.0, 1.0, 0.2, 1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()